@@ -10,6 +10,7 @@ import os
 import matplotlib.pyplot as plt
 from io import BytesIO
 import base64
+from fiscal_calendar import fiscal_calendar
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -463,9 +464,9 @@ class BiometricAI:
             # Generate predictions for each day
             forecast = []
             start_date = datetime.now().date() + timedelta(days=1)
+            forecast_range = fiscal_calendar.date_range(start_date, start_date + timedelta(days=days - 1))
             
-            for i in range(days):
-                forecast_date = start_date + timedelta(days=i)
+            for forecast_date in forecast_range.dates:
                 day_forecast = BiometricAI.predict_department_attendance(department_id, forecast_date)
                 
                 # Simplify the forecast data
@@ -523,8 +524,8 @@ class BiometricAI:
                 title = f"Department Attendance"
             
             # Filter by date range
-            end_date = datetime.now().date()
-            start_date = end_date - timedelta(days=days)
+            date_range = fiscal_calendar.trailing_range(days)
+            start_date, end_date = date_range.start_date, date_range.end_date
             query = query.filter(AttendanceRecord.date >= start_date, AttendanceRecord.date <= end_date)
             
             # Get records
@@ -774,8 +775,8 @@ class BiometricAI:
                 employee_ids = [e.id for e in employees]
                 
                 # Get recent attendance (last 30 days)
-                end_date = datetime.now().date()
-                start_date = end_date - timedelta(days=30)
+                date_range = fiscal_calendar.trailing_range(30)
+                start_date, end_date = date_range.start_date, date_range.end_date
                 
                 records = AttendanceRecord.query.filter(
                     AttendanceRecord.employee_id.in_(employee_ids),
@@ -0,0 +1,136 @@
+"""
+Post-sync attendance corrections.
+
+Data repair rules run here, in bulk and once, instead of while timesheets are
+rendered (timesheet generation is read-only). Each rule is a versioned
+set-based UPDATE over attendance records:
+
+- the sync applies every rule to the records it wrote, before committing them;
+- at startup, a rule whose version is newer than the one recorded in
+  SystemSettings is applied to every record, then its version is recorded.
+
+Changing what a rule does means bumping its version, so it runs once more over
+the whole history.
+"""
+
+import logging
+
+from sqlalchemy import exists, or_, update
+
+from models import AttendanceRecord, EmployeeException
+
+logger = logging.getLogger(__name__)
+
+# SystemSettings key prefix storing the applied version of each rule
+CORRECTION_SETTING_PREFIX = 'attendance_correction:'
+
+
+def correct_single_punch_day(filters):
+    """
+    May 10, 2025 records with a check-in but no check-out are credited 1 hour
+    without overtime (exception days, marked 'E' or with an EmployeeException
+    row, keep their credited hours).
+
+    Args:
+        filters: AttendanceRecord filters restricting the records to correct
+
+    Returns:
+        Number of records corrected
+    """
+    from database import db
+    from attendance_totals import SINGLE_PUNCH_DATE
+
+    result = db.session.execute(
+        update(AttendanceRecord)
+        .where(
+            AttendanceRecord.date == SINGLE_PUNCH_DATE,
+            AttendanceRecord.clock_in.isnot(None),
+            AttendanceRecord.clock_out.is_(None),
+            or_(AttendanceRecord.attendance_status.is_(None), AttendanceRecord.attendance_status != 'E'),
+            ~exists().where(
+                EmployeeException.employee_id == AttendanceRecord.employee_id,
+                EmployeeException.date == AttendanceRecord.date
+            ),
+            or_(AttendanceRecord.work_hours.is_(None), AttendanceRecord.work_hours != 1,
+                AttendanceRecord.overtime_hours.is_(None), AttendanceRecord.overtime_hours != 0),
+            *filters
+        )
+        .values(work_hours=1, overtime_hours=0)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
+
+
+# Correction rules: name -> (version, function(filters) returning the corrected count)
+CORRECTIONS = {
+    'single_punch_may_10': (2, correct_single_punch_day),
+}
+
+
+def apply_corrections(sync_id=None):
+    """
+    Apply every correction rule to the records written by a sync (or to all
+    records without a sync ID). The caller commits.
+
+    Args:
+        sync_id: Optional sync ID restricting the records to correct
+
+    Returns:
+        Dictionary {rule name: number of records corrected}
+    """
+    filters = [AttendanceRecord.sync_id == sync_id] if sync_id is not None else []
+
+    corrected = {}
+    for name, (version, correct) in CORRECTIONS.items():
+        corrected[name] = correct(filters)
+        if corrected[name]:
+            logger.info(f"Attendance correction {name} v{version} corrected {corrected[name]} records")
+    return corrected
+
+
+def apply_pending_corrections():
+    """
+    Apply, to every record, the rules whose version has not been applied yet
+    and record their versions. Commits, and drops cached timesheets when
+    records changed.
+
+    Returns:
+        Dictionary {rule name: number of records corrected} for the rules applied
+    """
+    from database import db
+    from models import SystemSettings
+    from settings_cache import settings_cache
+    from enhanced_cache_optimized import invalidate_timesheets
+
+    applied = {
+        setting.key[len(CORRECTION_SETTING_PREFIX):]: setting
+        for setting in SystemSettings.query.filter(SystemSettings.key.startswith(CORRECTION_SETTING_PREFIX))
+    }
+
+    corrected = {}
+    for name, (version, correct) in CORRECTIONS.items():
+        setting = applied.get(name)
+        try:
+            if setting is not None and int(setting.value or 0) >= version:
+                continue
+        except ValueError:
+            pass
+
+        corrected[name] = correct([])
+        logger.info(f"Applied attendance correction {name} v{version} to {corrected[name]} records")
+
+        if setting is None:
+            db.session.add(SystemSettings(
+                key=f"{CORRECTION_SETTING_PREFIX}{name}",
+                value=str(version),
+                description='Applied version of an attendance correction rule'
+            ))
+        else:
+            setting.value = str(version)
+
+    if corrected:
+        db.session.commit()
+        settings_cache.invalidate_system()
+        if any(corrected.values()):
+            invalidate_timesheets()
+    return corrected
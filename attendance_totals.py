@@ -0,0 +1,178 @@
+"""
+SQL-side attendance totals.
+
+Regular hours, overtime and per-status day counts are aggregated by the
+database in one GROUP BY query (over attendance records and exceptions)
+instead of walking every record in Python.
+The timesheet, /employee_performance and the department statistics all use
+aggregate_attendance_totals, so the three always agree.
+
+The rules are those of the timesheet:
+- a day's hours (work + overtime) count as regular up to 8, the rest is overtime
+- an exception day credits its hours_credited as regular hours instead of the
+  recorded hours (the latest exception wins when a day has several); records
+  already stored with status 'E' count their work hours as regular hours
+- the May 10, 2025 single-punch records count as 1 regular hour
+"""
+
+import logging
+from datetime import date
+
+from sqlalchemy import and_, case, func, literal, select, union_all
+
+logger = logging.getLogger(__name__)
+
+# Statuses counted separately (see AttendanceRecord.attendance_status)
+COUNTED_STATUSES = ('P', 'A', 'V', 'S', 'T', 'E')
+
+# Single-punch day whose records are credited 1 hour
+SINGLE_PUNCH_DATE = date(2025, 5, 10)
+
+# Standard working day; anything above is overtime
+REGULAR_DAY_HOURS = 8
+
+
+def empty_totals():
+    """Totals of an employee without any record in the range"""
+    totals = {
+        'regular_hours': 0,
+        'overtime_hours': 0,
+        'record_count': 0,
+        'exception_days': 0
+    }
+    for status in COUNTED_STATUSES:
+        totals[f'status_{status}'] = 0
+    return totals
+
+
+def _scope_filters(model, employee_ids, department_id, housing_id, active_only):
+    """Build the employee scope filters for a model with an employee_id column"""
+    from models import Employee
+
+    filters = []
+    if employee_ids is not None:
+        filters.append(model.employee_id.in_(employee_ids))
+    if department_id or housing_id or active_only:
+        scope = []
+        if department_id:
+            scope.append(Employee.department_id == int(department_id))
+        if housing_id:
+            scope.append(Employee.housing_id == int(housing_id))
+        if active_only:
+            scope.append(Employee.active == True)
+        filters.append(model.employee_id.in_(select(Employee.id).where(*scope)))
+    return filters
+
+
+def aggregate_attendance_totals(start_date, end_date, employee_ids=None, department_id=None,
+                                housing_id=None, active_only=False):
+    """
+    Aggregate attendance totals per employee for a date range and scope.
+
+    Args:
+        start_date: First date (inclusive)
+        end_date: Last date (inclusive)
+        employee_ids: Optional list of employee IDs to restrict to
+        department_id: Optional department ID to restrict to
+        housing_id: Optional housing ID to restrict to
+        active_only: Only include active employees
+
+    Returns:
+        Dictionary {employee_id: totals} where totals has regular_hours,
+        overtime_hours, record_count, exception_days and status_<X> day counts.
+        Employees without records or exceptions are absent (see empty_totals).
+    """
+    from models import AttendanceRecord, EmployeeException
+    from database import db
+
+    if employee_ids is not None and not employee_ids:
+        return {}
+
+    # Latest exception per employee and day; it replaces the recorded hours
+    latest_exception_ids = select(func.max(EmployeeException.id)).where(
+        EmployeeException.date >= start_date,
+        EmployeeException.date <= end_date,
+        *_scope_filters(EmployeeException, employee_ids, department_id, housing_id, active_only)
+    ).group_by(EmployeeException.employee_id, EmployeeException.date)
+
+    has_exception = select(EmployeeException.id).where(
+        EmployeeException.employee_id == AttendanceRecord.employee_id,
+        EmployeeException.date == AttendanceRecord.date
+    ).exists()
+
+    day_hours = func.coalesce(AttendanceRecord.work_hours, 0) + func.coalesce(AttendanceRecord.overtime_hours, 0)
+    single_punch = and_(
+        AttendanceRecord.date == SINGLE_PUNCH_DATE,
+        AttendanceRecord.clock_in.isnot(None),
+        AttendanceRecord.clock_out.is_(None)
+    )
+    stored_exception = AttendanceRecord.attendance_status == 'E'
+    regular_hours = case(
+        (stored_exception, func.coalesce(AttendanceRecord.work_hours, 0)),
+        (single_punch, 1),
+        (day_hours > REGULAR_DAY_HOURS, REGULAR_DAY_HOURS),
+        else_=day_hours
+    )
+    overtime_hours = case(
+        (stored_exception, 0),
+        (single_punch, 0),
+        (day_hours > REGULAR_DAY_HOURS, day_hours - REGULAR_DAY_HOURS),
+        else_=0
+    )
+
+    # One row per attendance record ...
+    record_rows = select(
+        AttendanceRecord.employee_id.label('employee_id'),
+        case((has_exception, 0), else_=regular_hours).label('regular_hours'),
+        case((has_exception, 0), else_=overtime_hours).label('overtime_hours'),
+        literal(1).label('records'),
+        literal(0).label('exceptions'),
+        *[case((AttendanceRecord.attendance_status == status, 1), else_=0).label(f'status_{status}')
+          for status in COUNTED_STATUSES]
+    ).where(
+        AttendanceRecord.date >= start_date,
+        AttendanceRecord.date <= end_date,
+        *_scope_filters(AttendanceRecord, employee_ids, department_id, housing_id, active_only)
+    )
+
+    # ... plus one row per exception day crediting its hours
+    exception_rows = select(
+        EmployeeException.employee_id.label('employee_id'),
+        func.coalesce(EmployeeException.hours_credited, 0).label('regular_hours'),
+        literal(0).label('overtime_hours'),
+        literal(0).label('records'),
+        literal(1).label('exceptions'),
+        *[literal(0).label(f'status_{status}') for status in COUNTED_STATUSES]
+    ).where(EmployeeException.id.in_(latest_exception_ids))
+
+    rows = union_all(record_rows, exception_rows).subquery()
+    query = db.session.query(
+        rows.c.employee_id,
+        func.sum(rows.c.regular_hours),
+        func.sum(rows.c.overtime_hours),
+        func.sum(rows.c.records),
+        func.sum(rows.c.exceptions),
+        *[func.sum(rows.c[f'status_{status}']) for status in COUNTED_STATUSES]
+    ).group_by(rows.c.employee_id)
+
+    totals = {}
+    for row in query:
+        employee_totals = empty_totals()
+        employee_totals['regular_hours'] = row[1] or 0
+        employee_totals['overtime_hours'] = row[2] or 0
+        employee_totals['record_count'] = row[3] or 0
+        employee_totals['exception_days'] = row[4] or 0
+        for status, count in zip(COUNTED_STATUSES, row[5:]):
+            employee_totals[f'status_{status}'] = count or 0
+        totals[row[0]] = employee_totals
+
+    return totals
+
+
+def combine_attendance_totals(totals):
+    """Sum per-employee totals (as returned by aggregate_attendance_totals) into one"""
+    combined = empty_totals()
+    for employee_totals in totals.values():
+        for key, value in employee_totals.items():
+            combined[key] += value
+    return combined
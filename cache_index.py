@@ -0,0 +1,227 @@
+"""
+On-disk index of the tiered cache's disk tier.
+
+A small SQLite table records every entry file (namespace, size, purge time,
+last access and hit count), so cache statistics and the eviction sweeper
+never have to scan the cache directories, and a second one the entries'
+tags, so invalidating a tag only reads the entries carrying it. A third
+table holds the generation of every invalidated tag, so each worker process
+can drop from its memory tier what another one invalidated, and a value
+computed before an invalidation is not stored after it. SQLite's locking
+makes it safe to share between the worker processes.
+
+Writes are recorded immediately; reads are only counted in memory and written
+in batches (flush), since the sweeper only needs approximate recency and
+frequency.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Pending accesses written to the index at once
+ACCESS_FLUSH_THRESHOLD = 100
+
+# Eviction orders: least recently used, or least frequently used (then least recently)
+EVICTION_ORDERS = {
+    'lru': 'accessed_at, hits',
+    'lfu': 'hits, accessed_at'
+}
+
+
+class DiskIndex:
+    """Index of the disk cache entries, kept in an SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+        self._lock = threading.RLock()
+        self._accesses = {}
+
+    def _connect(self):
+        """Connection of this process (reopened after a fork)"""
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'path TEXT PRIMARY KEY, namespace TEXT NOT NULL, size INTEGER NOT NULL, '
+                'purge_at REAL NOT NULL, accessed_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0'
+                ') WITHOUT ROWID'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, path TEXT NOT NULL, PRIMARY KEY (tag, path)) '
+                'WITHOUT ROWID'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS tags_path ON tags (path)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tag_generations (tag TEXT PRIMARY KEY, generation INTEGER NOT NULL) '
+                'WITHOUT ROWID'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS tag_generations_generation '
+                               'ON tag_generations (generation)')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            self._connect().execute(sql, parameters)
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connect().execute(sql, parameters).fetchall()
+
+    def record_write(self, namespace, path, size, purge_at, tags=()):
+        """Record a written entry and its tags (replacing any previous one at that path)"""
+        with self._lock:
+            self._accesses.pop(path, None)
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT OR REPLACE INTO entries (path, namespace, size, purge_at, accessed_at, hits) '
+                    'VALUES (?, ?, ?, ?, ?, 0)',
+                    (path, namespace, size, purge_at, time.time())
+                )
+                connection.execute('DELETE FROM tags WHERE path = ?', (path,))
+                connection.executemany('INSERT OR IGNORE INTO tags (tag, path) VALUES (?, ?)',
+                                       [(tag, path) for tag in tags])
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def record_access(self, path):
+        """Count a read of an entry (written to the index by flush)"""
+        with self._lock:
+            hits = self._accesses.get(path, (0, 0))[1]
+            self._accesses[path] = (time.time(), hits + 1)
+            pending = len(self._accesses)
+        if pending >= ACCESS_FLUSH_THRESHOLD:
+            self.flush()
+
+    def flush(self):
+        """Write the pending accesses to the index"""
+        with self._lock:
+            accesses, self._accesses = self._accesses, {}
+            if accesses:
+                self._connect().executemany(
+                    'UPDATE entries SET accessed_at = MAX(accessed_at, ?), hits = hits + ? WHERE path = ?',
+                    [(accessed_at, hits, path) for path, (accessed_at, hits) in accesses.items()]
+                )
+
+    def remove(self, paths):
+        """Forget entries"""
+        with self._lock:
+            for path in paths:
+                self._accesses.pop(path, None)
+            connection = self._connect()
+            connection.executemany('DELETE FROM entries WHERE path = ?', [(path,) for path in paths])
+            connection.executemany('DELETE FROM tags WHERE path = ?', [(path,) for path in paths])
+
+    def remove_namespace(self, namespace):
+        """Forget every entry of a namespace"""
+        with self._lock:
+            connection = self._connect()
+            connection.execute('DELETE FROM tags WHERE path IN (SELECT path FROM entries WHERE namespace = ?)',
+                               (namespace,))
+            connection.execute('DELETE FROM entries WHERE namespace = ?', (namespace,))
+
+    def usage(self, namespace=None):
+        """Number of entries and total bytes, of one namespace or of the whole disk tier"""
+        if namespace is None:
+            rows = self._query('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries')
+        else:
+            rows = self._query('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?',
+                               (namespace,))
+        return rows[0][0], rows[0][1]
+
+    def expired(self, now=None):
+        """(path, namespace, size) of the entries past their purge time"""
+        return self._query('SELECT path, namespace, size FROM entries WHERE purge_at <= ?', (now or time.time(),))
+
+    def victims(self, policy, limit):
+        """(path, namespace, size) of the first entries to evict under a policy ('lru' or 'lfu')"""
+        order = EVICTION_ORDERS[policy]
+        return self._query(f'SELECT path, namespace, size FROM entries ORDER BY {order} LIMIT ?', (limit,))
+
+    def tagged(self, tags, namespace=None):
+        """(path, namespace, size) of the entries carrying any of the tags, in one namespace or in all"""
+        tags = list(tags)
+        if not tags:
+            return []
+        placeholders = ', '.join('?' * len(tags))
+        sql = (f'SELECT DISTINCT entries.path, entries.namespace, entries.size FROM tags '
+               f'JOIN entries ON entries.path = tags.path WHERE tags.tag IN ({placeholders})')
+        if namespace is not None:
+            return self._query(sql + ' AND entries.namespace = ?', tags + [namespace])
+        return self._query(sql, tags)
+
+    def bump_tags(self, tags):
+        """
+        Give the tags a new generation, higher than every earlier one (before
+        dropping their entries, see TieredCache.invalidate).
+
+        Returns:
+            The new generation
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                generation = connection.execute(
+                    'SELECT COALESCE(MAX(generation), 0) + 1 FROM tag_generations'
+                ).fetchone()[0]
+                connection.executemany('INSERT OR REPLACE INTO tag_generations (tag, generation) VALUES (?, ?)',
+                                       [(tag, generation) for tag in tags])
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return generation
+
+    def generation(self, tags=None):
+        """Latest generation of any of the tags, or of all tags when None (0 when never invalidated)"""
+        if tags is None:
+            return self._query('SELECT COALESCE(MAX(generation), 0) FROM tag_generations')[0][0]
+        tags = list(tags)
+        if not tags:
+            return 0
+        placeholders = ', '.join('?' * len(tags))
+        return self._query(f'SELECT COALESCE(MAX(generation), 0) FROM tag_generations '
+                           f'WHERE tag IN ({placeholders})', tags)[0][0]
+
+    def invalidated_since(self, generation):
+        """(tag, generation) of the tags invalidated after a generation"""
+        return self._query('SELECT tag, generation FROM tag_generations WHERE generation > ?', (generation,))
+
+    def replace_namespace(self, namespace, entries, tags=()):
+        """
+        Replace a namespace's rows with (path, namespace, size, purge_at,
+        accessed_at) entries and their (tag, path) tags
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute('DELETE FROM tags WHERE path IN (SELECT path FROM entries WHERE namespace = ?)',
+                                   (namespace,))
+                connection.execute('DELETE FROM entries WHERE namespace = ?', (namespace,))
+                connection.executemany(
+                    'INSERT OR REPLACE INTO entries (path, namespace, size, purge_at, accessed_at, hits) '
+                    'VALUES (?, ?, ?, ?, ?, 0)',
+                    entries
+                )
+                connection.executemany('INSERT OR IGNORE INTO tags (tag, path) VALUES (?, ?)', tags)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
@@ -1,172 +1,31 @@
 """
 تحسين أداء تطبيق Housing Maintenance باستخدام التخزين المؤقت (Caching)
 Enhanced with disk caching and advanced functionality
+
+Every cache here is a namespace of the shared tiered cache (see tiered_cache).
 """
 
-import logging
+import os
 import time
-import pickle
+import bisect
+import logging
 import hashlib
-import os
-from functools import lru_cache, wraps
-from datetime import datetime, timedelta
+import threading
+from collections import namedtuple
+from functools import wraps
+
+from flask import g, has_app_context
+from sqlalchemy import event
+
+from models import EmployeeVacation, EmployeeTransfer
+from tiered_cache import cache, CACHE_DIR
 
 # إعداد التسجيل
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Create cache directory for persistent caching
-CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cache')
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-# Simple in-memory cache (dictionary)
-_MEMORY_CACHE = {}
-
-# DiskCache class that can be instantiated and used as an object
-class DiskCache:
-    """A class that provides disk-based caching functionality"""
-    
-    def __init__(self, cache_dir=CACHE_DIR, expire_seconds=3600):
-        """Initialize the disk cache
-        
-        Args:
-            cache_dir: Directory to store cache files
-            expire_seconds: Time in seconds before cache entries expire
-        """
-        self.cache_dir = cache_dir
-        self.expire_seconds = expire_seconds
-        os.makedirs(cache_dir, exist_ok=True)
-    
-    def _get_cache_file(self, key):
-        """Get the cache file path for a given key"""
-        # Ensure key is safe for file system
-        safe_key = hashlib.md5(str(key).encode()).hexdigest()
-        return os.path.join(self.cache_dir, f"{safe_key}.pkl")
-    
-    def get(self, key):
-        """Get a value from the cache
-        
-        Args:
-            key: The cache key
-            
-        Returns:
-            The cached value or None if not found or expired
-        """
-        cache_file = self._get_cache_file(key)
-        
-        if os.path.exists(cache_file):
-            try:
-                # Check if file is expired
-                file_mtime = os.path.getmtime(cache_file)
-                if time.time() - file_mtime < self.expire_seconds:
-                    with open(cache_file, 'rb') as f:
-                        result = pickle.load(f)
-                    logger.debug(f"Disk cache hit for {key}")
-                    return result
-                else:
-                    # Remove expired file
-                    try:
-                        os.remove(cache_file)
-                    except:
-                        pass
-            except Exception as e:
-                logger.error(f"Error reading cache file {cache_file}: {str(e)}")
-        
-        return None
-    
-    def set(self, key, value):
-        """Set a value in the cache
-        
-        Args:
-            key: The cache key
-            value: The value to cache
-            
-        Returns:
-            True if successful, False otherwise
-        """
-        cache_file = self._get_cache_file(key)
-        
-        try:
-            with open(cache_file, 'wb') as f:
-                pickle.dump(value, f)
-            logger.debug(f"Saved to disk cache: {key}")
-            return True
-        except Exception as e:
-            logger.error(f"Error saving to cache file {cache_file}: {str(e)}")
-            return False
-    
-    def clear(self, pattern=None):
-        """Clear cache entries
-        
-        Args:
-            pattern: Optional pattern to match cache keys
-            
-        Returns:
-            Number of entries cleared
-        """
-        try:
-            count = 0
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.pkl') and (not pattern or pattern in filename):
-                    try:
-                        os.remove(os.path.join(self.cache_dir, filename))
-                        count += 1
-                    except:
-                        pass
-            logger.info(f"Cleared {count} disk cache files")
-            return count
-        except Exception as e:
-            logger.error(f"Error clearing disk cache: {str(e)}")
-            return 0
-
-# Create a global instance of DiskCache for the timesheet
-disk_cache = DiskCache(expire_seconds=7200)  # 2 hours expiry
-
-# نموذج لإدارة ذاكرة التخزين المؤقت مع معرف المستخدم
-class TimedCache:
-    """
-    A simple cache that expires entries after a given timeout.
-    
-    Attributes:
-        timeout (int): Number of seconds before entries expire
-        cache (dict): In-memory cache storage 
-        timestamps (dict): Timestamps for each key to track expiration
-    """
-    
-    def __init__(self, timeout=3600):  # Default timeout of 1 hour
-        self.timeout = timeout
-        self.cache = {}
-        self.timestamps = {}
-        
-    def get(self, key):
-        """Get a value from the cache if it exists and is not expired."""
-        if key in self.cache:
-            # Check if entry is expired
-            if time.time() - self.timestamps[key] > self.timeout:
-                # Remove expired entry
-                del self.cache[key]
-                del self.timestamps[key]
-                return None
-            return self.cache[key]
-        return None
-    
-    def set(self, key, value):
-        """Set a value in the cache with current timestamp."""
-        self.cache[key] = value
-        self.timestamps[key] = time.time()
-        
-    def clear(self):
-        """Clear all cache entries."""
-        self.cache.clear()
-        self.timestamps.clear()
-        
-    def clear_expired(self):
-        """Clear only expired entries."""
-        now = time.time()
-        expired_keys = [k for k, t in self.timestamps.items() if now - t > self.timeout]
-        for key in expired_keys:
-            del self.cache[key]
-            del self.timestamps[key]
+# General purpose disk cache (2 hours), a namespace of the shared tiered cache
+disk_cache = cache.namespace('general', ttl=7200, disk=True)
 
 def generate_cache_key(*args, **kwargs):
     """Generate a cache key from arguments"""
@@ -179,133 +38,110 @@ def generate_cache_key(*args, **kwargs):
     return hashlib.md5(key_str.encode('utf-8')).hexdigest()
 
 def memoize(expire_seconds=300):
-    """In-memory cache decorator with expiry"""
+    """In-memory cache decorator with expiry (one namespace per decorated function)"""
     def decorator(func):
+        namespace = cache.namespace(f"memoize:{func.__module__}.{func.__name__}", ttl=expire_seconds)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Generate cache key based on function name and arguments
-            cache_key = f"{func.__module__}.{func.__name__}:{generate_cache_key(*args, **kwargs)}"
-            
-            # Check if we have a valid cached value
-            if cache_key in _MEMORY_CACHE:
-                timestamp, result = _MEMORY_CACHE[cache_key]
-                if timestamp + expire_seconds > time.time():
-                    logger.debug(f"Cache hit for {cache_key}")
-                    return result
+            cache_key = generate_cache_key(*args, **kwargs)
             
-            # If not cached or expired, execute the function
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            execution_time = time.time() - start_time
+            # If not cached or expired, execute the function (once for concurrent callers)
+            def compute():
+                start_time = time.time()
+                result = func(*args, **kwargs)
+                logger.info(f"Cached result for {func.__name__} (took {time.time() - start_time:.2f}s)")
+                return result
             
-            _MEMORY_CACHE[cache_key] = (time.time(), result)
-            logger.info(f"Cached result for {func.__name__} (took {execution_time:.2f}s)")
-            return result
+            return namespace.get_or_compute(cache_key, compute, should_cache=lambda result: result is not None)
             
         return wrapper
     return decorator
 
 def disk_cache_decorator(expire_seconds=3600, force_refresh=False):
-    """Persistent disk cache decorator with expiry"""
+    """Persistent disk cache decorator with expiry (one namespace per decorated function)"""
     def decorator(func):
+        name = f"{func.__module__}.{func.__name__}"
+        namespace = cache.namespace(f"disk:{name}", ttl=expire_seconds, disk=True,
+                                    directory=os.path.join('functions', name))
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             # Extract force refresh parameter if present
             local_force_refresh = kwargs.pop('force_refresh', force_refresh)
             
-            # Generate a unique cache key based on function name and arguments
-            cache_key = f"{func.__module__}.{func.__name__}:{generate_cache_key(*args, **kwargs)}"
-            safe_key = hashlib.md5(cache_key.encode()).hexdigest()
-            cache_file = os.path.join(CACHE_DIR, f"{safe_key}.pkl")
+            cache_key = generate_cache_key(*args, **kwargs)
             
-            # Check if requested to ignore cache or cache doesn't exist
-            if not local_force_refresh:
-                # Try to load from cache if file exists and is not expired
-                try:
-                    if os.path.exists(cache_file):
-                        file_mtime = os.path.getmtime(cache_file)
-                        if time.time() - file_mtime < expire_seconds:
-                            with open(cache_file, 'rb') as f:
-                                result = pickle.load(f)
-                            logger.debug(f"Disk cache hit for {func.__name__}")
-                            return result
-                except Exception as e:
-                    logger.warning(f"Error reading cache file {cache_file}: {str(e)}")
+            # Execute the function (once for concurrent callers) and save the result to cache
+            def compute():
+                start_time = time.time()
+                result = func(*args, **kwargs)
+                logger.info(f"Cached {func.__name__} to disk (took {time.time() - start_time:.2f}s)")
+                return result
             
-            # Execute the function
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            execution_time = time.time() - start_time
+            # Check if requested to ignore cache
+            if local_force_refresh:
+                result = compute()
+                namespace.set(cache_key, result)
+                return result
             
-            # Save result to cache file
-            try:
-                with open(cache_file, 'wb') as f:
-                    pickle.dump(result, f)
-                logger.info(f"Cached {func.__name__} to disk (took {execution_time:.2f}s)")
-            except Exception as e:
-                logger.error(f"Error saving to cache file {cache_file}: {str(e)}")
-            
-            return result
+            return namespace.get_or_compute(cache_key, compute, should_cache=lambda result: result is not None)
             
         return wrapper
     return decorator
 
-def clear_cache(pattern=None):
-    """Clear all cache entries or those matching the pattern"""
-    # Clear in-memory cache
-    if pattern:
-        keys_to_remove = [k for k in _MEMORY_CACHE if pattern in k]
-        for k in keys_to_remove:
-            del _MEMORY_CACHE[k]
-        logger.info(f"Cleared {len(keys_to_remove)} memory cache entries matching {pattern}")
-    else:
-        count = len(_MEMORY_CACHE)
-        _MEMORY_CACHE.clear()
-        logger.info(f"Cleared all {count} memory cache entries")
-    
-    # Clear disk cache
-    try:
-        cache_files = [f for f in os.listdir(CACHE_DIR) if f.endswith('.pkl')]
-        removed = 0
-        
-        for cache_file in cache_files:
-            if not pattern or pattern in cache_file:
-                try:
-                    os.remove(os.path.join(CACHE_DIR, cache_file))
-                    removed += 1
-                except Exception as e:
-                    logger.error(f"Error removing cache file {cache_file}: {str(e)}")
-        
-        logger.info(f"Cleared {removed} disk cache files")
-    except Exception as e:
-        logger.error(f"Error accessing cache directory: {str(e)}")
+def clear_cache():
+    """
+    Clear every cache entry, in memory and on disk, in every worker (see
+    TieredCache.clear); to drop only some entries, invalidate their tags
+    """
+    removed = cache.clear()
+    logger.info(f"Cleared cache entries ({removed} disk cache files)")
+    return removed
 
 def get_cache_stats():
-    """Get statistics about the cache"""
-    memory_cache_count = len(_MEMORY_CACHE)
-    
-    try:
-        disk_cache_count = len([f for f in os.listdir(CACHE_DIR) if f.endswith('.pkl')])
-        disk_cache_size = sum(os.path.getsize(os.path.join(CACHE_DIR, f)) for f in os.listdir(CACHE_DIR) if f.endswith('.pkl'))
-    except:
-        disk_cache_count = 0
-        disk_cache_size = 0
-    
-    return {
-        'memory_cache_entries': memory_cache_count,
-        'disk_cache_entries': disk_cache_count, 
-        'disk_cache_size_mb': round(disk_cache_size / (1024 * 1024), 2)
-    }
+    """Get statistics about the cache (see TieredCache.stats)"""
+    stats = cache.stats()
+    namespaces = stats['namespaces'].values()
+    return dict(
+        stats,
+        memory_cache_entries=stats['memory_items'],
+        disk_cache_entries=sum(namespace['disk_items'] for namespace in namespaces),
+        disk_cache_size_mb=round(sum(namespace['disk_bytes'] for namespace in namespaces) / (1024 * 1024), 2)
+    )
+
+def reset_cache_stats():
+    """Zero the counters and metrics of every namespace (to measure from now on)"""
+    cache.reset_stats()
+    logger.info("Reset cache statistics")
 
 # تخزين مؤقت للبيانات المستخدمة بشكل متكرر
-housing_cache = TimedCache(timeout=1800)  # 30 دقيقة
-department_cache = TimedCache(timeout=1800)  # 30 دقيقة
+housing_cache = cache.namespace('housing', ttl=1800)  # 30 دقيقة
+department_cache = cache.namespace('departments', ttl=1800)  # 30 دقيقة
+
+# تخزين مؤقت لبيانات الاجازات والتنقلات: all of an employee's leave periods,
+# so any date range is answered from memory (5 دقائق, and dropped as soon as
+# this process writes the employee's vacations or transfers, or sees in the
+# change log that another worker did)
+leave_cache = cache.namespace('leave_periods', ttl=300)
+
+# Last change log entry applied to leave_cache (see _sync_leave_cache)
+_leave_change_id = None
+_leave_lock = threading.Lock()
 
-# تخزين مؤقت لبيانات الاجازات والتنقلات
-vacation_cache = TimedCache(timeout=300)  # 5 دقائق
-transfer_cache = TimedCache(timeout=300)  # 5 دقائق
+# More logged changes than this since the last check drop every cached period
+LEAVE_SYNC_MAX_CHANGES = 1000
+
+# Employee IDs per query when loading the leave periods of many employees
+LEAVE_LOAD_CHUNK_SIZE = 500
+
+# Leave periods as cached (plain values, no ORM objects)
+VacationPeriod = namedtuple('VacationPeriod', ['id', 'employee_id', 'start_date', 'end_date'])
+TransferPeriod = namedtuple('TransferPeriod', [
+    'id', 'employee_id', 'start_date', 'end_date', 'from_department_id', 'to_department_id',
+    'from_housing_id', 'to_housing_id'
+])
 
-@lru_cache(maxsize=32)  # تخزين مؤقت لحد 32 استدعاء للدالة
 def get_housing_by_id(housing_id):
     """
     Get housing by ID with caching
@@ -315,7 +151,7 @@ def get_housing_by_id(housing_id):
     # Check cache first
     cache_key = f"housing_{housing_id}"
     cached_housing = housing_cache.get(cache_key)
-    if cached_housing:
+    if cached_housing is not None:
         return cached_housing
     
     # If not in cache, get from database and cache
@@ -323,7 +159,6 @@ def get_housing_by_id(housing_id):
     housing_cache.set(cache_key, housing)
     return housing
 
-@lru_cache(maxsize=32)
 def get_department_by_id(dept_id):
     """
     Get department by ID with caching
@@ -333,7 +168,7 @@ def get_department_by_id(dept_id):
     # Check cache first
     cache_key = f"dept_{dept_id}"
     cached_dept = department_cache.get(cache_key)
-    if cached_dept:
+    if cached_dept is not None:
         return cached_dept
     
     # If not in cache, get from database and cache
@@ -341,82 +176,256 @@ def get_department_by_id(dept_id):
     department_cache.set(cache_key, dept)
     return dept
 
+class EmployeeLeave:
+    """One employee's vacation and transfer periods, sorted by start date"""
+
+    __slots__ = ('vacations', 'transfers', '_vacation_starts', '_transfer_starts')
+
+    def __init__(self, vacations, transfers):
+        self.vacations = tuple(sorted(vacations, key=lambda period: (period.start_date, period.id)))
+        self.transfers = tuple(sorted(transfers, key=lambda period: (period.start_date, period.id)))
+        self._vacation_starts = [period.start_date for period in self.vacations]
+        self._transfer_starts = [period.start_date for period in self.transfers]
+
+    @staticmethod
+    def _overlapping(periods, starts, start_date, end_date):
+        # Only the periods starting by end_date can overlap; keep those ending from start_date
+        candidates = periods[:bisect.bisect_right(starts, end_date)]
+        return [period for period in candidates if period.end_date >= start_date]
+
+    def vacations_between(self, start_date, end_date):
+        """Vacations overlapping a date range (inclusive)"""
+        return self._overlapping(self.vacations, self._vacation_starts, start_date, end_date)
+
+    def transfers_between(self, start_date, end_date):
+        """Transfers overlapping a date range (inclusive)"""
+        return self._overlapping(self.transfers, self._transfer_starts, start_date, end_date)
+
+
+def _sync_leave_cache():
+    """
+    Drop the cached leave periods of the employees whose leave was changed by
+    another worker, as logged in the shared change log (see data_versions).
+    Checked once per application context.
+
+    Returns:
+        The change id the cached periods are valid for, or None outside an
+        application context
+    """
+    global _leave_change_id
+
+    if not has_app_context():
+        return None
+    change_id = g.get('leave_change_id')
+    if change_id is not None:
+        return change_id
+
+    from database import db
+    from models import DataVersion
+    from data_versions import current_change_id
+
+    with _leave_lock:
+        last_seen = _leave_change_id
+    if last_seen is None:
+        # Nothing cached yet was checked against the log
+        leave_cache.clear()
+        change_id = current_change_id()
+    else:
+        changes = db.session.query(DataVersion.id, DataVersion.kind, DataVersion.employee_id).filter(
+            DataVersion.id > last_seen
+        ).order_by(DataVersion.id).limit(LEAVE_SYNC_MAX_CHANGES + 1).all()
+        if len(changes) > LEAVE_SYNC_MAX_CHANGES:
+            leave_cache.clear()
+            change_id = current_change_id()
+        else:
+            change_id = changes[-1].id if changes else last_seen
+            for change in changes:
+                if change.kind == 'reset' or (change.kind == 'leave' and change.employee_id is None):
+                    leave_cache.clear()
+                elif change.kind == 'leave':
+                    invalidate_employee_leave(change.employee_id)
+
+    with _leave_lock:
+        if _leave_change_id is None or change_id > _leave_change_id:
+            _leave_change_id = change_id
+    g.leave_change_id = change_id
+    return change_id
+
+def _load_employee_leaves(employee_ids=None):
+    """
+    Load the vacation and transfer periods of employees in two queries (per
+    chunk of LEAVE_LOAD_CHUNK_SIZE employees).
+
+    Args:
+        employee_ids: Employee IDs, or None for every employee
+
+    Returns:
+        Dictionary {employee_id: EmployeeLeave}; every requested employee is
+        present (employees without periods get an empty EmployeeLeave)
+    """
+    from database import db
+
+    if employee_ids is None:
+        chunks = [None]
+    else:
+        employee_ids = list(employee_ids)
+        chunks = [employee_ids[i:i + LEAVE_LOAD_CHUNK_SIZE]
+                  for i in range(0, len(employee_ids), LEAVE_LOAD_CHUNK_SIZE)]
+
+    vacations = {employee_id: [] for employee_id in employee_ids or ()}
+    transfers = {employee_id: [] for employee_id in employee_ids or ()}
+    for chunk in chunks:
+        vacation_query = db.session.query(
+            EmployeeVacation.id, EmployeeVacation.employee_id, EmployeeVacation.start_date, EmployeeVacation.end_date
+        )
+        transfer_query = db.session.query(
+            EmployeeTransfer.id, EmployeeTransfer.employee_id, EmployeeTransfer.start_date, EmployeeTransfer.end_date,
+            EmployeeTransfer.from_department_id, EmployeeTransfer.to_department_id,
+            EmployeeTransfer.from_housing_id, EmployeeTransfer.to_housing_id
+        )
+        if chunk is not None:
+            vacation_query = vacation_query.filter(EmployeeVacation.employee_id.in_(chunk))
+            transfer_query = transfer_query.filter(EmployeeTransfer.employee_id.in_(chunk))
+        for row in vacation_query:
+            vacations.setdefault(row.employee_id, []).append(VacationPeriod(*row))
+        for row in transfer_query:
+            transfers.setdefault(row.employee_id, []).append(TransferPeriod(*row))
+
+    return {employee_id: EmployeeLeave(vacations.get(employee_id, ()), transfers.get(employee_id, ()))
+            for employee_id in set(vacations) | set(transfers)}
+
+def get_employee_leave(employee_id):
+    """
+    Get all of an employee's vacation and transfer periods, loading them in
+    two queries on a miss.
+
+    Returns:
+        EmployeeLeave
+    """
+    change_id = _sync_leave_cache()
+    return leave_cache.get_or_compute(
+        _leave_key(employee_id), lambda: _load_employee_leaves([employee_id])[employee_id],
+        # Periods read before a newer change was seen are not kept
+        should_cache=lambda leave: change_id == _leave_change_id
+    )
+
+def get_employee_leaves(employee_ids=None):
+    """
+    Get the vacation and transfer periods of many employees, from the cache,
+    loading all the missing ones in two queries.
+
+    Args:
+        employee_ids: Employee IDs, or None for every employee (always loaded,
+                      then cached for the employees with periods)
+
+    Returns:
+        Dictionary {employee_id: EmployeeLeave} (for employee_ids=None, only
+        the employees with periods)
+    """
+    change_id = _sync_leave_cache()
+
+    leaves = {}
+    missing = None
+    if employee_ids is not None:
+        missing = []
+        for employee_id in employee_ids:
+            leave = leave_cache.get(_leave_key(employee_id))
+            if leave is None:
+                missing.append(employee_id)
+            else:
+                leaves[employee_id] = leave
+        if not missing:
+            return leaves
+
+    loaded = _load_employee_leaves(missing)
+    # Periods read before a newer change was seen are not kept
+    if change_id == _leave_change_id:
+        for employee_id, leave in loaded.items():
+            leave_cache.set(_leave_key(employee_id), leave)
+    leaves.update(loaded)
+    return leaves
+
+def _leave_key(employee_id):
+    return f"leave_{int(employee_id)}"
+
+def clear_leave_cache():
+    """Drop every cached leave period; the next lookup checks the change log afresh"""
+    global _leave_change_id
+
+    with _leave_lock:
+        leave_cache.clear()
+        _leave_change_id = None
+
+def invalidate_employee_leave(*employee_ids):
+    """Drop the cached leave periods of employees (after their vacations or transfers changed)"""
+    for employee_id in employee_ids:
+        if employee_id:
+            leave_cache.delete(_leave_key(employee_id))
+
+@event.listens_for(EmployeeVacation, 'after_insert')
+@event.listens_for(EmployeeVacation, 'after_update')
+@event.listens_for(EmployeeVacation, 'after_delete')
+@event.listens_for(EmployeeTransfer, 'after_insert')
+@event.listens_for(EmployeeTransfer, 'after_update')
+@event.listens_for(EmployeeTransfer, 'after_delete')
+def _leave_changed(mapper, connection, target):
+    invalidate_employee_leave(target.employee_id)
+
+@event.listens_for(EmployeeVacation.employee_id, 'set', active_history=True)
+@event.listens_for(EmployeeTransfer.employee_id, 'set', active_history=True)
+def _leave_moved(target, value, oldvalue, initiator):
+    # A period moved to another employee leaves the previous one's periods too
+    if isinstance(oldvalue, int):
+        invalidate_employee_leave(oldvalue)
+
 def get_employee_vacations(employee_id, start_date, end_date):
     """
-    Get employee vacations with caching
+    Get employee vacations overlapping a date range, from the cached leave
+    periods (see get_employee_leave)
+
+    Returns:
+        List of VacationPeriod (id, employee_id, start_date, end_date)
     """
-    from models import EmployeeVacation
-    
-    # Create cache key based on parameters
-    cache_key = f"vacation_{employee_id}_{start_date}_{end_date}"
-    
-    # Check cache first
-    cached_vacations = vacation_cache.get(cache_key)
-    if cached_vacations:
-        return cached_vacations
-    
-    # If not in cache, get from database and cache
-    vacations = EmployeeVacation.query.filter(
-        EmployeeVacation.employee_id == employee_id,
-        EmployeeVacation.start_date <= end_date,
-        EmployeeVacation.end_date >= start_date
-    ).all()
-    
-    vacation_cache.set(cache_key, vacations)
-    return vacations
+    return get_employee_leave(employee_id).vacations_between(start_date, end_date)
 
 def get_employee_transfers(employee_id, start_date, end_date):
     """
-    Get employee transfers with caching
+    Get employee transfers overlapping a date range, from the cached leave
+    periods (see get_employee_leave)
+
+    Returns:
+        List of TransferPeriod (id, employee_id, start_date, end_date and the
+        from/to department and housing IDs)
     """
-    from models import EmployeeTransfer
-    
-    # Create cache key based on parameters
-    cache_key = f"transfer_{employee_id}_{start_date}_{end_date}"
-    
-    # Check cache first
-    cached_transfers = transfer_cache.get(cache_key)
-    if cached_transfers:
-        return cached_transfers
-    
-    # If not in cache, get from database and cache
-    transfers = EmployeeTransfer.query.filter(
-        EmployeeTransfer.employee_id == employee_id,
-        EmployeeTransfer.start_date <= end_date,
-        EmployeeTransfer.end_date >= start_date
-    ).all()
-    
-    transfer_cache.set(cache_key, transfers)
-    return transfers
+    return get_employee_leave(employee_id).transfers_between(start_date, end_date)
 
 # Function to clear all caches
 def clear_all_caches():
     """Clear all application caches"""
     housing_cache.clear()
     department_cache.clear()
-    vacation_cache.clear()
-    transfer_cache.clear()
-    
-    # Also clear LRU caches
-    get_housing_by_id.cache_clear()
-    get_department_by_id.cache_clear()
+    clear_leave_cache()
     
     logger.info("تم مسح جميع ذاكرة التخزين المؤقت")
 
-# Function to periodically clear expired entries
+# Function to periodically clear expired entries (run by the scheduler)
 def clear_expired_cache_entries():
-    """Clear expired cache entries"""
-    housing_cache.clear_expired()
-    department_cache.clear_expired()
-    vacation_cache.clear_expired()
-    transfer_cache.clear_expired()
-    
-    logger.info("تم مسح مدخلات التخزين المؤقت المنتهية الصلاحية")
+    """
+    Clear expired cache entries: in memory, then on disk, where the sweep also
+    evicts entries to keep the disk tier within its budget
+    """
+    try:
+        for namespace in cache.namespaces().values():
+            namespace.clear_expired()
+        cache.sweep()
+        logger.info("تم مسح مدخلات التخزين المؤقت المنتهية الصلاحية")
+    except Exception as e:
+        logger.error(f"Error clearing expired cache entries: {str(e)}")
 
-# Initialize cache
-if not os.path.exists(CACHE_DIR):
+def reindex_disk_cache():
+    """Rebuild the disk cache index from the cache files (run at startup and daily)"""
     try:
-        os.makedirs(CACHE_DIR)
-        logger.info(f"Created cache directory: {CACHE_DIR}")
+        indexed = cache.reindex()
+        logger.info(f"Indexed {indexed} disk cache entries")
     except Exception as e:
-        logger.error(f"Failed to create cache directory {CACHE_DIR}: {str(e)}")
+        logger.error(f"Error indexing disk cache: {str(e)}")
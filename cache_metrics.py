@@ -0,0 +1,131 @@
+"""
+Metrics of the tiered cache namespaces.
+
+Every namespace (see tiered_cache) keeps a CacheMetrics next to its hit and
+miss counters:
+
+- latency: how long memory hits, disk hits and the computations run on a
+  miss take, over a rolling window of the last LATENCY_WINDOW samples of
+  each, reported as percentiles;
+- serialized size: the size of the values stored by disk and copy_on_read
+  namespaces;
+- churn: the keys missed most often, i.e. computed again and again because
+  they expire, are evicted or are invalidated.
+
+Metrics are kept per worker process, like the memory tier.
+"""
+
+import threading
+from collections import Counter, deque
+
+# Samples kept per latency window
+LATENCY_WINDOW = 1024
+
+# Percentiles reported for each latency window
+PERCENTILES = (50, 95, 99)
+
+# Distinct keys whose misses are counted (the least missed are forgotten past it)
+CHURN_KEYS = 256
+
+# Most missed keys reported by summary()
+TOP_CHURN_KEYS = 5
+
+# Longest key reported (keys can be long argument lists)
+MAX_KEY_LENGTH = 120
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of sorted samples"""
+    if not samples:
+        return None
+    rank = max(1, -(-len(samples) * percent // 100))
+    return samples[min(rank, len(samples)) - 1]
+
+
+class LatencyWindow:
+    """Durations of the last LATENCY_WINDOW operations of one kind, and totals of all of them"""
+
+    __slots__ = ('samples', 'count', 'total')
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        """Count, average and window percentiles, in milliseconds"""
+        samples = sorted(self.samples)
+        summary = {'count': self.count, 'avg_ms': round(self.total / self.count * 1000, 3) if self.count else None}
+        for percent in PERCENTILES:
+            value = percentile(samples, percent)
+            summary[f'p{percent}_ms'] = round(value * 1000, 3) if value is not None else None
+        summary['max_ms'] = round(samples[-1] * 1000, 3) if samples else None
+        return summary
+
+
+class CacheMetrics:
+    """Latency windows, serialized sizes and missed keys of one namespace"""
+
+    LATENCIES = ('memory_hit', 'disk_hit', 'compute')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {kind: LatencyWindow() for kind in self.LATENCIES}
+        self.serialized_count = 0
+        self.serialized_total = 0
+        self.serialized_max = 0
+        self.missed_keys = Counter()
+
+    def record_latency(self, kind, seconds):
+        """Record the duration of a memory hit, a disk hit or a computation"""
+        with self._lock:
+            self.latency[kind].add(seconds)
+
+    def record_size(self, size):
+        """Record the serialized size of a stored value"""
+        with self._lock:
+            self.serialized_count += 1
+            self.serialized_total += size
+            self.serialized_max = max(self.serialized_max, size)
+
+    def record_miss(self, key):
+        """Count a miss of a key"""
+        key = str(key)[:MAX_KEY_LENGTH]
+        with self._lock:
+            self.missed_keys[key] += 1
+            if len(self.missed_keys) > CHURN_KEYS * 2:
+                # Keep the most missed half so the counter stays bounded
+                self.missed_keys = Counter(dict(self.missed_keys.most_common(CHURN_KEYS)))
+
+    def reset(self):
+        """Forget every sample"""
+        with self._lock:
+            self.latency = {kind: LatencyWindow() for kind in self.LATENCIES}
+            self.serialized_count = self.serialized_total = self.serialized_max = 0
+            self.missed_keys = Counter()
+
+    def summary(self):
+        """
+        Metrics as plain values.
+
+        Returns:
+            Dictionary with latency ({kind: LatencyWindow.summary()}),
+            serialized (count, avg_bytes, max_bytes, total_bytes) and
+            top_missed_keys ([[key, misses], ...])
+        """
+        with self._lock:
+            return {
+                'latency': {kind: window.summary() for kind, window in self.latency.items()},
+                'serialized': {
+                    'count': self.serialized_count,
+                    'avg_bytes': self.serialized_total // self.serialized_count if self.serialized_count else None,
+                    'max_bytes': self.serialized_max,
+                    'total_bytes': self.serialized_total
+                },
+                'top_missed_keys': [[key, misses] for key, misses in self.missed_keys.most_common(TOP_CHURN_KEYS)]
+            }
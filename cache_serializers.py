@@ -0,0 +1,222 @@
+"""
+Serializers of the tiered cache.
+
+A namespace turns its values into bytes with a serializer, for the disk tier
+and for the copy_on_read memory tier (see tiered_cache). Every serializer has
+a one-byte code, written in the header of each disk entry, so an entry is
+always read back with the serializer that wrote it:
+
+- pickle (code 0): the value pickled as is, the default;
+- timesheet (code 1): a columnar, zlib-compressed format for the timesheet
+  dictionaries built by optimized_timesheet.assemble_timesheet. Rows are
+  stored field by field, each distinct TimesheetDays once (primary and
+  secondary rows share them), the records field by field and the housing
+  groups as row numbers, so the repeated values sit next to each other and
+  compress well. Other values are stored as compressed pickles. Frozen
+  timesheets (see timesheet_rows.freeze_timesheet) are stored the same way;
+  the serializer also freezes and sizes timesheets for the frozen memory tier.
+"""
+
+import zlib
+import pickle
+from array import array
+
+from timesheet_rows import (
+    TimesheetDays, TimesheetRecord, TimesheetRow, FrozenTimesheetDays, FrozenTimesheetRecord, FrozenTimesheetRow,
+    freeze_timesheet, timesheet_memory_size
+)
+
+# zlib level of the compressed formats (6 is zlib's default: about as fast to
+# decompress as 1, and noticeably smaller)
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Payload kinds of the timesheet format (first byte of the payload)
+_COMPRESSED_PICKLE = 0
+_COLUMNAR_TIMESHEET = 1
+
+# Row fields stored as columns (the days are stored separately)
+_ROW_COLUMNS = tuple(name for name in TimesheetRow.fields if name != 'attendance')
+_ATTENDANCE_POSITION = TimesheetRow.fields.index('attendance')
+
+# Row, days and record types stored as columns (mutable or frozen)
+_ROW_TYPES = (TimesheetRow, FrozenTimesheetRow)
+_DAYS_TYPES = (TimesheetDays, FrozenTimesheetDays)
+_RECORD_TYPES = (TimesheetRecord, FrozenTimesheetRecord)
+
+
+class PickleSerializer:
+    """Plain pickle (the default serializer)"""
+
+    name = 'pickle'
+    code = 0
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class TimesheetSerializer:
+    """Columnar, compressed timesheets; any other value as a compressed pickle"""
+
+    name = 'timesheet'
+    code = 1
+
+    def __init__(self, level=DEFAULT_COMPRESSION_LEVEL):
+        self.level = level
+
+    def dumps(self, value):
+        columns = self._columns(value)
+        if columns is None:
+            kind, payload = _COMPRESSED_PICKLE, value
+        else:
+            kind, payload = _COLUMNAR_TIMESHEET, columns
+        return bytes((kind,)) + zlib.compress(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL), self.level)
+
+    def loads(self, data):
+        payload = pickle.loads(zlib.decompress(data[1:]))
+        if data[0] == _COLUMNAR_TIMESHEET:
+            return self._timesheet(payload)
+        return payload
+
+    def freeze(self, value):
+        """Read-only version of a value for the frozen memory tier (see freeze_timesheet)"""
+        return freeze_timesheet(value)
+
+    def memory_size(self, value):
+        """Approximate memory size of a value held by the frozen memory tier"""
+        return timesheet_memory_size(value)
+
+    def _columns(self, timesheet):
+        """
+        Columnar form of a timesheet dictionary.
+
+        Returns:
+            Tuple of the columns, or None when the value is not a timesheet
+            made of TimesheetRow, TimesheetDays and TimesheetRecord objects
+        """
+        if not isinstance(timesheet, dict):
+            return None
+        rows = timesheet.get('employees')
+        groups = timesheet.get('housing_groups')
+        if not isinstance(rows, (list, tuple)) or not isinstance(groups, dict):
+            return None
+
+        row_numbers = {}
+        day_numbers = {}
+        day_tables = []
+        row_days = array('l')
+        for number, row in enumerate(rows):
+            if type(row) not in _ROW_TYPES or type(row.attendance) not in _DAYS_TYPES:
+                return None
+            row_numbers[id(row)] = number
+            days = row.attendance
+            if id(days) not in day_numbers:
+                day_numbers[id(days)] = len(day_tables)
+                day_tables.append(days)
+            row_days.append(day_numbers[id(days)])
+
+        housing_groups = {}
+        for name, group in groups.items():
+            try:
+                housing_groups[name] = array('l', [row_numbers[id(row)] for row in group])
+            except (KeyError, TypeError):
+                return None
+
+        # Days: one (dates, weekend mask) axis per distinct dates tuple, the
+        # statuses as is and the records as numbers in the record table (-1 for none)
+        axes = []
+        axis_numbers = {}
+        day_axes = array('l')
+        statuses = []
+        record_numbers = array('l')
+        records = []
+        for days in day_tables:
+            axis = (days.dates, days.weekend_mask)
+            key = (id(days.dates), id(days.weekend_mask))
+            if key not in axis_numbers:
+                axis_numbers[key] = len(axes)
+                axes.append(axis)
+            day_axes.append(axis_numbers[key])
+            statuses.append(days.statuses)
+            if len(days.records) != len(days.statuses):
+                return None
+            for record in days.records:
+                if record is None:
+                    record_numbers.append(-1)
+                elif type(record) in _RECORD_TYPES:
+                    record_numbers.append(len(records))
+                    records.append(record)
+                else:
+                    return None
+
+        row_columns = [[getattr(row, name) for row in rows] for name in _ROW_COLUMNS]
+        record_columns = [[getattr(record, name) for record in records] for name in TimesheetRecord.fields]
+        meta = {key: item for key, item in timesheet.items() if key not in ('employees', 'housing_groups')}
+        return (meta, list(timesheet), row_columns, row_days, axes, day_axes, statuses, record_numbers,
+                record_columns, housing_groups)
+
+    def _timesheet(self, columns):
+        """Rebuild the timesheet dictionary from its columnar form"""
+        (meta, keys, row_columns, row_days, axes, day_axes, statuses, record_numbers,
+         record_columns, housing_groups) = columns
+
+        records = list(map(TimesheetRecord, *record_columns))
+        day_tables = []
+        position = 0
+        for axis_number, day_statuses in zip(day_axes, statuses):
+            dates, weekend_mask = axes[axis_number]
+            end = position + len(day_statuses)
+            day_records = [records[number] if number >= 0 else None for number in record_numbers[position:end]]
+            day_tables.append(TimesheetDays(dates, weekend_mask, list(day_statuses), day_records))
+            position = end
+
+        columns = list(row_columns)
+        columns.insert(_ATTENDANCE_POSITION, [day_tables[number] for number in row_days])
+        rows = list(map(TimesheetRow, *columns))
+
+        timesheet = {}
+        for key in keys:
+            if key == 'employees':
+                timesheet[key] = rows
+            elif key == 'housing_groups':
+                timesheet[key] = {name: [rows[number] for number in numbers]
+                                  for name, numbers in housing_groups.items()}
+            else:
+                timesheet[key] = meta[key]
+        return timesheet
+
+
+# Serializers by name and by code
+_SERIALIZERS = {}
+_SERIALIZER_CODES = {}
+
+
+def register_serializer(serializer):
+    """Make a serializer available to namespaces (by name) and to disk reads (by code)"""
+    existing = _SERIALIZER_CODES.get(serializer.code)
+    if existing is not None and existing.name != serializer.name:
+        raise ValueError(f"Cache serializer code {serializer.code} is already used by {existing.name}")
+    _SERIALIZERS[serializer.name] = serializer
+    _SERIALIZER_CODES[serializer.code] = serializer
+    return serializer
+
+
+def get_serializer(serializer):
+    """Serializer registered under a name (serializer objects are returned as is)"""
+    if not isinstance(serializer, str):
+        return serializer
+    try:
+        return _SERIALIZERS[serializer]
+    except KeyError:
+        raise ValueError(f"Unknown cache serializer: {serializer}")
+
+
+def serializer_for_code(code):
+    """Serializer that wrote a disk entry, or None for an unknown code"""
+    return _SERIALIZER_CODES.get(code)
+
+
+register_serializer(PickleSerializer())
+register_serializer(TimesheetSerializer())
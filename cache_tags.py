@@ -0,0 +1,64 @@
+"""
+Tags of the cached timesheets.
+
+Every cached timesheet is tagged with what it shows, so a change drops only
+the entries it can affect (see TieredCache.invalidate) instead of every
+cached month:
+
+    department:<id>     timesheets filtered on the department
+    department:all      timesheets of every department (they show each one)
+    housing:<id>        timesheets filtered on the housing, or with a row in it
+    period:<yyyy-mm>    timesheets of the month period
+    employee:<id>       timesheets with a row of the employee
+"""
+
+ALL_DEPARTMENTS_TAG = 'department:all'
+
+
+def department_tag(department_id):
+    return f"department:{department_id}"
+
+
+def department_tags(department_id):
+    """Tags of every timesheet showing a department: filtered on it, or on no department"""
+    return [department_tag(department_id), ALL_DEPARTMENTS_TAG]
+
+
+def housing_tag(housing_id):
+    return f"housing:{housing_id}"
+
+
+def period_tag(year, month):
+    return f"period:{int(year):04d}-{int(month):02d}"
+
+
+def employee_tag(employee_id):
+    return f"employee:{employee_id}"
+
+
+def employee_tags(employee_ids):
+    return [employee_tag(employee_id) for employee_id in employee_ids if employee_id]
+
+
+def timesheet_tags(timesheet, year, month, department_id=None, housing_id=None):
+    """
+    Tags of a cached timesheet.
+
+    Args:
+        timesheet: Timesheet dictionary (rows in 'employees')
+        year: Year of the month period
+        month: Month of the month period
+        department_id: Department filter of the timesheet, if any
+        housing_id: Housing filter of the timesheet, if any
+
+    Returns:
+        Set of tags
+    """
+    tags = {period_tag(year, month), department_tag(department_id) if department_id else ALL_DEPARTMENTS_TAG}
+    if housing_id:
+        tags.add(housing_tag(housing_id))
+    for row in timesheet.get('employees') or ():
+        tags.add(employee_tag(row['id']))
+        if row.get('housing_id') is not None:
+            tags.add(housing_tag(row['housing_id']))
+    return tags
@@ -0,0 +1,170 @@
+"""
+Post-sync cache warm-up.
+
+A successful sync (or /clear_cache) invalidates every cached timesheet, so
+without this the first supervisor to open each department or housing pays the
+full generation cost. The warm-up rebuilds, in a low-priority background
+thread, the current and previous month's timesheets for the scopes that were
+requested most in the recent cache access log, plus the dashboard summary and
+the statistics of the most viewed departments.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import date
+
+from enhanced_cache_optimized import cache_access_log
+
+logger = logging.getLogger(__name__)
+
+# How many timesheet scopes and departments to warm
+WARMUP_TOP_SCOPES = int(os.environ.get('CACHE_WARMUP_TOP_SCOPES', 8))
+WARMUP_TOP_DEPARTMENTS = int(os.environ.get('CACHE_WARMUP_TOP_DEPARTMENTS', 5))
+
+# Pause between two warm-up items so request threads get the interpreter
+WARMUP_PAUSE = float(os.environ.get('CACHE_WARMUP_PAUSE', 0.5))
+
+# Page size of the /timesheet view, warmed when nothing has been logged yet
+DEFAULT_TIMESHEET_PAGE_SIZE = 50
+
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+
+def _timesheet_scope(args, kwargs):
+    """
+    Map a logged timesheet lookup to the scope it viewed:
+    (department_id, housing_id, limit, weekend_days).
+    Only first pages are worth warming, so deeper pages are skipped.
+    """
+    if kwargs.get('cursor') or kwargs.get('offset') or len(args) < 6:
+        return None
+    return args[2], args[5], kwargs.get('limit'), kwargs.get('weekend_days')
+
+
+def _department_scope(args, kwargs):
+    """Map a logged department statistics lookup to its department ID"""
+    return args[0] if args else None
+
+
+def learned_timesheet_scopes(limit=WARMUP_TOP_SCOPES):
+    """Get the most requested timesheet scopes from the cache access log"""
+    scopes = cache_access_log.most_common('_generate_timesheet', _timesheet_scope, limit)
+    if not scopes:
+        # Nothing logged yet (e.g. right after a restart): warm the default view
+        from settings_cache import resolve_weekend_days, DEFAULT_USER_ID
+        scopes = [(None, None, DEFAULT_TIMESHEET_PAGE_SIZE, resolve_weekend_days(DEFAULT_USER_ID))]
+    return scopes
+
+
+def learned_department_ids(limit=WARMUP_TOP_DEPARTMENTS):
+    """Get the departments whose statistics were requested most"""
+    return cache_access_log.most_common('get_department_statistics', _department_scope, limit)
+
+
+def warmup_months(today=None):
+    """Get the (year, month) pairs to warm: the current and the previous month"""
+    today = today or date.today()
+    previous = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+    return [(today.year, today.month), previous]
+
+
+def _lower_thread_priority():
+    """Lower the calling thread's scheduling priority where the OS allows it"""
+    try:
+        # On Linux each thread has its own nice value
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError) as e:
+        logger.debug(f"Could not lower warm-up thread priority: {str(e)}")
+
+
+def warm_caches(today=None):
+    """
+    Rebuild the most used cache entries. Must run inside an app context.
+
+    Returns:
+        Number of entries warmed
+    """
+    from fiscal_calendar import fiscal_calendar
+    from optimized_timesheet import optimized_generate_timesheet
+    import dashboard_stats
+
+    start_time = time.time()
+    warmed = 0
+    month_dates = fiscal_calendar.month_dates_config()
+    scopes = learned_timesheet_scopes()
+
+    # Warm-up lookups must not count as user demand
+    with cache_access_log.suppressed():
+        for year, month in warmup_months(today):
+            # The /timesheet view uses the configured period of the month
+            period = month_dates.get(month, {})
+            for department_id, housing_id, limit, weekend_days in scopes:
+                try:
+                    optimized_generate_timesheet(
+                        year, month, department_id, period.get('start'), period.get('end'), housing_id,
+                        limit=limit, weekend_days=weekend_days
+                    )
+                    warmed += 1
+                except Exception as e:
+                    logger.error(f"Error warming timesheet {month}/{year} "
+                                 f"(department={department_id}, housing={housing_id}): {str(e)}")
+                time.sleep(WARMUP_PAUSE)
+
+        try:
+            dashboard_stats.get_dashboard_summary(force_refresh=True)
+            warmed += 1
+        except Exception as e:
+            logger.error(f"Error warming dashboard summary: {str(e)}")
+
+        for department_id in learned_department_ids():
+            time.sleep(WARMUP_PAUSE)
+            try:
+                dashboard_stats.get_department_statistics(department_id, force_refresh=True)
+                warmed += 1
+            except Exception as e:
+                logger.error(f"Error warming statistics for department {department_id}: {str(e)}")
+
+    logger.info(f"Cache warm-up finished: {warmed} entries in {time.time() - start_time:.2f} seconds")
+    return warmed
+
+
+def _run_warmup(app):
+    """Background thread body"""
+    _lower_thread_priority()
+    try:
+        with app.app_context():
+            warm_caches()
+    except Exception as e:
+        logger.error(f"Cache warm-up failed: {str(e)}")
+
+
+def start_warmup(app=None):
+    """
+    Start the warm-up in a background thread, unless one is already running.
+
+    Args:
+        app: Flask application (defaults to the current app)
+
+    Returns:
+        True if a warm-up was started
+    """
+    global _warmup_thread
+
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+
+    with _warmup_lock:
+        if _warmup_thread and _warmup_thread.is_alive():
+            logger.info("Cache warm-up already running")
+            return False
+
+        _warmup_thread = threading.Thread(target=_run_warmup, args=(app,), name='cache-warmup')
+        _warmup_thread.daemon = True
+        _warmup_thread.start()
+
+    logger.info("Started cache warm-up in the background")
+    return True
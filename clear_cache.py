@@ -1,6 +1,4 @@
 from flask import Flask
-import os
-import shutil
 from database import db
 import logging
 
@@ -16,32 +14,13 @@ def clear_timesheet_cache():
     """Clear all timesheet cache files and memory cache"""
     print("Clearing timesheet cache...")
     
-    # Clear in-memory cache
+    # Clear the timesheet namespace of the shared cache (memory and disk)
     try:
-        from enhanced_cache import _timesheet_cache
-        cache_size = len(_timesheet_cache)
-        _timesheet_cache.clear()
-        print(f"Cleared in-memory timesheet cache ({cache_size} entries)")
-    except (ImportError, AttributeError) as e:
-        print(f"Error clearing in-memory cache: {str(e)}")
-    
-    # Clear disk cache if it exists
-    cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cache')
-    timesheet_cache_dir = os.path.join(cache_dir, 'timesheets')
-    
-    if os.path.exists(timesheet_cache_dir):
-        try:
-            # Remove all files in the directory
-            for file in os.listdir(timesheet_cache_dir):
-                file_path = os.path.join(timesheet_cache_dir, file)
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-                    print(f"Deleted cache file: {file}")
-            print(f"Cleared disk cache in {timesheet_cache_dir}")
-        except Exception as e:
-            print(f"Error clearing disk cache: {str(e)}")
-    else:
-        print(f"Disk cache directory does not exist: {timesheet_cache_dir}")
+        from enhanced_cache_optimized import timesheet_cache
+        removed = timesheet_cache.clear()
+        print(f"Cleared timesheet cache ({removed} disk cache files)")
+    except Exception as e:
+        print(f"Error clearing timesheet cache: {str(e)}")
     
     print("Cache clearing completed!")
 
@@ -5,6 +5,7 @@ from datetime import datetime, date, timedelta
 from collections import defaultdict
 from sqlalchemy import extract
 from database import db
+from fiscal_calendar import fiscal_calendar
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -50,24 +51,8 @@ def get_month_days(year, month):
     Returns:
         Number of days in the month
     """
-    # Import here to avoid circular imports
-    from models import MonthPeriod
-
-    year = int(year)
-    month = int(month)
-
-    # Format month code to MM/YY format (e.g., "01/25" for January 2025)
-    month_code = f"{month:02d}/{str(year)[2:4]}"
-
-    # Try to find month period in the database
-    month_period = MonthPeriod.query.filter_by(month_code=month_code).first()
-
-    if month_period:
-        # If found in database, use the days_in_month field
-        return month_period.days_in_month
-    else:
-        # Fallback to standard calendar if not found
-        return calendar.monthrange(year, month)[1]
+    # Periods are served from the in-memory fiscal calendar (falls back to the standard calendar)
+    return fiscal_calendar.month_days(year, month)
 
 def get_month_start_end_dates(year, month):
     """
@@ -80,33 +65,8 @@ def get_month_start_end_dates(year, month):
     Returns:
         Tuple of (start_date, end_date) for the month
     """
-    # Import here to avoid circular imports
-    from models import MonthPeriod
-
-    year = int(year)
-    month = int(month)
-
-    # Format month code to MM/YY format (e.g., "01/25" for January 2025)
-    month_code = f"{month:02d}/{str(year)[2:4]}"
-
-    # Try to find month period in the database
-    month_period = MonthPeriod.query.filter_by(month_code=month_code).first()
-
-    if month_period and month_period.start_date and month_period.end_date:
-        # If found in database, use the defined period
-        logger.info(f"Using custom month period for {month_code}: {month_period.start_date} to {month_period.end_date}")
-        return month_period.start_date, month_period.end_date
-    else:
-        # Fallback to standard calendar if not found
-        # First day of the month
-        start_date = date(year, month, 1)
-
-        # Last day of the month
-        _, last_day = calendar.monthrange(year, month)
-        end_date = date(year, month, last_day)
-
-        logger.info(f"Using standard calendar for {month}/{year}: {start_date} to {end_date}")
-        return start_date, end_date
+    # Periods are served from the in-memory fiscal calendar (falls back to the standard calendar)
+    return fiscal_calendar.month_bounds(year, month)
 
 def get_previous_month_days(year, month, num_days=5):
     """Get the last few days of the previous month"""
@@ -124,53 +84,16 @@ def get_previous_month_days(year, month, num_days=5):
     # Reverse so they're in chronological order
     return previous_days[::-1]
 
-def apply_vacations_and_transfers(attendance_data, employee_id, start_date, end_date):
-    """
-    Apply vacation and transfer statuses to employee attendance data - Optimized with caching
-
-    Args:
-        attendance_data: List of attendance data dictionaries
-        employee_id: Employee ID
-        start_date: Start date for the timesheet
-        end_date: End date for the timesheet
-
-    Returns:
-        Updated attendance data with vacation and transfer statuses
-    """
-    # Import cache manager
-    from cache_manager import get_employee_vacations, get_employee_transfers
-
-    # Get vacations and transfers using cache
-    vacations = get_employee_vacations(employee_id, start_date, end_date)
-    transfers = get_employee_transfers(employee_id, start_date, end_date)
-
-    # Apply vacation statuses - process by date ranges rather than generating all dates
-    for vacation in vacations:
-        v_start = max(vacation.start_date, start_date)
-        v_end = min(vacation.end_date, end_date)
-
-        # Find applicable dates in the attendance data that fall within this vacation
-        for day_data in attendance_data:
-            day_date = day_data['date']
-            if v_start <= day_date <= v_end and (day_data['status'] == 'A' or not day_data['status']):
-                day_data['status'] = 'V'
-
-    # Apply transfer statuses
-    for transfer in transfers:
-        t_start = max(transfer.start_date, start_date)
-        t_end = min(transfer.end_date, end_date)
-
-        # Find applicable dates in the attendance data that fall within this transfer
-        for day_data in attendance_data:
-            day_date = day_data['date']
-            if t_start <= day_date <= t_end:
-                day_data['status'] = 'T'
-
-    return attendance_data
-
 def generate_timesheet(year, month, department_id=None, custom_start_date=None, custom_end_date=None, housing_id=None, limit=None, offset=None, force_refresh=False):
     """
-    Generate timesheet data for the specified month and department/housing
+    Generate timesheet data for the specified month and department/housing.
+
+    Kept for older callers: the timesheet is built by the timesheet engine
+    through optimized_generate_timesheet (same caching, weekend settings and
+    leave handling as the timesheet page). Without custom dates it still
+    covers the last 5 days of the previous month up to the end of the fiscal
+    month period (see fiscal_calendar), unlike the calendar month shown by the
+    timesheet page.
 
     Args:
         year: Year for the timesheet (string or int)
@@ -186,475 +109,19 @@ def generate_timesheet(year, month, department_id=None, custom_start_date=None,
     Returns:
         Dictionary with timesheet data
     """
-    # Import here to avoid circular imports
-    from models import Department, Employee, AttendanceRecord, Housing, BiometricTerminal, EmployeeException, EmployeeSickLeave
-    from flask import session
-    import datetime
-    from sqlalchemy.orm import joinedload
-    from cache_manager import disk_cache
-
-    # Create a cache key based on parameters
-    import hashlib
-
-    # Create a more precise cache key that includes all relevant parameters
-    cache_params = f"timesheet_{year}_{month}_{department_id}_{custom_start_date}_{custom_end_date}_{housing_id}_{limit}_{offset}"
-    cache_key = f"timesheet_{hashlib.md5(cache_params.encode()).hexdigest()}"
-      # Check if we can return data from cache (unless force refresh is requested)
-    if not force_refresh:
-        cached_data = disk_cache.get(cache_key)
-        if cached_data:
-            logger.info(f"Returning timesheet data from cache for {year}/{month}")
-            return cached_data
-
-    # Start timing the function
-    start_time = time.time()
+    from optimized_timesheet import optimized_generate_timesheet
 
-    try:
-        year = int(year)
-        month = int(month)
-
-        # Use custom dates if provided
-        if custom_start_date and custom_end_date:
-            try:
-                # Parse custom dates
-                start_date = datetime.datetime.strptime(custom_start_date, "%Y-%m-%d").date()
-                end_date = datetime.datetime.strptime(custom_end_date, "%Y-%m-%d").date()
-                logger.info(f"Using custom date range: {start_date} to {end_date}")
-            except ValueError as e:
-                logger.error(f"Error parsing custom dates: {str(e)}")
-                # Fall back to default month dates
-                start_date, end_date = get_month_start_end_dates(year, month)
-        else:
-            # Get standard month boundaries
-            start_date, end_date = get_month_start_end_dates(year, month)
-
-        # Get a few days from previous month for display at start of timesheet
-        # (Only if we're not using custom dates)
+    if not (custom_start_date and custom_end_date):
+        start_date, end_date = fiscal_calendar.month_bounds(year, month)
         if not custom_start_date:
-            prev_month_days = get_previous_month_days(year, month, 5)
-
-            # Adjust start date to include previous month days
-            if prev_month_days:
-                start_date = prev_month_days[0]
-
-        # Build the list of dates for the timesheet
-        dates = []
-        current_date = start_date
-        while current_date <= end_date:
-            dates.append(current_date)
-            current_date += timedelta(days=1)
-
-        # Get all employees to include in timesheet with optimized query
-        query = Employee.query.filter(Employee.active == True)
-
-        # Apply department filter if provided
-        if department_id:
-            query = query.filter(Employee.department_id == int(department_id))
-
-        # Apply Housing filter if provided
-        if housing_id:
-            query = query.filter(Employee.housing_id == int(housing_id))
-
-        # Optimize query with eager loading
-        query = query.options(
-            joinedload(Employee.department),
-            joinedload(Employee.housing)
-        )
-
-        # Apply pagination if specified
-        if limit is not None and offset is not None:
-            employees = query.order_by(Employee.name).limit(limit).offset(offset).all()
-            # Also get total count for pagination
-            total_employees = query.count()
-        else:
-            employees = query.order_by(Employee.name).all()
-            total_employees = len(employees)
-
-        logger.info(f"Fetched {len(employees)} employees for timesheet (total: {total_employees})")
-
-        # إنشاء قاموس لربط أجهزة البصمة بالسكن
-        terminal_to_housing = {}
-        housing_names = {}  # قاموس لتخزين أسماء السكنات حسب المعرف
-
-        # جمع جميع أجهزة البصمة والسكنات المرتبطة بها - استخدم eager loading
-        terminals = BiometricTerminal.query.options(
-            db.joinedload(BiometricTerminal.housing)
-        ).all()
-
-        # Preload all housings into dictionary to avoid repeated queries
-        housings = {h.id: h for h in Housing.query.all()}
-
-        # تخزين أسماء السكنات حسب المعرف
-        for housing_id, housing in housings.items():
-            housing_names[housing_id] = housing.name
-
-        # ربط أجهزة البصمة بالسكن
-        for terminal in terminals:
-            if terminal.housing_id:
-                terminal_to_housing[terminal.terminal_alias] = terminal.housing_id
-                # تخزين معرف السكن واسم السكن معاً
-                terminal_to_housing[f"{terminal.terminal_alias}_name"] = housing_names.get(terminal.housing_id, "Unknown Housing")
-            elif terminal.terminal_alias in terminal_to_housing:
-                # إذا كان الجهاز غير مرتبط بسكن محدد لكنه موجود في القاموس (للتوافق مع الإصدارات القديمة)
-                terminal_to_housing.pop(terminal.terminal_alias)
-                # Also remove the name entry if it exists
-                name_key = f"{terminal.terminal_alias}_name"
-                if name_key in terminal_to_housing:
-                    terminal_to_housing.pop(name_key)
-
-        # Query all attendance records for these employees in the date range with optimized approach
-        # First check if we have too many employees for a single query
-        employee_ids = [e.id for e in employees]
-
-        if len(employee_ids) > 100:            # For large employee sets, break into chunks to avoid excessive memory usage
-            logger.info(f"Breaking attendance query into chunks for {len(employee_ids)} employees")
-            attendance_records = []
-            chunk_size = 100
-
-            for i in range(0, len(employee_ids), chunk_size):
-                chunk_ids = employee_ids[i:i+chunk_size]
-                chunk_records = AttendanceRecord.query.filter(
-                    AttendanceRecord.employee_id.in_(chunk_ids),
-                    AttendanceRecord.date >= start_date,
-                    AttendanceRecord.date <= end_date
-                ).all()
-                attendance_records.extend(chunk_records)
-
-        else:            # For smaller sets, use a single query
-            attendance_records = AttendanceRecord.query.filter(
-                AttendanceRecord.employee_id.in_(employee_ids),
-                AttendanceRecord.date >= start_date,
-                AttendanceRecord.date <= end_date
-            ).all()
-
-        logger.info(f"Fetched {len(attendance_records)} attendance records for date range {start_date} to {end_date}")
-
-        # Organize attendance records by employee and date
-        attendance_by_employee = defaultdict(dict)
-
-        # تتبع أجهزة البصمة المستخدمة لكل موظف
-        employee_terminals = defaultdict(set)
-
-        # تتبع السكنات المختلفة المستخدمة من قبل الموظفين في الأيام المختلفة
-        employee_daily_housing = defaultdict(lambda: defaultdict(set))
-
-        for record in attendance_records:
-            attendance_by_employee[record.employee_id][record.date] = record
-
-            # جمع معلومات عن أجهزة البصمة المستخدمة لكل موظف
-            # وتطبيق القاعدة 1 و 2: إذا تطابقت أجهزة بصمة الدخول والخروج أو اختلفت، نعطي الأولوية لبصمة الدخول
-            housing_id_in = None
-            housing_id_out = None
-
-            if record.terminal_alias_in and record.terminal_alias_in in terminal_to_housing:
-                employee_terminals[record.employee_id].add(record.terminal_alias_in)
-                housing_id_in = terminal_to_housing[record.terminal_alias_in]
-                # أضف السكن المرتبط ببصمة الدخول إلى مجموعة السكنات لهذا اليوم
-                if housing_id_in:
-                    employee_daily_housing[record.employee_id][record.date].add(housing_id_in)
-
-            if record.terminal_alias_out and record.terminal_alias_out in terminal_to_housing:
-                employee_terminals[record.employee_id].add(record.terminal_alias_out)
-                housing_id_out = terminal_to_housing[record.terminal_alias_out]
-                # أضف السكن المرتبط ببصمة الخروج إلى مجموعة السكنات لهذا اليوم فقط إذا كان مختلفًا
-                if housing_id_out and housing_id_out != housing_id_in:
-                    employee_daily_housing[record.employee_id][record.date].add(housing_id_out)
-
-        # Get weekend days from user settings
-        weekend_days = []
-        if 'ui_settings' in session and 'weekend_days' in session['ui_settings']:
-            weekend_days = [int(day) for day in session['ui_settings']['weekend_days']]
-        else:
-            # Default to Friday and Saturday if not set
-            weekend_days = [4, 5]  # 4=Friday, 5=Saturday in Python's weekday system (0=Monday)
-
-        logger.info(f"Using weekend days: {weekend_days}")
-
-        # قائمة لتخزين جميع صفوف الموظفين، بما في ذلك الموظفين المكررين بسكنات مختلفة
-        all_employee_rows = []
-
-        # تتبع الموظفين الذين تمت إضافتهم بالفعل إلى صفوف الموظفين
-        processed_employee_ids = set()
-
-        for employee in employees:
-            attendance_data = []
-
-            # تتبع جميع السكنات التي استخدمها الموظف خلال الفترة
-            all_housing_used = set()
-
-            # For each date in the range, get the attendance status
-            for day in dates:
-                record = attendance_by_employee.get(employee.id, {}).get(day)
-
-                if record:
-                    status = record.attendance_status
+            start_date = date(int(year), int(month), 1) - timedelta(days=5)
+        custom_start_date = start_date.strftime('%Y-%m-%d')
+        custom_end_date = end_date.strftime('%Y-%m-%d')
 
-                    # جمع السكنات المستخدمة في هذا اليوم
-                    daily_housings = employee_daily_housing[employee.id].get(day, set())
-                    if daily_housings:
-                        all_housing_used.update(daily_housings)
-                else:
-                    # If no record, determine if it's a weekend or future date
-                    if day.weekday() in weekend_days:  # Using the weekend days from settings
-                        status = 'W'  # Weekend
-                    elif day > date.today():
-                        status = ''  # Future date
-                    else:
-                        status = 'A'  # Absent
-
-                # Add extra information for weekend days
-                is_weekend = (day.weekday() in weekend_days)
-
-                attendance_data.append({
-                    'date': day,
-                    'status': status,
-                    'record': record,
-                    'is_weekend': is_weekend  # Flag for weekend styling
-                })
-
-            # Apply vacations and transfers to attendance data
-            attendance_data = apply_vacations_and_transfers(attendance_data, employee.id, start_date, end_date)
-
-            # Get department name
-            # Extract department name from already loaded relationship
-            dept_name = ''
-            if employee.department_id and hasattr(employee, 'department') and employee.department:
-                dept_name = employee.department.name
-
-            # استخراج معلومات السكن للموظف
-            employee_housing_id = employee.housing_id
-            housing_name = ''
-
-            # إذا كان للموظف سكن محدد، استخدم اسم السكن من البيانات المحملة مسبقاً
-            if employee_housing_id:
-                housing_name = housing_names.get(employee_housing_id, "")
-                if housing_name:
-                    # أضف سكن الموظف إلى قائمة السكنات المستخدمة
-                    all_housing_used.add(employee_housing_id)
-
-            # جمع معلومات عن أجهزة البصمة المستخدمة
-            devices = employee_terminals.get(employee.id, set())
-            terminal_alias_in = None
-
-            # إذا لم يكن للموظف سكن محدد، حاول تحديد السكن من أجهزة البصمة المستخدمة بتطبيق القواعد
-            if not employee_housing_id and devices:
-                # Count terminal usage by housing
-                housing_usage = defaultdict(int)
-
-                # محاولة تحديد السكن بناءً على تكرار استخدام الأجهزة
-                for device in devices:
-                    if device in terminal_to_housing:
-                        housing_id = terminal_to_housing[device]
-                        housing_usage[housing_id] += 1
-
-                # If we have housing usage data, use the most frequent one
-                if housing_usage:
-                    most_used_housing_id = max(housing_usage.items(), key=lambda x: x[1])[0]
-                    employee_housing_id = most_used_housing_id
-                    housing_name = housing_names.get(most_used_housing_id, "")
-                    # أضف السكن الأكثر استخدامًا إلى قائمة السكنات المستخدمة
-                    all_housing_used.add(most_used_housing_id)
-
-            # استخدام أول جهاز بصمة كجهاز افتراضي للموظف إذا كان موجوداً
-            if devices:
-                terminal_alias_in = sorted(devices)[0]  # استخدام أول جهاز بالترتيب الأبجدي
-
-            # إذا لم يتم تحديد سكن للموظف حتى الآن، ضعه في "Unknown Housing"
-            if not housing_name:
-                housing_name = "Unknown Housing"
-              # حساب إجمالي ساعات العمل والساعات الإضافية
-            total_work_hours = 0
-            total_overtime_hours = 0
-
-            for day_data in attendance_data:
-                record = day_data.get('record')
-                day = day_data.get('date')
-
-                # Verificar si hay una excepción para este empleado en esta fecha
-                exception = None
-                if day:
-                    exception = EmployeeException.query.filter_by(
-                        employee_id=employee.id,
-                        date=day
-                    ).first()
-
-                if exception:
-                    # Si hay una excepción, usar las horas acreditadas de la excepción
-                    regular_hours = exception.hours_credited
-                    overtime = 0
-                    # Marcar el estado como 'E' para excepción
-                    day_data['status'] = 'E'
-                    total_work_hours += regular_hours
-                    total_overtime_hours += overtime
-                elif record:
-                    # تحقق مما إذا كان التاريخ هو 10 مايو 2025 وكان لدى الموظف بصمة دخول فقط بدون بصمة خروج
-                    today_date = date(2025, 5, 10)  # تاريخ اليوم (10 مايو 2025)
-                    if record.date == today_date and record.clock_in and not record.clock_out:
-                        # إذا كان التاريخ هو اليوم وكان للموظف بصمة دخول فقط، نضع 1 ساعة عمل بدلاً من 8
-                        regular_hours = 1
-                        overtime = 0
-                          # تحديث القيمة أيضًا في قاعدة البيانات
-                        if record.work_hours != 1:
-                            record.work_hours = 1
-                            record.overtime_hours = 0
-                            db.session.add(record)
-                    else:
-                        # حساب ساعات العمل العادية (بحد أقصى 8 ساعات في اليوم) والساعات الإضافية كالمعتاد
-                        total_hours = record.work_hours + record.overtime_hours
-                        regular_hours = min(8, total_hours)  # ساعات العمل العادية بحد أقصى 8 ساعات
-                        overtime = total_hours - regular_hours if total_hours > 8 else 0  # الساعات الإضافية فوق ال 8 ساعات
-
-                    total_work_hours += regular_hours
-                    total_overtime_hours += overtime
-
-            # إضافة الموظف بالسكن الرئيسي أولاً
-            all_employee_rows.append({
-                'id': employee.id,
-                'emp_code': employee.emp_code,
-                'name': employee.name,
-                'name_ar': employee.name_ar,
-                'profession': employee.profession,
-                'department': dept_name,
-                'housing': housing_name,  # اسم السكن
-                'housing_id': employee_housing_id,  # معرف السكن
-                'attendance': attendance_data,
-                'terminal_alias_in': terminal_alias_in,  # جهاز البصمة الأساسي
-                'devices': list(devices),  # قائمة بجميع أجهزة البصمة المستخدمة
-                'total_work_hours': total_work_hours,  # إجمالي ساعات العمل
-                'total_overtime_hours': total_overtime_hours,  # إجمالي الساعات الإضافية
-                'is_primary': True  # علامة للإشارة إلى أنه السكن الرئيسي للموظف
-            })
-
-            # إضافة الموظف إلى قائمة المعالجة
-            processed_employee_ids.add(employee.id)
-
-            # قاعدة 3: إظهار الموظف في السكنات الأخرى التي بصم فيها
-            # إنشاء نسخة من الموظف لكل سكن إضافي استخدمه
-            for housing_id in all_housing_used:
-                # تخطي السكن الرئيسي الذي تمت إضافته بالفعل
-                if housing_id == employee_housing_id:
-                    continue
-
-                # الحصول على اسم السكن
-                secondary_housing_name = housing_names.get(housing_id, "Unknown Housing")
-
-                # إنشاء نسخة من بيانات الموظف مع تحديد السكن الثانوي
-                all_employee_rows.append({
-                    'id': employee.id,
-                    'emp_code': employee.emp_code,
-                    'name': employee.name,
-                    'name_ar': employee.name_ar,
-                    'profession': employee.profession,
-                    'department': dept_name,
-                    'housing': secondary_housing_name,  # اسم السكن الثانوي
-                    'housing_id': housing_id,  # معرف السكن الثانوي
-                    'attendance': attendance_data,
-                    'terminal_alias_in': terminal_alias_in,  # جهاز البصمة الأساسي
-                    'devices': list(devices),  # قائمة بجميع أجهزة البصمة المستخدمة
-                    'total_work_hours': total_work_hours,  # إجمالي ساعات العمل
-                    'total_overtime_hours': total_overtime_hours,  # إجمالي الساعات الإضافية
-                    'is_primary': False  # علامة للإشارة إلى أنه سكن ثانوي للموظف
-                })
-
-        # استخدام القائمة الجديدة التي تتضمن الموظفين المكررين بالسكنات المختلفة
-        employee_rows = all_employee_rows
-
-        # ترتيب الموظفين حسب السكن ثم حسب الاسم
-        employee_rows.sort(key=lambda x: (x.get('housing') or 'Unknown Housing', x.get('name') or '', not x.get('is_primary', False)))
-
-        # Get month period data if available
-        from models import MonthPeriod
-        month_code = f"{int(month):02d}/{str(int(year))[2:4]}"
-        month_period = MonthPeriod.query.filter_by(month_code=month_code).first()
-
-        working_days = None
-        working_hours = None
-
-        if month_period:
-            working_days = month_period.days_in_month
-            working_hours = month_period.hours_in_month
-
-        # تنظيم الموظفين حسب السكن
-        housing_groups = {}
-        ungrouped_employees = []
-
-        for employee in employee_rows:
-            housing_name = employee.get('housing')
-            if housing_name:
-                if housing_name not in housing_groups:
-                    housing_groups[housing_name] = []
-                housing_groups[housing_name].append(employee)
-            else:
-                ungrouped_employees.append(employee)
-                  # بناء قائمة الموظفين النهائية المرتبة حسب السكن
-        grouped_employees = []
-
-        # أولاً إضافة الموظفين المجمعين حسب السكن
-        for housing_name in sorted(housing_groups.keys()):
-            grouped_employees.extend(housing_groups[housing_name])
-
-        # ثم إضافة الموظفين الذين ليس لديهم سكن
-        grouped_employees.extend(ungrouped_employees)
-
-        # Commit any changes to the database
-        db.session.commit()
-
-        # Calculate execution time
-        execution_time = time.time() - start_time
-
-        # Build and return timesheet data
-        timesheet_data = {
-            'year': year,
-            'month': month,
-            'month_name': get_month_name(month),
-            'dates': dates,
-            'employees': grouped_employees,  # استخدام القائمة المجمعة حسب السكن
-            'total_employees': total_employees,  # Total unique employees (for pagination)
-            'employees_loaded': len(employees),  # Number of employees loaded in this batch
-            'total_rows': len(employee_rows),  # العدد الإجمالي للصفوف بما فيها المكررة
-            'housing_groups': housing_groups,  # تضمين معلومات التجميع حسب السكن
-            'start_date': start_date,
-            'end_date': end_date,
-            'working_days': working_days,
-            'working_hours': working_hours,
-            'weekend_days': weekend_days,  # Include weekend days for reference
-            'execution_time': round(execution_time, 2),  # Include execution time for monitoring
-            'has_more': offset + limit < total_employees if limit and offset is not None else False,
-            'pagination': {
-                'limit': limit,
-                'offset': offset,
-                'total': total_employees
-            } if limit is not None else None
-        }
-
-        logger.info(f"Generated timesheet data in {execution_time:.2f} seconds")
-
-        # Save to cache for future requests
-        disk_cache.set(cache_key, timesheet_data)
-
-        return timesheet_data
-
-    except Exception as e:
-        logger.error(f"Error generating timesheet: {str(e)}")
-        # Rollback any database changes if there was an error
-        try:
-            db.session.rollback()
-        except:
-            pass  # Ignore error if db is not initialized
-        # Return empty timesheet structure
-        return {
-            'year': year,
-            'month': month,
-            'month_name': get_month_name(int(month)) if isinstance(month, (int, str)) else '',
-            'dates': [],
-            'employees': [],
-            'total_employees': 0,
-            'start_date': None,
-            'end_date': None,
-            'working_days': None,
-            'working_hours': None,
-            'error': str(e)
-        }
+    return optimized_generate_timesheet(
+        year, month, department_id, custom_start_date, custom_end_date, housing_id,
+        limit=limit, offset=offset, force_refresh=force_refresh
+    )
 
 def get_department_stats():
     """Get statistics by department for dashboard"""
@@ -774,7 +241,7 @@ def update_employee_housing_from_terminals():
     - Improved logging for better troubleshooting
     """
     # Import here to avoid circular imports
-    from models import Employee, AttendanceRecord, BiometricTerminal, Housing
+    from models import Employee, AttendanceRecord, Housing
     from database import db
     import logging
     from collections import defaultdict
@@ -792,9 +259,10 @@ def update_employee_housing_from_terminals():
 
         logger.info(f"Found {len(employees_without_housing)} active employees without housing assignments")
 
-        # Get the mapping of terminals to housing
+        # Get the mapping of terminals to housing (shared reference data snapshot)
+        from reference_data import get_reference_snapshot
         terminal_to_housing = {}
-        terminals = BiometricTerminal.query.filter(BiometricTerminal.housing_id != None).all()
+        terminal_housings = get_reference_snapshot().terminal_to_housing
 
         # Common terminals that don't represent housing (security checkpoints and office locations)
         common_terminals = [
@@ -810,9 +278,9 @@ def update_employee_housing_from_terminals():
         ]
 
         terminal_count = 0
-        for terminal in terminals:
-            if terminal.terminal_alias not in common_terminals:
-                terminal_to_housing[terminal.terminal_alias] = terminal.housing_id
+        for terminal_alias, housing_id in terminal_housings.items():
+            if terminal_alias not in common_terminals:
+                terminal_to_housing[terminal_alias] = housing_id
                 terminal_count += 1
 
         logger.info(f"Loaded {terminal_count} biometric terminals mapped to housing locations")
@@ -0,0 +1,308 @@
+"""
+Data version tokens for live timesheet updates.
+
+A version token is "<sync_id>.<change_id>":
+- sync_id is the last successful sync. Attendance records written by later
+  (or still running) syncs carry a higher AttendanceRecord.sync_id.
+- change_id is the last DataVersion row, written with every leave edit,
+  employee change, month period or settings edit and data reset. These are
+  logged automatically when the session flushes (see _log_flushed_changes).
+
+Comparing a client's token with the current one tells exactly which
+employee/day cells changed in between, and whether the page itself must be
+rendered again (see changes_since). Changes that force a page to reload
+also drop the cached timesheets they affect once committed, so the reloaded
+page is rebuilt with a newer version.
+"""
+
+import logging
+from datetime import date, timedelta
+
+from sqlalchemy import event, func, inspect, insert
+from sqlalchemy.orm import Session
+
+import cache_tags
+from fiscal_calendar import calendar_month_bounds
+from models import (DataVersion, Employee, EmployeeVacation, EmployeeTransfer,
+                    EmployeeException, EmployeeSickLeave, AppearanceSettings, SystemSettings,
+                    MonthPeriod, Department, Housing, BiometricTerminal)
+
+logger = logging.getLogger(__name__)
+
+# Leave models with a start_date/end_date range
+LEAVE_RANGE_MODELS = (EmployeeVacation, EmployeeTransfer, EmployeeSickLeave)
+
+# Settings and reference data edits: logged so the versions derived from the
+# change log move in every worker (parsed settings, ETags, see settings_cache
+# and response_versions), but they never reload a timesheet page by
+# themselves. The weekend a page was rendered with is compared with the
+# user's current one instead.
+SETTINGS_MODELS = (AppearanceSettings, SystemSettings, Department, Housing, BiometricTerminal)
+
+# Employee columns that decide which timesheets show an employee
+EMPLOYEE_SCOPE_ATTRIBUTES = ('department_id', 'housing_id', 'active')
+
+# Session.info key of the timesheet cache tags to drop after the commit
+_TAGS_KEY = 'timesheet_reload_tags'
+
+
+def _old_value(state, attribute):
+    """Get an attribute's value before the pending change"""
+    history = state.attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attribute)
+
+
+def _leave_ranges(obj, state, include_old):
+    """Yield (employee_id, start_date, end_date) a leave row covers (and covered before the edit)"""
+    if isinstance(obj, EmployeeException):
+        yield obj.employee_id, obj.date, obj.date
+        if include_old:
+            old_date = _old_value(state, 'date')
+            yield _old_value(state, 'employee_id'), old_date, old_date
+    else:
+        yield obj.employee_id, obj.start_date, obj.end_date
+        if include_old:
+            yield _old_value(state, 'employee_id'), _old_value(state, 'start_date'), _old_value(state, 'end_date')
+
+
+def _employee_tags(employee, state, include_old):
+    """Tags of the timesheets showing an employee (and showing it before the edit)"""
+    tags = {cache_tags.employee_tag(employee.id)}
+    values = [(employee.department_id, employee.housing_id)]
+    if include_old:
+        values.append((_old_value(state, 'department_id'), _old_value(state, 'housing_id')))
+    for department_id, housing_id in values:
+        if department_id:
+            tags.update(cache_tags.department_tags(department_id))
+        else:
+            tags.add(cache_tags.ALL_DEPARTMENTS_TAG)
+        if housing_id:
+            tags.add(cache_tags.housing_tag(housing_id))
+    return tags
+
+
+def _period_months(period, state, include_old):
+    """Yield the (year, month) of a month period (and of its code before the edit)"""
+    codes = {period.month_code}
+    if include_old:
+        codes.add(_old_value(state, 'month_code'))
+    for code in codes:
+        try:
+            month_part, year_part = code.split('/')
+            yield 2000 + int(year_part), int(month_part)
+        except (AttributeError, ValueError):
+            logger.warning(f"Ignoring change of month period with invalid code {code!r}")
+
+
+@event.listens_for(Session, 'after_flush')
+def _log_flushed_changes(session, flush_context):
+    """
+    Log leave edits, employee changes, month period and settings edits flushed
+    by any code path. Runs after the flush so new employees have their IDs;
+    the session still holds the flushed objects and their history.
+    """
+    changes = set()
+    tags = set()
+    for obj, include_old in [(obj, False) for obj in session.new] + \
+                            [(obj, True) for obj in session.dirty] + \
+                            [(obj, False) for obj in session.deleted]:
+        if isinstance(obj, LEAVE_RANGE_MODELS + (EmployeeException,)):
+            state = inspect(obj)
+            if include_old and not session.is_modified(obj):
+                continue
+            for employee_id, start_date, end_date in _leave_ranges(obj, state, include_old):
+                if employee_id:
+                    changes.add(('leave', int(employee_id), start_date, end_date))
+        elif isinstance(obj, Employee):
+            # New, removed or moved employees change which rows a scope shows
+            state = inspect(obj)
+            if not include_old or any(state.attrs[attribute].history.has_changes()
+                                      for attribute in EMPLOYEE_SCOPE_ATTRIBUTES):
+                changes.add(('employee', obj.id, None, None))
+                tags.update(_employee_tags(obj, state, include_old))
+        elif isinstance(obj, MonthPeriod):
+            # The /timesheet view of the month uses the period's bounds
+            if include_old and not session.is_modified(obj):
+                continue
+            for year, month in _period_months(obj, inspect(obj), include_old):
+                changes.add(('period', None) + calendar_month_bounds(year, month))
+                tags.add(cache_tags.period_tag(year, month))
+        elif isinstance(obj, SETTINGS_MODELS):
+            if not include_old or session.is_modified(obj):
+                changes.add(('settings', None, None, None))
+
+    if changes:
+        session.connection().execute(insert(DataVersion.__table__), [
+            {'kind': kind, 'employee_id': employee_id, 'start_date': start_date, 'end_date': end_date}
+            for kind, employee_id, start_date, end_date in sorted(
+                changes, key=lambda c: (c[0], c[1] or 0, str(c[2])))
+        ])
+    if tags:
+        session.info.setdefault(_TAGS_KEY, set()).update(tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_reloaded_timesheets(session):
+    # Pages reloaded because of these changes must not get the cached (older) timesheet back
+    tags = session.info.pop(_TAGS_KEY, None)
+    if tags:
+        from enhanced_cache_optimized import invalidate_timesheet_tags
+        try:
+            invalidate_timesheet_tags(*tags)
+        except Exception as e:
+            logger.error(f"Error invalidating timesheets after a data change: {str(e)}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_reloaded_timesheets(session):
+    session.info.pop(_TAGS_KEY, None)
+
+
+def record_data_change(kind, employee_id=None, start_date=None, end_date=None):
+    """
+    Add a change log row to the current session; it is committed with the edit.
+    Only needed for changes the flush listener cannot see (bulk deletes).
+
+    Args:
+        kind: 'leave' (cells in a date range), 'employee' (an employee was
+              added, removed or changed department, housing or status),
+              'period' (the month period of the calendar month from
+              start_date to end_date changed), 'settings' (settings or
+              reference data changed) or 'reset' (attendance data wiped)
+        employee_id: Employee concerned, or None for everyone
+        start_date: First affected date for leave edits
+        end_date: Last affected date for leave edits
+    """
+    from database import db
+
+    db.session.add(DataVersion(
+        kind=kind,
+        employee_id=int(employee_id) if employee_id else None,
+        start_date=start_date,
+        end_date=end_date
+    ))
+
+
+def current_change_id():
+    """Get the id of the last DataVersion row (0 before the first change), seen by every worker"""
+    from database import db
+
+    return db.session.query(func.max(DataVersion.id)).scalar() or 0
+
+
+def current_data_version():
+    """Get the current version token"""
+    from models import SyncLog
+    from database import db
+
+    sync_id = db.session.query(func.max(SyncLog.id)).filter(SyncLog.status == 'success').scalar() or 0
+    return f"{sync_id}.{current_change_id()}"
+
+
+def parse_data_version(token):
+    """
+    Parse a version token.
+
+    Returns:
+        Tuple (sync_id, change_id), or None if the token is missing or invalid
+    """
+    try:
+        sync_id, change_id = str(token).split('.')
+        return int(sync_id), int(change_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def changes_since(token, employee_ids, start_date, end_date, year=None, month=None,
+                  department_id=None, housing_id=None):
+    """
+    Find the timesheet cells that changed since a version token.
+
+    Args:
+        token: Version token the client rendered
+        employee_ids: Employees displayed by the client
+        start_date: First displayed date
+        end_date: Last displayed date
+        year: Year of the displayed timesheet (with month: periods edits of
+              other months are ignored)
+        month: Month of the displayed timesheet
+        department_id: Department filter of the displayed timesheet, if any
+        housing_id: Housing filter of the displayed timesheet, if any
+
+    Returns:
+        Dictionary with reload (True when the client must re-render the page:
+        data was reset, the month's period changed, or a displayed employee
+        or one now in the page's scope was added, removed or moved) and cells
+        ({employee_id: set(dates)})
+    """
+    from models import AttendanceRecord
+    from database import db
+
+    since = parse_data_version(token)
+    if since is None:
+        return {'reload': True, 'cells': {}}
+    since_sync_id, since_change_id = since
+
+    cells = {}
+    employee_set = set(employee_ids)
+    if employee_ids:
+        # Attendance written by syncs after the client's version (including one still running)
+        synced = db.session.query(AttendanceRecord.employee_id, AttendanceRecord.date).filter(
+            AttendanceRecord.sync_id > since_sync_id,
+            AttendanceRecord.employee_id.in_(employee_ids),
+            AttendanceRecord.date >= start_date,
+            AttendanceRecord.date <= end_date
+        )
+        for employee_id, record_date in synced:
+            cells.setdefault(employee_id, set()).add(record_date)
+
+    # Leave edits and other changes logged since the client's version
+    changes = db.session.query(DataVersion).filter(DataVersion.id > since_change_id).order_by(DataVersion.id)
+    period_day = date(int(year), int(month), 1) if year and month else None
+    moved_employees = set()
+    for change in changes:
+        if change.kind == 'reset':
+            return {'reload': True, 'cells': {}}
+        if change.kind == 'settings':
+            continue
+        if change.kind == 'period':
+            if period_day is not None:
+                affected = change.start_date <= period_day <= change.end_date
+            else:
+                affected = change.start_date <= end_date and change.end_date >= start_date
+            if affected:
+                return {'reload': True, 'cells': {}}
+            continue
+        if change.kind == 'employee':
+            if change.employee_id is None or change.employee_id in employee_set:
+                return {'reload': True, 'cells': {}}
+            # An employee may have moved into the displayed scope
+            moved_employees.add(change.employee_id)
+            continue
+        if change.employee_id is None:
+            return {'reload': True, 'cells': {}}
+        if change.employee_id not in employee_set:
+            continue
+
+        change_start = max(change.start_date or start_date, start_date)
+        change_end = min(change.end_date or end_date, end_date)
+        if change_start > change_end:
+            continue
+        days = cells.setdefault(change.employee_id, set())
+        day = change_start
+        while day <= change_end:
+            days.add(day)
+            day += timedelta(days=1)
+
+    if moved_employees:
+        in_scope = db.session.query(Employee.id).filter(Employee.id.in_(moved_employees), Employee.active == True)
+        if department_id:
+            in_scope = in_scope.filter(Employee.department_id == int(department_id))
+        if housing_id:
+            in_scope = in_scope.filter(Employee.housing_id == int(housing_id))
+        if in_scope.first() is not None:
+            return {'reload': True, 'cells': {}}
+
+    return {'reload': False, 'cells': cells}
@@ -1,5 +1,9 @@
+from contextlib import contextmanager
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
 
 # Set up database
 Base = declarative_base()
@@ -8,3 +12,56 @@ db = SQLAlchemy(model_class=Base)
 def init_db(app):
     """Initialize the database with the Flask app"""
     db.init_app(app)
+
+# Bind key of the optional read replica (SQLALCHEMY_BINDS)
+REPLICA_BIND = 'replica'
+
+class ReadOnlySessionError(RuntimeError):
+    """Raised when code running on a read-only session tries to write"""
+
+def _refuse_flush(session, flush_context, instances):
+    raise ReadOnlySessionError("Cannot write from a read-only session")
+
+def _refuse_writes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        raise ReadOnlySessionError("Cannot write from a read-only session")
+
+def _begin_read_only(session, transaction, connection):
+    # Let PostgreSQL enforce it too
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+
+@contextmanager
+def read_only_session():
+    """
+    Make db.session a read-only session for the duration of the block.
+
+    The session reads from the read replica when one is configured (the
+    'replica' bind), otherwise from the main database. Flushes and INSERT/
+    UPDATE/DELETE statements raise ReadOnlySessionError, and the transaction
+    is always rolled back. Nested blocks share the outer session.
+    """
+    registry = db.session.registry
+    previous = registry() if registry.has() else None
+    if previous is not None and previous.info.get('read_only'):
+        yield previous
+        return
+
+    engine = db.engines.get(REPLICA_BIND) or db.engine
+    session = Session(bind=engine, autoflush=False, expire_on_commit=False, info={'read_only': True})
+    event.listen(session, 'before_flush', _refuse_flush)
+    event.listen(session, 'do_orm_execute', _refuse_writes)
+    event.listen(session, 'after_begin', _begin_read_only)
+
+    registry.set(session)
+    try:
+        yield session
+    finally:
+        try:
+            session.rollback()
+        finally:
+            session.close()
+            if previous is not None:
+                registry.set(previous)
+            else:
+                registry.clear()
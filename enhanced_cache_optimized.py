@@ -1,245 +1,267 @@
 """
 Enhanced caching implementation for the Housing Maintenance application
 with improved performance and memory management
+
+The timesheet and statistics caches are namespaces of the shared tiered
+cache (see tiered_cache): entries live in the byte-bounded memory tier and on
+disk under instance/cache/timesheets and instance/cache/stats.
 """
 import os
 import time
-import pickle
 import hashlib
 import logging
+import threading
+from collections import deque, Counter
+from contextlib import contextmanager
 from functools import wraps
-from datetime import datetime, timedelta
-from flask import current_app, g, request, session
+from datetime import datetime
+
+from tiered_cache import cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Create cache directory
-CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cache')
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-# Create timesheet cache directory
-TIMESHEET_CACHE_DIR = os.path.join(CACHE_DIR, 'timesheets')
-os.makedirs(TIMESHEET_CACHE_DIR, exist_ok=True)
-
-# In-memory LRU cache for most frequently accessed items
-MEMORY_CACHE = {}
-MEMORY_CACHE_MAX_SIZE = 150  # Increased from 100 to 150
-MEMORY_CACHE_TIMESTAMPS = {}  # Track when items were added to cache
-
-# In-memory timesheet cache
-_timesheet_cache = {}
-
-class EnhancedCache:
-    """Enhanced caching class with both memory and disk caching"""
-
-    def __init__(self, cache_dir=CACHE_DIR, timeout=3600, max_memory_items=MEMORY_CACHE_MAX_SIZE):
-        """Initialize the cache"""
-        self.cache_dir = cache_dir
-        self.timeout = timeout
-        self.max_memory_items = max_memory_items
-        os.makedirs(cache_dir, exist_ok=True)
-
-    def _get_cache_path(self, key):
-        """Get the file path for a cache key"""
-        if len(key) > 40:  # If key is too long, hash it
-            key = hashlib.md5(key.encode()).hexdigest()
-        return os.path.join(self.cache_dir, f"{key}.pkl")
-
-    def get(self, key, default=None):
-        """Get an item from cache (memory first, then disk)"""
-        # Try memory cache first (fastest)
-        if key in MEMORY_CACHE:
-            timestamp = MEMORY_CACHE_TIMESTAMPS.get(key, 0)
-            if time.time() - timestamp <= self.timeout:
-                return MEMORY_CACHE[key]
-            else:
-                # Expired, remove from memory
-                self._remove_from_memory(key)
-
-        # Try disk cache next
-        cache_path = self._get_cache_path(key)
-        if os.path.exists(cache_path):
-            try:
-                # Check if file is expired
-                modified_time = os.path.getmtime(cache_path)
-                if time.time() - modified_time <= self.timeout:
-                    with open(cache_path, 'rb') as f:
-                        data = pickle.load(f)
-
-                    # Store in memory for faster access next time
-                    self._add_to_memory(key, data)
-                    return data
-                else:
-                    # Expired, remove file
-                    try:
-                        os.unlink(cache_path)
-                    except:
-                        pass
-            except Exception as e:
-                logger.error(f"Error reading cache file {cache_path}: {str(e)}")
-
-        return default
-
-    def set(self, key, value, timeout=None):
-        """Set an item in cache (both memory and disk)"""
-        if timeout is None:
-            timeout = self.timeout
-
-        # Store in memory
-        self._add_to_memory(key, value)
-
-        # Store in disk
-        cache_path = self._get_cache_path(key)
-        try:
-            with open(cache_path, 'wb') as f:
-                pickle.dump(value, f)
-            return True
-        except Exception as e:
-            logger.error(f"Error writing to cache file {cache_path}: {str(e)}")
-            return False
-
-    def delete(self, key):
-        """Delete an item from cache (both memory and disk)"""
-        # Remove from memory
-        self._remove_from_memory(key)
-
-        # Remove from disk
-        cache_path = self._get_cache_path(key)
-        if os.path.exists(cache_path):
-            try:
-                os.unlink(cache_path)
-                return True
-            except Exception as e:
-                logger.error(f"Error removing cache file {cache_path}: {str(e)}")
-        return False
-
-    def clear(self, pattern=None):
-        """Clear all cache entries or those matching a pattern"""
-        # Clear memory cache
-        if pattern:
-            keys_to_remove = [k for k in MEMORY_CACHE if pattern in k]
-            for k in keys_to_remove:
-                self._remove_from_memory(k)
-        else:
-            MEMORY_CACHE.clear()
-            MEMORY_CACHE_TIMESTAMPS.clear()
-
-        # Clear disk cache
+class CacheAccessLog:
+    """
+    Bounded log of recent cache lookups.
+
+    Each entry records which cached function was called, with which arguments,
+    and whether it was a hit. The warm-up job reads it to decide which entries
+    are worth rebuilding after the cache has been invalidated.
+    """
+
+    def __init__(self, max_entries=5000, window=7 * 24 * 3600):
+        self.window = window
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, name, args=(), kwargs=None, hit=False):
+        """Record one lookup (ignored inside ``suppressed()``)"""
+        if getattr(self._local, 'suppressed', False):
+            return
+        entry = (time.time(), name, tuple(args), tuple(sorted((kwargs or {}).items())), hit)
+        with self._lock:
+            self._entries.append(entry)
+
+    @contextmanager
+    def suppressed(self):
+        """Don't record lookups made by the current thread (e.g. by the warm-up job itself)"""
+        previous = getattr(self._local, 'suppressed', False)
+        self._local.suppressed = True
         try:
-            removed = 0
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.pkl') and (not pattern or pattern in filename):
-                    try:
-                        os.unlink(os.path.join(self.cache_dir, filename))
-                        removed += 1
-                    except:
-                        pass
-            return removed
-        except Exception as e:
-            logger.error(f"Error clearing cache: {str(e)}")
-            return 0
-
-    def _add_to_memory(self, key, value):
-        """Add an item to memory cache with LRU eviction"""
-        # If cache is full, remove oldest item
-        if len(MEMORY_CACHE) >= self.max_memory_items:
-            oldest_key = min(MEMORY_CACHE_TIMESTAMPS.items(), key=lambda x: x[1])[0]
-            self._remove_from_memory(oldest_key)
-
-        # Add to memory cache
-        MEMORY_CACHE[key] = value
-        MEMORY_CACHE_TIMESTAMPS[key] = time.time()
-
-    def _remove_from_memory(self, key):
-        """Remove an item from memory cache"""
-        if key in MEMORY_CACHE:
-            del MEMORY_CACHE[key]
-        if key in MEMORY_CACHE_TIMESTAMPS:
-            del MEMORY_CACHE_TIMESTAMPS[key]
-
-# Create timesheet cache instance with 2 hour timeout
-timesheet_cache = EnhancedCache(
-    cache_dir=TIMESHEET_CACHE_DIR,
-    timeout=7200,  # 2 hours
-    max_memory_items=75  # Increased from 50 to 75
-)
+            yield
+        finally:
+            self._local.suppressed = previous
+
+    def recent(self, name, window=None):
+        """Get (args, kwargs_dict, hit) for the recent lookups of one cached function"""
+        cutoff = time.time() - (window or self.window)
+        with self._lock:
+            entries = list(self._entries)
+        return [(args, dict(kwargs), hit) for ts, entry_name, args, kwargs, hit in entries
+                if entry_name == name and ts >= cutoff]
+
+    def most_common(self, name, key, limit=10, window=None):
+        """
+        Rank the recent lookups of one cached function.
+
+        Args:
+            name: Cached function name
+            key: Callable mapping (args, kwargs) to the value to count, or None to skip the lookup
+            limit: Maximum number of values to return
+            window: Optional look-back in seconds (defaults to the log's window)
+
+        Returns:
+            List of the most frequent values, most used first
+        """
+        counts = Counter()
+        for args, kwargs, hit in self.recent(name, window):
+            value = key(args, kwargs)
+            if value is not None:
+                counts[value] += 1
+        return [value for value, count in counts.most_common(limit)]
+
+    def clear(self):
+        """Forget every recorded lookup"""
+        with self._lock:
+            self._entries.clear()
+
+# Shared access log for the timesheet and statistics caches
+cache_access_log = CacheAccessLog()
+
+# Byte budget of the timesheets in the memory tier (least recently used evicted first)
+TIMESHEET_MEMORY_MAX_BYTES = int(os.environ.get('TIMESHEET_CACHE_MEMORY_MAX_BYTES', 48 * 1024 * 1024))
+
+# Timesheets (2 hours, served 10 more minutes while rebuilt): the memory tier
+# keeps them frozen and every read returns the same read-only timesheet, so a
+# hit costs no copy (decorate rows with timesheet_rows.Overlay). Stored on disk
+# in the compressed columnar timesheet format (see cache_serializers).
+timesheet_cache = cache.namespace('timesheets', ttl=7200, disk=True, frozen=True, stale_ttl=600,
+                                  serializer='timesheet', max_memory_bytes=TIMESHEET_MEMORY_MAX_BYTES)
+
+# Statistics (15 minutes, served 5 more minutes while rebuilt)
+stats_cache = cache.namespace('stats', ttl=900, disk=True, stale_ttl=300)
 
 def clear_timesheet_cache():
-    """Clear all timesheet cache entries"""
-    global _timesheet_cache
-    had_entries = len(_timesheet_cache) > 0
-    _timesheet_cache = {}
-    return had_entries
+    """Drop the timesheets held in memory (the disk tier is kept)"""
+    return timesheet_cache.clear_memory() > 0
+
+def invalidate_timesheets():
+    """
+    Drop every cached timesheet, in memory and on disk, after the data changed.
+    The attendance statistics are derived from the same records and go too.
+    """
+    stats_cache.clear()
+    return timesheet_cache.clear()
+
+def invalidate_timesheet_tags(*tags):
+    """
+    Drop the cached timesheets carrying any of the tags (see cache_tags), after
+    a change limited to some departments, housings or employees. The attendance
+    statistics are derived from the same records and go too.
+
+    Returns:
+        Number of timesheet entries dropped (memory entries plus disk files)
+    """
+    stats_cache.clear()
+    return timesheet_cache.invalidate(*tags)
+
+def make_timesheet_cache_key(args, kwargs):
+    """Build the cache key for a timesheet call from its arguments"""
+    key_parts = [str(arg) for arg in args]
+
+    # Add sorted kwargs
+    for k in sorted(kwargs.keys()):
+        if k != 'force_refresh':  # Skip force_refresh in cache key
+            key_parts.append(f"{k}:{kwargs[k]}")
 
-def cached_timesheet(func):
+    # Join parts and hash
+    key = "_".join(key_parts)
+    return hashlib.md5(key.encode()).hexdigest()
+
+def cached_timesheet(func=None, tags=None):
     """
-    Decorator to cache timesheet data in memory.
-    Ensures all SQLAlchemy objects are properly converted to dictionaries.
-    Uses a more efficient caching strategy with deep copy for thread safety.
+    Decorator to cache timesheet data in timesheet_cache.
+    Cached results are frozen and shared (see timesheet_rows.freeze_timesheet):
+    callers copy the dictionary (dict(result)) to add keys and wrap rows in
+    an Overlay to decorate them.
+    Concurrent requests for a missing timesheet are coalesced into one build,
+    and an expired timesheet is served for a while longer to the requests
+    arriving while it is rebuilt (see TieredCache.get_or_compute).
+
+    Entries written ahead of time with ``prime`` (e.g. by the month-end batch
+    job) are stored the same way.
+
+    Args:
+        func: Timesheet builder (when used as a bare decorator)
+        tags: Optional callable (result, args, kwargs) returning the tags of a
+            cached result, for invalidate_timesheet_tags
     """
+    if func is None:
+        return lambda func: cached_timesheet(func, tags)
+
+    def entry_tags(args, kwargs):
+        return (lambda result: tags(result, args, kwargs)) if tags else None
+
     @wraps(func)
     def decorated_function(*args, **kwargs):
         # Skip cache if force_refresh is True
         if kwargs.get('force_refresh'):
             kwargs.pop('force_refresh', None)
+            cache_access_log.record(func.__name__, args, kwargs, hit=False)
             return func(*args, **kwargs)
+        kwargs.pop('force_refresh', None)
 
         # Create a cache key
-        key_parts = [str(arg) for arg in args]
-
-        # Add sorted kwargs
-        for k in sorted(kwargs.keys()):
-            if k != 'force_refresh':  # Skip force_refresh in cache key
-                key_parts.append(f"{k}:{kwargs[k]}")
-
-        # Join parts and hash
-        key = "_".join(key_parts)
-        cache_key = hashlib.md5(key.encode()).hexdigest()
-
-        # Check if the result is in the cache
-        global _timesheet_cache
-        if cache_key in _timesheet_cache:
-            # Use a deep copy of the cached data to ensure it's a completely separate object
-            import copy
-            return copy.deepcopy(_timesheet_cache[cache_key])
-
-        # Call the original function
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        execution_time = time.time() - start_time
-
-        # Store in memory cache - ensure result is not None and has employees data
-        if result and isinstance(result, dict):
-            _timesheet_cache[cache_key] = result
-            logger.info(f"Cached timesheet with {len(result.get('employees', []))} employees for {args[0]}/{args[1]} in {execution_time:.2f}s")
+        cache_key = make_timesheet_cache_key(args, kwargs)
+
+        # Concurrent misses for the key wait for one build (or get the stale timesheet)
+        built = []
+
+        def build():
+            built.append(True)
+            start_time = time.time()
+            result = func(*args, **kwargs)
+            if result and isinstance(result, dict):
+                logger.info(f"Cached timesheet with {len(result.get('employees', []))} employees for {args[0]}/{args[1]} in {time.time() - start_time:.2f}s")
+            return result
+
+        # Store in cache - ensure result is a timesheet, not the error a failed build returns
+        result = timesheet_cache.get_or_compute(
+            cache_key, build,
+            should_cache=lambda result: bool(result) and isinstance(result, dict) and not result.get('error'),
+            tags=entry_tags(args, kwargs)
+        )
+        cache_access_log.record(func.__name__, args, kwargs, hit=not built)
+        return result
+
+    def prime(result, *args, generation=None, **kwargs):
+        """
+        Store a prebuilt result under the key a call with these arguments would
+        use. Pass the tag generation read before building it (see
+        TieredCache.tag_generation) to skip it if its tags were invalidated since.
+        """
+        cache_key = make_timesheet_cache_key(args, kwargs)
+        timesheet_cache.set(cache_key, result, tags=tags(result, args, kwargs) if tags else None,
+                            generation=generation)
+        return cache_key
+
+    def peek(*args, **kwargs):
+        """
+        Get the cached result a call with these arguments would return, without
+        building it on a miss or recording the lookup.
+        """
+        kwargs.pop('force_refresh', None)
+        return timesheet_cache.get(make_timesheet_cache_key(args, kwargs))
+
+    decorated_function.prime = prime
+    decorated_function.peek = peek
+    return decorated_function
+
+def cached_statistics(func):
+    """
+    Decorator to cache a statistics builder (dashboard summary, department
+    statistics) in stats_cache. Entries are keyed by the arguments and today's
+    date, so they roll over at midnight. Pass force_refresh=True to rebuild.
+    """
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        force_refresh = kwargs.pop('force_refresh', False)
+        key_parts = [func.__name__, datetime.now().date().isoformat()] + [str(arg) for arg in args]
+        key_parts += [f"{k}:{kwargs[k]}" for k in sorted(kwargs)]
+        cache_key = hashlib.md5("_".join(key_parts).encode()).hexdigest()
+
+        if force_refresh:
+            cache_access_log.record(func.__name__, args, kwargs, hit=False)
+            result = func(*args, **kwargs)
+            if result is not None:
+                stats_cache.set(cache_key, result)
+            return result
+
+        built = []
+
+        def build():
+            built.append(True)
+            return func(*args, **kwargs)
 
+        result = stats_cache.get_or_compute(cache_key, build, should_cache=lambda result: result is not None)
+        cache_access_log.record(func.__name__, args, kwargs, hit=not built)
         return result
+
     return decorated_function
 
 def get_cache_stats():
-    """Get statistics about cache usage"""
-    memory_items = len(MEMORY_CACHE)
-    timesheet_items = len(_timesheet_cache)
-
-    # Count disk cache items and size
-    disk_items = 0
-    disk_size = 0
-    try:
-        for filename in os.listdir(TIMESHEET_CACHE_DIR):
-            if filename.endswith('.pkl'):
-                disk_items += 1
-                disk_size += os.path.getsize(os.path.join(TIMESHEET_CACHE_DIR, filename))
-    except:
-        pass
-
-    return {
-        'memory_items': memory_items,
-        'timesheet_items': timesheet_items,
-        'disk_items': disk_items,
-        'disk_size_mb': round(disk_size / (1024 * 1024), 2)
-    }
+    """Get statistics about cache usage (see TieredCache.stats)"""
+    stats = cache.stats()
+    timesheets = stats['namespaces']['timesheets']
+    return dict(
+        stats,
+        timesheet_items=timesheets['memory_items'],
+        disk_items=timesheets['disk_items'],
+        disk_size_mb=round(timesheets['disk_bytes'] / (1024 * 1024), 2)
+    )
 
 def attendance_record_to_dict(record):
     """Convert an AttendanceRecord object to a dictionary to prevent DetachedInstanceError"""
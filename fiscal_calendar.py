@@ -0,0 +1,175 @@
+"""
+Fiscal calendar service.
+
+Keeps every MonthPeriod in memory together with precomputed date vectors,
+day-of-week vectors and weekend masks, so timesheet, export and AI code no
+longer query the month_periods table or walk dates day by day. The periods
+come from the reference data snapshot (see reference_data), reloaded by every
+worker once a period is saved.
+"""
+
+import calendar
+import logging
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+class DateRange:
+    """Immutable run of consecutive dates with precomputed weekday data"""
+
+    __slots__ = ('start_date', 'end_date', 'dates', 'weekdays', '_weekend_masks')
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        length = max((end_date - start_date).days + 1, 0)
+        self.dates = tuple(start_date + timedelta(days=i) for i in range(length))
+        first_weekday = start_date.weekday()
+        self.weekdays = tuple((first_weekday + i) % 7 for i in range(length))
+        self._weekend_masks = {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def weekend_mask(self, weekend_days):
+        """
+        Get a tuple of booleans marking which dates fall on a weekend.
+
+        Args:
+            weekend_days: Iterable of Python weekday numbers (0=Monday)
+
+        Returns:
+            Tuple of booleans aligned with self.dates
+        """
+        key = frozenset(int(day) for day in weekend_days or ())
+        mask = self._weekend_masks.get(key)
+        if mask is None:
+            mask = tuple(weekday in key for weekday in self.weekdays)
+            self._weekend_masks[key] = mask
+        return mask
+
+    def count_working_days(self, weekend_days):
+        """Number of dates in the range that are not weekend days"""
+        return self.weekend_mask(weekend_days).count(False)
+
+
+class FiscalPeriod:
+    """A configured MonthPeriod with its date vector"""
+
+    __slots__ = ('month_code', 'year', 'month', 'start_date', 'end_date',
+                 'days_in_month', 'hours_in_month', 'date_range')
+
+    def __init__(self, month_code, start_date, end_date, days_in_month, hours_in_month):
+        self.month_code = month_code
+        month_part, year_part = month_code.split('/')
+        self.month = int(month_part)
+        self.year = 2000 + int(year_part)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.days_in_month = days_in_month
+        self.hours_in_month = hours_in_month
+        self.date_range = get_date_range(start_date, end_date)
+
+    @property
+    def dates(self):
+        return self.date_range.dates
+
+    @property
+    def weekdays(self):
+        return self.date_range.weekdays
+
+    def weekend_mask(self, weekend_days):
+        return self.date_range.weekend_mask(weekend_days)
+
+    def __repr__(self):
+        return f'<FiscalPeriod {self.month_code}: {self.start_date} to {self.end_date}>'
+
+
+@lru_cache(maxsize=256)
+def get_date_range(start_date, end_date):
+    """Get the shared DateRange for a start/end pair"""
+    return DateRange(start_date, end_date)
+
+
+def format_month_code(year, month):
+    """Format year and month as a MonthPeriod code (MM/YY)"""
+    return f"{int(month):02d}/{str(int(year))[2:4]}"
+
+
+def calendar_month_bounds(year, month):
+    """Get the first and last day of a calendar month"""
+    year = int(year)
+    month = int(month)
+    _, last_day = calendar.monthrange(year, month)
+    return date(year, month, 1), date(year, month, last_day)
+
+
+class FiscalCalendar:
+    """In-memory view of all configured month periods"""
+
+    def _get_periods(self):
+        """Configured periods by month code, from the shared reference data snapshot"""
+        from reference_data import get_reference_snapshot
+        return get_reference_snapshot().month_periods
+
+    def invalidate(self):
+        """Drop the loaded periods so the next lookup reloads them"""
+        from reference_data import reference_data
+        reference_data.invalidate()
+
+    def get_period(self, year, month):
+        """Get the configured FiscalPeriod for a month, or None"""
+        return self._get_periods().get(format_month_code(year, month))
+
+    def all_periods(self):
+        """Get all configured periods ordered by start date"""
+        return sorted(self._get_periods().values(), key=lambda p: p.start_date)
+
+    def month_bounds(self, year, month):
+        """
+        Get the start and end dates of a month using the fiscal calendar,
+        falling back to the calendar month when no period is configured.
+        """
+        period = self.get_period(year, month)
+        if period:
+            return period.start_date, period.end_date
+        return calendar_month_bounds(year, month)
+
+    def month_days(self, year, month):
+        """Number of days in a month based on the fiscal calendar"""
+        period = self.get_period(year, month)
+        if period:
+            return period.days_in_month
+        return calendar.monthrange(int(year), int(month))[1]
+
+    def month_dates_config(self):
+        """
+        Month configuration keyed by month number, as used by the timesheet
+        and settings pages ({month: {'start': 'YYYY-MM-DD', 'end': 'YYYY-MM-DD'}}).
+        """
+        month_dates = {}
+        for period in self.all_periods():
+            month_dates[period.month] = {
+                'start': period.start_date.strftime('%Y-%m-%d'),
+                'end': period.end_date.strftime('%Y-%m-%d')
+            }
+        return month_dates
+
+    def date_range(self, start_date, end_date):
+        """Get the DateRange for an arbitrary start/end pair"""
+        return get_date_range(start_date, end_date)
+
+    def trailing_range(self, days, end_date=None):
+        """
+        Get the DateRange covering the last ``days`` days up to end_date (inclusive).
+        Used by analytics code for rolling windows.
+        """
+        if end_date is None:
+            end_date = datetime.now().date()
+        return get_date_range(end_date - timedelta(days=days), end_date)
+
+
+# Shared calendar instance
+fiscal_calendar = FiscalCalendar()
@@ -0,0 +1,133 @@
+"""
+Daily housing attribution.
+
+Each attendance day is attributed to one housing, using the check-in-first
+rule: the housing of the check-in terminal, or of the check-out terminal
+when the check-in terminal belongs to no housing. The attribution is stored
+in EmployeeDailyHousing. The sync refreshes it for the records it wrote, so
+timesheets read it instead of mapping raw terminal aliases on every request.
+"""
+
+import logging
+
+from sqlalchemy import and_, case, delete, func, insert, or_, select
+from sqlalchemy.orm import aliased
+
+from models import AttendanceRecord, BiometricTerminal, EmployeeDailyHousing
+
+logger = logging.getLogger(__name__)
+
+
+def _record_filters(employee_ids=None, start_date=None, end_date=None, terminal_aliases=None, sync_id=None):
+    """Build the AttendanceRecord filters selecting the days to refresh"""
+    filters = []
+    if sync_id is not None:
+        filters.append(AttendanceRecord.sync_id == sync_id)
+    if employee_ids is not None:
+        filters.append(AttendanceRecord.employee_id.in_(employee_ids))
+    if start_date:
+        filters.append(AttendanceRecord.date >= start_date)
+    if end_date:
+        filters.append(AttendanceRecord.date <= end_date)
+    if terminal_aliases is not None:
+        filters.append(or_(AttendanceRecord.terminal_alias_in.in_(terminal_aliases),
+                           AttendanceRecord.terminal_alias_out.in_(terminal_aliases)))
+    return filters
+
+
+def refresh_daily_housing(employee_ids=None, start_date=None, end_date=None, terminal_aliases=None,
+                          sync_id=None):
+    """
+    Recompute the housing attribution of the matching attendance days in two
+    set-based statements. Everything is recomputed when no filter is given.
+    The caller commits.
+
+    Args:
+        employee_ids: Optional employee IDs to restrict to
+        start_date: Optional first date (inclusive)
+        end_date: Optional last date (inclusive)
+        terminal_aliases: Optional terminal aliases; only days using one of
+                          them (to clock in or out) are refreshed
+        sync_id: Optional sync ID; only days written by that sync are refreshed
+
+    Returns:
+        Number of attributed days written
+    """
+    from database import db
+
+    filters = _record_filters(employee_ids, start_date, end_date, terminal_aliases, sync_id)
+
+    # Drop the current attribution of the matching days ...
+    matching_day = select(AttendanceRecord.id).where(
+        AttendanceRecord.employee_id == EmployeeDailyHousing.employee_id,
+        AttendanceRecord.date == EmployeeDailyHousing.date,
+        *filters
+    ).exists()
+    db.session.execute(delete(EmployeeDailyHousing).where(matching_day).execution_options(synchronize_session=False))
+
+    # ... and attribute them again: check-in terminal first, then check-out terminal
+    terminal_in = aliased(BiometricTerminal)
+    terminal_out = aliased(BiometricTerminal)
+    housing_id = func.coalesce(terminal_in.housing_id, terminal_out.housing_id)
+    attributed = select(
+        AttendanceRecord.employee_id,
+        AttendanceRecord.date,
+        housing_id,
+        case((terminal_in.housing_id.isnot(None), AttendanceRecord.terminal_alias_in),
+             else_=AttendanceRecord.terminal_alias_out)
+    ).select_from(AttendanceRecord).outerjoin(
+        terminal_in, and_(terminal_in.terminal_alias == AttendanceRecord.terminal_alias_in,
+                          terminal_in.housing_id.isnot(None))
+    ).outerjoin(
+        terminal_out, and_(terminal_out.terminal_alias == AttendanceRecord.terminal_alias_out,
+                           terminal_out.housing_id.isnot(None))
+    ).where(housing_id.isnot(None), *filters)
+
+    result = db.session.execute(insert(EmployeeDailyHousing).from_select(
+        ['employee_id', 'date', 'housing_id', 'terminal_alias'], attributed
+    ))
+    written = result.rowcount if result.rowcount is not None and result.rowcount >= 0 else 0
+    logger.info(f"Refreshed daily housing attribution: {written} days")
+    return written
+
+
+def employees_using_terminals(terminal_aliases):
+    """
+    IDs of the employees with attendance clocked in or out on any of the
+    terminals (whose days a change of those terminals re-attributes).
+    """
+    from database import db
+
+    query = db.session.query(AttendanceRecord.employee_id).filter(
+        *_record_filters(terminal_aliases=terminal_aliases)
+    ).distinct()
+    return [employee_id for (employee_id,) in query]
+
+
+def load_daily_housing(employee_ids, start_date, end_date):
+    """
+    Load the housing attribution of a date range.
+
+    Args:
+        employee_ids: Employee IDs to load, or None for every employee
+        start_date: First date (inclusive)
+        end_date: Last date (inclusive)
+
+    Returns:
+        Dictionary {employee_id: {date: housing_id}}
+    """
+    from database import db
+
+    query = db.session.query(
+        EmployeeDailyHousing.employee_id, EmployeeDailyHousing.date, EmployeeDailyHousing.housing_id
+    ).filter(
+        EmployeeDailyHousing.date >= start_date,
+        EmployeeDailyHousing.date <= end_date
+    )
+    if employee_ids is not None:
+        query = query.filter(EmployeeDailyHousing.employee_id.in_(employee_ids))
+
+    daily_housing = {}
+    for employee_id, day, housing_id in query:
+        daily_housing.setdefault(employee_id, {})[day] = housing_id
+    return daily_housing
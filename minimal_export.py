@@ -1,8 +1,8 @@
 from flask import Flask, render_template, request, redirect, url_for, flash
 from datetime import datetime, timedelta
-import copy
 import logging
 from optimized_timesheet import optimized_generate_timesheet
+from timesheet_rows import Overlay
 
 # تعريف مسار للتصدير البسيط للدوام
 def export_minimal_timesheet(app):
@@ -19,9 +19,10 @@ def export_minimal_timesheet(app):
         print(f"*** تصدير PDF للدوام: سنة={year}, شهر={month}, قسم={dept_id}, سكن={housing_id}")
         
         try:
-            # إجبار إعادة تحميل البيانات للحصول على أحدث المعلومات
+            # البيانات من الذاكرة المؤقتة ما لم يُطلب التحديث
+            force_refresh = request.args.get('refresh', '').lower() in ('true', '1', 'yes')
             timesheet_data = optimized_generate_timesheet(
-                year, month, dept_id, None, None, housing_id, force_refresh=True
+                year, month, dept_id, None, None, housing_id, force_refresh=force_refresh
             )
             
             # معالجة بيانات الموظفين والتواريخ
@@ -30,16 +31,14 @@ def export_minimal_timesheet(app):
             weekend_days = timesheet_data.get('weekend_days', [5, 6])  # الجمعة والسبت افتراضياً
             
             # إضافة معلومات التاريخ بتنسيق سلسلة نصية لكل سجل حضور
-            for employee in employees:
-                for att in employee.get('attendance', []):
-                    if 'date' in att:
-                        try:
-                            if hasattr(att['date'], 'strftime'):
-                                att['date_str'] = att['date'].strftime('%Y-%m-%d')
-                            else:
-                                att['date_str'] = str(att['date'])
-                        except Exception as e:
-                            print(f"خطأ في معالجة تاريخ الحضور: {e}")
+            # (عبر Overlay لأن صفوف كشف الدوام المخزنة مجمدة ومشتركة، دون نسخها)
+            employees = [
+                Overlay(employee, attendance=[
+                    Overlay(att, date_str=att['date'].strftime('%Y-%m-%d') if hasattr(att['date'], 'strftime') else str(att['date']))
+                    for att in employee.get('attendance', [])
+                ])
+                for employee in employees
+            ]
             
             # الحصول على اسم القسم إذا تم تحديده
             from models import Department, Housing
@@ -79,9 +78,7 @@ def export_minimal_timesheet(app):
                             present_days += 1
                     
                     emp['total_work_hours'] = total_hours
-                    emp['present_days'] = present_days            # إنشاء نسخة عميقة من البيانات لتجنب أي تعديلات أثناء عرض القالب
-            employees_copy = copy.deepcopy(employees)
-            dates_copy = copy.deepcopy(dates)
+                    emp['present_days'] = present_days
             
             # تعريف دالة now() لاستخدامها في القالب
             def now():
@@ -89,8 +86,8 @@ def export_minimal_timesheet(app):
               # عرض القالب البسيط مع البيانات
             return render_template(
                 'minimal_timesheet.html',
-                employees=employees_copy,
-                dates=dates_copy,
+                employees=employees,
+                dates=dates,
                 weekend_days=weekend_days,
                 department_name=department_name,
                 housing_name=housing_name,
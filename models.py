@@ -262,3 +262,46 @@ class SystemSettings(db.Model):
 
     def __repr__(self):
         return f'<SystemSettings {self.key}>'
+
+class DataVersion(db.Model):
+    """Change log of edits that affect timesheets (leave edits, employee moves, period and settings edits, data resets)"""
+    __tablename__ = 'data_versions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # leave, employee, period, settings, reset
+    employee_id = db.Column(db.Integer, nullable=True)  # None = every employee
+    start_date = db.Column(db.Date, nullable=True)
+    end_date = db.Column(db.Date, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<DataVersion {self.id}: {self.kind} employee={self.employee_id}>'
+
+class ReferenceVersion(db.Model):
+    """Version of the reference data (departments, housings, terminals, month periods), bumped by every edit"""
+    __tablename__ = 'reference_versions'
+
+    id = db.Column(db.Integer, primary_key=True)  # Single row (see reference_data.VERSION_ROW_ID)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ReferenceVersion {self.version}>'
+
+class EmployeeDailyHousing(db.Model):
+    """Housing an employee is attributed to on a day, computed from the day's terminals at sync time"""
+    __tablename__ = 'employee_daily_housing'
+
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    housing_id = db.Column(db.Integer, db.ForeignKey('housings.id'), nullable=False)
+    terminal_alias = db.Column(db.String(100))  # Terminal the attribution comes from
+
+    __table_args__ = (
+        db.Index('idx_daily_housing_employee_date', 'employee_id', 'date'),
+        db.Index('idx_daily_housing_housing_date', 'housing_id', 'date'),
+    )
+
+    def __repr__(self):
+        return f'<EmployeeDailyHousing {self.employee_id} {self.date}: {self.housing_id}>'
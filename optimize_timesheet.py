@@ -31,7 +31,8 @@ try:
     from app import app, db
     from models import AttendanceRecord, Employee, Housing, BiometricTerminal, Department
     from data_processor import generate_timesheet
-    from cache_manager import clear_cache, disk_cache, get_cache_stats
+    from cache_manager import disk_cache, get_cache_stats
+    from enhanced_cache_optimized import invalidate_timesheets
 except ImportError as e:
     logger.error(f"Error importing modules: {str(e)}")
     sys.exit(1)
@@ -253,7 +254,7 @@ def test_timesheet_performance():
         print("Cache stats before test:", get_cache_stats())
         
         # Clear cache to ensure a fresh test
-        clear_cache("timesheet_")
+        invalidate_timesheets()
         
         print("\nTesting timesheet performance...")
         
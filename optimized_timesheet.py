@@ -1,18 +1,139 @@
 """
 Optimized version of the timesheet generation function with improved performance,
 reduced database queries, and effective caching.
+
+The building blocks below (loading, overlays, row aggregation) are the stages
+of the timesheet engine (see timesheet_engine), which every timesheet goes through.
 """
 
 import time
+import json
+import base64
 import logging
+import threading
 from datetime import datetime, date, timedelta
-from collections import defaultdict
-from flask import session
-from sqlalchemy.orm import joinedload
-from enhanced_cache import cached_timesheet
+from collections import defaultdict, namedtuple
+import cache_tags
+from enhanced_cache_optimized import cached_timesheet
+from fiscal_calendar import fiscal_calendar, calendar_month_bounds
+from settings_cache import resolve_weekend_days
+from models import Employee, AttendanceRecord
+from timesheet_rows import TimesheetRecord, TimesheetDays, TimesheetRow
 
 logger = logging.getLogger(__name__)
 
+# Employees whose rows are built at a time by stream_timesheet
+STREAM_CHUNK_SIZE = 200
+
+# Cached active-employee counts per (department_id, housing_id) scope, with
+# the DataVersion change id they were counted at. Every worker logs added,
+# removed and moved employees as DataVersion rows (see data_versions), so a
+# count is reused while the last change id is unchanged: paginated timesheet
+# pages run a primary key MAX() instead of COUNT(*).
+_employee_count_cache = {}
+_employee_count_lock = threading.Lock()
+
+def invalidate_employee_count_cache():
+    """Forget all cached employee counts"""
+    with _employee_count_lock:
+        _employee_count_cache.clear()
+
+def _normalize_scope_id(value):
+    """Normalize a department/housing filter value to an int or None"""
+    if value in (None, '', 'None'):
+        return None
+    return int(value)
+
+def get_employee_count(department_id=None, housing_id=None):
+    """
+    Get the number of active employees in a timesheet scope.
+
+    The count is computed once per scope and then served from memory until
+    any worker logs a data change (see data_versions.current_change_id).
+    """
+    from data_versions import current_change_id
+
+    department_id = _normalize_scope_id(department_id)
+    housing_id = _normalize_scope_id(housing_id)
+    scope = (department_id, housing_id)
+    change_id = current_change_id()
+
+    with _employee_count_lock:
+        cached = _employee_count_cache.get(scope)
+        if cached is not None and cached[0] == change_id:
+            return cached[1]
+
+    from database import db
+    query = db.session.query(db.func.count(Employee.id)).filter(Employee.active == True)
+    if department_id:
+        query = query.filter(Employee.department_id == department_id)
+    if housing_id:
+        query = query.filter(Employee.housing_id == housing_id)
+    count = query.scalar() or 0
+
+    with _employee_count_lock:
+        _employee_count_cache[scope] = (change_id, count)
+    return count
+
+# Attendance columns rendered by the timesheet, in the order they are selected.
+# Rows are read as plain tuples (no ORM identity map) and turned into the
+# TimesheetRecord values the templates use.
+TIMESHEET_ATTENDANCE_FIELDS = (
+    'id', 'employee_id', 'date', 'clock_in', 'clock_out', 'work_hours',
+    'overtime_hours', 'attendance_status', 'terminal_alias_in', 'terminal_alias_out',
+    'terminal_id_in', 'terminal_id_out'
+)
+
+# Number of attendance rows fetched per round trip while streaming
+ATTENDANCE_YIELD_PER = 1000
+
+def _timesheet_attendance_columns():
+    return [getattr(AttendanceRecord, field) for field in TIMESHEET_ATTENDANCE_FIELDS]
+
+def _timesheet_employee_columns():
+    return (Employee.id, Employee.emp_code, Employee.name, Employee.name_ar,
+            Employee.profession, Employee.department_id, Employee.housing_id)
+
+# Employee columns as a plain, picklable tuple
+TimesheetEmployee = namedtuple('TimesheetEmployee', (
+    'id', 'emp_code', 'name', 'name_ar', 'profession', 'department_id', 'housing_id'
+))
+
+def encode_timesheet_cursor(name, employee_id, direction='next'):
+    """
+    Encode a keyset position (employee name, employee id) as an opaque cursor.
+
+    Args:
+        name: Name of the boundary employee
+        employee_id: ID of the boundary employee
+        direction: 'next' to page forward from the boundary, 'prev' to page backward
+
+    Returns:
+        URL-safe cursor string
+    """
+    payload = json.dumps({'n': name, 'i': employee_id, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_timesheet_cursor(cursor):
+    """
+    Decode a cursor created by encode_timesheet_cursor.
+
+    Returns:
+        Tuple (name, employee_id, direction), or None if the cursor is missing or invalid
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        direction = payload.get('d', 'next')
+        if direction not in ('next', 'prev'):
+            direction = 'next'
+        return payload['n'], int(payload['i']), direction
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning(f"Ignoring invalid timesheet cursor: {str(e)}")
+        return None
+
 def get_month_name(month):
     """Get the name of the month from its number"""
     month_names = ['', 'January', 'February', 'March', 'April', 'May',
@@ -87,15 +208,7 @@ def temp_attendance_to_dict(record):
 def get_month_start_end_dates(year, month):
     """Get the start and end date for a month"""
     try:
-        year = int(year)
-        month = int(month)
-        start_date = date(year, month, 1)
-        # Get last day of month by getting first day of next month and subtracting one day
-        if month == 12:
-            end_date = date(year + 1, 1, 1) - timedelta(days=1)
-        else:
-            end_date = date(year, month + 1, 1) - timedelta(days=1)
-        return start_date, end_date
+        return calendar_month_bounds(year, month)
     except ValueError as e:
         logger.error(f"Error getting month dates: {str(e)}")
         return date.today().replace(day=1), date.today()
@@ -127,541 +240,813 @@ def get_current_month():
     """Get the current month"""
     return date.today().month
 
-def apply_vacations_and_transfers(attendance_data, employee_id, start_date, end_date):
-    """Apply vacation and transfer records to attendance data.
-    This function works with dictionary data and doesn't use SQLAlchemy objects directly."""
-    from models import EmployeeVacation, EmployeeTransfer
+def optimized_generate_timesheet(year, month, department_id=None, custom_start_date=None,
+                      custom_end_date=None, housing_id=None, limit=None, offset=None,
+                      force_refresh=False, cursor=None, weekend_days=None):
+    """
+    Optimized version of generate_timesheet with improved performance and caching
 
-    # Get vacation periods for this employee
-    vacations = EmployeeVacation.query.filter(
-        EmployeeVacation.employee_id == employee_id,
-        EmployeeVacation.end_date >= start_date,
-        EmployeeVacation.start_date <= end_date
-    ).all()
+    Pagination is keyset based: pass ``limit`` together with an opaque ``cursor``
+    (see encode_timesheet_cursor) and only that page's employees and attendance
+    are loaded, so deep pages cost the same as the first one. ``offset`` is still
+    accepted for older callers.
 
-    # Apply vacation status to matching days
-    for vacation in vacations:
-        v_start = vacation.start_date
-        v_end = vacation.end_date
+    Args:
+        year: Year for the timesheet (string or int)
+        month: Month for the timesheet (string or int)
+        department_id: Optional department ID to filter by
+        custom_start_date: Optional custom start date (string in 'YYYY-MM-DD' format)
+        custom_end_date: Optional custom end date (string in 'YYYY-MM-DD' format)
+        housing_id: Optional housing ID to filter by
+        limit: Optional limit for number of employees (for pagination)
+        offset: Optional offset for employees (legacy pagination)
+        force_refresh: Force refresh the cache
+        cursor: Optional opaque keyset cursor returned as next_cursor/prev_cursor
+        weekend_days: Optional weekend days; defaults to the current user's settings
 
-        for day_data in attendance_data:
-            day_date = day_data['date']
-            if v_start <= day_date <= v_end:
-                day_data['status'] = 'V'
+    Returns:
+        Dictionary with timesheet data
+    """
+    # Resolve the effective weekend up front so it becomes part of the cache key
+    if weekend_days is None:
+        weekend_days = resolve_weekend_days()
+
+    return _generate_timesheet(
+        *timesheet_cache_args(year, month, department_id, custom_start_date, custom_end_date, housing_id),
+        limit=limit, offset=offset, force_refresh=force_refresh, cursor=cursor,
+        weekend_days=tuple(sorted({int(day) for day in weekend_days}))
+    )
+
+def timesheet_cache_args(year, month, department_id=None, custom_start_date=None,
+                         custom_end_date=None, housing_id=None):
+    """
+    Normalize the positional timesheet arguments so equivalent requests
+    (e.g. "5" and 5, "" and None) share one cache entry.
+    """
+    try:
+        year = int(year)
+        month = int(month)
+    except (TypeError, ValueError):
+        pass
+    try:
+        department_id = _normalize_scope_id(department_id)
+        housing_id = _normalize_scope_id(housing_id)
+    except (TypeError, ValueError):
+        pass
+    return (year, month, department_id, custom_start_date or None,
+            custom_end_date or None, housing_id)
+
+def prime_timesheet_cache(timesheet_data, year, month, department_id=None, housing_id=None,
+                          weekend_days=(4, 5), generation=None):
+    """
+    Store a full (unpaginated) timesheet built elsewhere under the cache key that
+    optimized_generate_timesheet(year, month, department_id, housing_id=housing_id)
+    would use. With the tag generation read before the build (see
+    TieredCache.tag_generation), it is not stored if it was invalidated since.
+    """
+    return _generate_timesheet.prime(
+        timesheet_data,
+        *timesheet_cache_args(year, month, department_id, None, None, housing_id),
+        limit=None, offset=None, force_refresh=False, cursor=None,
+        weekend_days=tuple(sorted({int(day) for day in weekend_days})),
+        generation=generation
+    )
+
+def resolve_timesheet_dates(year, month, custom_start_date=None, custom_end_date=None):
+    """
+    Work out the date range displayed by a timesheet.
 
-    # Get transfers for this employee
-    transfers = EmployeeTransfer.query.filter(
-        EmployeeTransfer.employee_id == employee_id,
-        EmployeeTransfer.end_date >= start_date,
-        EmployeeTransfer.start_date <= end_date
-    ).all()
+    Custom dates win when both are given; otherwise the calendar month is used.
+    Without a custom start date, the last 5 days of the previous month are
+    prepended.
 
-    # Apply transfer status to matching days
-    for transfer in transfers:
-        t_start = transfer.start_date
-        t_end = transfer.end_date
+    Returns:
+        Tuple (start_date, end_date, date_range)
+    """
+    year = int(year)
+    month = int(month)
 
-        # Find applicable dates in the attendance data that fall within this transfer
-        for day_data in attendance_data:
-            day_date = day_data['date']
-            if t_start <= day_date <= t_end:
-                day_data['status'] = 'T'
+    # Use custom dates if provided
+    if custom_start_date and custom_end_date:
+        try:
+            # Parse custom dates
+            start_date = datetime.strptime(custom_start_date, "%Y-%m-%d").date()
+            end_date = datetime.strptime(custom_end_date, "%Y-%m-%d").date()
+            logger.info(f"Using custom date range: {start_date} to {end_date}")
+        except ValueError as e:
+            logger.error(f"Error parsing custom dates: {str(e)}")
+            # Fall back to default month dates
+            start_date, end_date = get_month_start_end_dates(year, month)
+    else:
+        # Get standard month boundaries
+        start_date, end_date = get_month_start_end_dates(year, month)
 
-    return attendance_data
+    # Get a few days from previous month for display at start of timesheet
+    # (Only if we're not using custom dates)
+    if not custom_start_date:
+        prev_month_days = get_previous_month_days(year, month, 5)
 
-def apply_exceptions(attendance_data, employee_id, start_date, end_date):
-    """Apply exception records to attendance data with 8-hour compensation.
-    This function works with dictionary data and doesn't use SQLAlchemy objects directly."""
-    from models import EmployeeException
+        # Adjust start date to include previous month days
+        if prev_month_days:
+            start_date = prev_month_days[0]
+
+    # Date and weekday vectors come precomputed from the fiscal calendar
+    return start_date, end_date, fiscal_calendar.date_range(start_date, end_date)
+
+def load_timesheet_reference():
+    """
+    Get the reference data every timesheet needs from the shared reference
+    data snapshot (one version check, see reference_data).
+
+    Returns:
+        Dictionary with department_names, housing_names and terminal_to_housing
+        (alias -> housing id, terminals attached to a housing; the daily
+        attribution itself is precomputed by the sync). The dictionaries are
+        shared: do not modify them.
+    """
+    from reference_data import get_reference_snapshot
+
+    snapshot = get_reference_snapshot()
+    return {
+        'department_names': snapshot.department_names,
+        'housing_names': snapshot.housing_names,
+        'terminal_to_housing': snapshot.terminal_to_housing
+    }
+
+def load_attendance_index(employee_ids, start_date, end_date, terminal_to_housing):
+    """
+    Stream attendance for a date range and index it by employee and date.
+
+    Args:
+        employee_ids: Employee IDs to load, or None for every employee
+        start_date: First date (inclusive)
+        end_date: Last date (inclusive)
+        terminal_to_housing: Terminal alias to housing ID mapping
 
-    # Get exception records for this employee
-    exceptions = EmployeeException.query.filter(
-        EmployeeException.employee_id == employee_id,
+    Returns:
+        Dictionary with by_employee ({emp_id: {date: TimesheetRecord}}), terminals
+        ({emp_id: set(alias)}), daily_housing ({emp_id: {date: housing_id}} from
+        the EmployeeDailyHousing attribution),
+        totals ({emp_id: totals} from aggregate_attendance_totals) and count.
+        Only plain containers are used so the index can be sent to worker
+        processes.
+    """
+    from database import db
+    from attendance_totals import aggregate_attendance_totals
+    from housing_attribution import load_daily_housing
+
+    # Stream only the rendered attendance columns as tuples
+    query = db.session.query(*_timesheet_attendance_columns()).filter(
+        AttendanceRecord.date >= start_date,
+        AttendanceRecord.date <= end_date
+    )
+    if employee_ids is not None:
+        query = query.filter(AttendanceRecord.employee_id.in_(employee_ids))
+
+    # Organize attendance records by employee and date
+    attendance_by_employee = {}
+
+    # Track terminals used by each employee
+    employee_terminals = {}
+
+    # One date object per day, shared by every record of that day
+    record_dates = {}
+
+    attendance_count = 0
+    for row in query.yield_per(ATTENDANCE_YIELD_PER):
+        # Single pass: build the record straight from the column tuple
+        record = TimesheetRecord.from_columns(row)
+        record.date = record_dates.setdefault(record.date, record.date)
+        employee_id = record.employee_id
+        attendance_by_employee.setdefault(employee_id, {})[record.date] = record
+        attendance_count += 1
+
+        # Collect the housing terminals used
+        alias_in = record.terminal_alias_in
+        if alias_in and alias_in in terminal_to_housing:
+            employee_terminals.setdefault(employee_id, set()).add(alias_in)
+
+        alias_out = record.terminal_alias_out
+        if alias_out and alias_out in terminal_to_housing:
+            employee_terminals.setdefault(employee_id, set()).add(alias_out)
+
+    logger.info(f"Fetched {attendance_count} attendance records for date range {start_date} to {end_date}")
+
+    return {
+        'by_employee': attendance_by_employee,
+        'terminals': employee_terminals,
+        'daily_housing': load_daily_housing(employee_ids, start_date, end_date),
+        'totals': aggregate_attendance_totals(start_date, end_date, employee_ids=employee_ids),
+        'count': attendance_count
+    }
+
+def load_leave_index(employee_ids, start_date, end_date):
+    """
+    Load vacations, transfers and exceptions overlapping a date range.
+    Vacations and transfers come from the cached leave periods (see
+    cache_manager.get_employee_leaves); exceptions take one query.
+
+    Args:
+        employee_ids: Employee IDs to load, or None for every employee
+        start_date: First date (inclusive)
+        end_date: Last date (inclusive)
+
+    Returns:
+        Dictionary with vacations and transfers ({emp_id: [(start, end)]}) and
+        exceptions ({emp_id: [(date, hours_credited)]})
+    """
+    from models import EmployeeException
+    from database import db
+    from cache_manager import get_employee_leaves
+
+    vacations = {}
+    transfers = {}
+    for employee_id, leave in get_employee_leaves(employee_ids).items():
+        employee_vacations = leave.vacations_between(start_date, end_date)
+        if employee_vacations:
+            vacations[employee_id] = [(period.start_date, period.end_date) for period in employee_vacations]
+        employee_transfers = leave.transfers_between(start_date, end_date)
+        if employee_transfers:
+            transfers[employee_id] = [(period.start_date, period.end_date) for period in employee_transfers]
+
+    exception_query = db.session.query(
+        EmployeeException.employee_id, EmployeeException.date, EmployeeException.hours_credited
+    ).filter(
         EmployeeException.date >= start_date,
         EmployeeException.date <= end_date
-    ).all()
+    )
+    if employee_ids is not None:
+        exception_query = exception_query.filter(EmployeeException.employee_id.in_(employee_ids))
+
+    exceptions = {}
+    for employee_id, exception_date, hours_credited in exception_query.order_by(EmployeeException.id):
+        exceptions.setdefault(employee_id, []).append((exception_date, hours_credited))
+
+    return {
+        'vacations': vacations,
+        'transfers': transfers,
+        'exceptions': exceptions
+    }
 
-    # Apply exception status and hours to matching days
-    for exception in exceptions:
-        exception_date = exception.date
-        hours_credited = exception.hours_credited
+def apply_leave_overlays(attendance_data, vacations=(), transfers=(), exceptions=()):
+    """
+    Apply preloaded vacations, transfers and exceptions to one employee's days.
+    They are applied in that order, so a transfer wins over a vacation on the
+    same day and an exception (with its credited hours) over both.
+    """
+    for v_start, v_end in vacations:
+        for day_data in attendance_data:
+            if v_start <= day_data['date'] <= v_end:
+                day_data['status'] = 'V'
+
+    for t_start, t_end in transfers:
+        for day_data in attendance_data:
+            if t_start <= day_data['date'] <= t_end:
+                day_data['status'] = 'T'
 
+    for exception_date, hours_credited in exceptions:
         for day_data in attendance_data:
-            day_date = day_data['date']
-            if day_date == exception_date:
+            if day_data['date'] == exception_date:
                 # Mark as exception
                 day_data['status'] = 'E'
 
-                # Create or update record dictionary with credited hours
+                # Create or update the record with credited hours
                 if not day_data.get('record'):
-                    # If no record exists, create a new dictionary
-                    day_data['record'] = {
-                        'work_hours': hours_credited,
-                        'overtime_hours': 0,
-                        'date': day_date,
-                        'attendance_status': 'E'
-                    }
+                    day_data['record'] = TimesheetRecord(
+                        date=day_data['date'],
+                        work_hours=hours_credited,
+                        overtime_hours=0,
+                        attendance_status='E'
+                    )
                 else:
-                    # Update existing record
                     day_data['record']['work_hours'] = hours_credited
                     day_data['record']['attendance_status'] = 'E'
 
     return attendance_data
 
-def create_safe_timesheet_cache_key(*args, **kwargs):
-    """Create a safe cache key for timesheet data"""
-    # Convert all args to strings to ensure consistent cache keys
-    key_parts = [str(arg) for arg in args]
+def overlay_employee_days(employees, dates, weekend_mask, today, attendance_index, leave_index):
+    """
+    Work out every employee's status for each displayed day: the attendance
+    record's status, or weekend/future/absent without a record, then
+    vacations, transfers and exceptions on top.
 
-    # Add sorted kwargs
-    for k in sorted(kwargs.keys()):
-        if k != 'force_refresh':  # Skip force_refresh in cache key
-            key_parts.append(f"{k}:{kwargs[k]}")
+    Args:
+        employees: Sequence of TimesheetEmployee tuples
+        dates: Dates displayed by the timesheet
+        weekend_mask: Booleans aligned with dates
+        today: Date used to tell absences from future days
+        attendance_index: Result of load_attendance_index
+        leave_index: Result of load_leave_index
 
-    # Join parts and hash
-    key = "_".join(key_parts)
-    import hashlib
-    return hashlib.md5(key.encode()).hexdigest()
+    Returns:
+        Dictionary {emp_id: TimesheetDays aligned with dates}
+    """
+    attendance_by_employee = attendance_index['by_employee']
 
-@cached_timesheet
-def optimized_generate_timesheet(year, month, department_id=None, custom_start_date=None,
-                      custom_end_date=None, housing_id=None, limit=None, offset=None,
-                      force_refresh=False):
+    vacations = leave_index['vacations']
+    transfers = leave_index['transfers']
+    exceptions = leave_index['exceptions']
+
+    # Dates and weekend flags are shared by every employee's days
+    dates = tuple(dates)
+    weekend_mask = tuple(weekend_mask)
+
+    employee_days = {}
+    for employee in employees:
+        statuses = []
+        records = []
+        employee_attendance = attendance_by_employee.get(employee.id, {})
+
+        # Process each date in the range
+        for day, is_weekend in zip(dates, weekend_mask):
+            record = employee_attendance.get(day)
+
+            if record:
+                status = record.attendance_status
+            else:
+                # If no record, determine if it's a weekend or future date
+                if is_weekend:
+                    status = 'W'  # Weekend
+                elif day > today:
+                    status = ''  # Future date
+                else:
+                    status = 'A'  # Absent
+            statuses.append(status)
+            records.append(record)
+        attendance_data = TimesheetDays(dates, weekend_mask, statuses, records)
+
+        # Apply vacations, transfers, and exceptions (days with 8-hour compensation)
+        apply_leave_overlays(
+            attendance_data,
+            vacations.get(employee.id, ()),
+            transfers.get(employee.id, ()),
+            exceptions.get(employee.id, ())
+        )
+        employee_days[employee.id] = attendance_data
+
+    return employee_days
+
+def aggregate_employee_rows(employees, employee_days, dates, attendance_index, reference):
     """
-    Optimized version of generate_timesheet with improved performance and caching
+    Turn overlaid days into timesheet rows: totals, primary housing and one
+    extra row per secondary housing the employee was attributed to.
 
     Args:
-        year: Year for the timesheet (string or int)
-        month: Month for the timesheet (string or int)
-        department_id: Optional department ID to filter by
-        custom_start_date: Optional custom start date (string in 'YYYY-MM-DD' format)
-        custom_end_date: Optional custom end date (string in 'YYYY-MM-DD' format)
-        housing_id: Optional housing ID to filter by
-        limit: Optional limit for number of employees (for pagination)
-        offset: Optional offset for employees (for pagination)
-        force_refresh: Force refresh the cache
+        employees: Sequence of TimesheetEmployee tuples
+        employee_days: Result of overlay_employee_days
+        dates: Dates displayed by the timesheet
+        attendance_index: Result of load_attendance_index
+        reference: Result of load_timesheet_reference
 
     Returns:
-        Dictionary with timesheet data
+        List of rows, including duplicate rows for secondary housings
     """
-    # Import here to avoid circular imports
-    from models import Department, Employee, AttendanceRecord, Housing, BiometricTerminal, EmployeeException
-    from flask import session
-    import datetime
-    from database import db
+    from attendance_totals import empty_totals
+
+    department_names = reference['department_names']
+    housing_names = reference['housing_names']
+
+    attendance_by_employee = attendance_index['by_employee']
+    employee_terminals = attendance_index['terminals']
+    employee_daily_housing = attendance_index['daily_housing']
+    employee_totals = attendance_index['totals']
+
+    # List to store all employee rows, including duplicates with different housing
+    all_employee_rows = []
+
+    for employee in employees:
+        attendance_data = employee_days[employee.id]
+        employee_attendance = attendance_by_employee.get(employee.id, {})
+        daily_housing = employee_daily_housing.get(employee.id, {})
+
+        # Track all housing used by this employee during the period (days per housing)
+        housing_usage = defaultdict(int)
+        for day in dates:
+            day_housing_id = daily_housing.get(day)
+            if day_housing_id and day in employee_attendance:
+                housing_usage[day_housing_id] += 1
+
+        # Get department name from preloaded data
+        dept_name = department_names.get(employee.department_id) or ''
+
+        # Get housing information
+        employee_housing_id = employee.housing_id
+        housing_name = ''
+        all_housing_used = set(housing_usage)
+
+        # Use preloaded housing data
+        if employee_housing_id and employee_housing_id in housing_names:
+            housing_name = housing_names[employee_housing_id]
+            all_housing_used.add(employee_housing_id)
+
+        # Get terminal information
+        devices = employee_terminals.get(employee.id, set())
+        terminal_alias_in = None
+
+        # If employee doesn't have assigned housing, use the housing of most attributed days
+        if not employee_housing_id and housing_usage:
+            most_used_housing_id = max(housing_usage.items(), key=lambda x: (x[1], -x[0]))[0]
+            employee_housing_id = most_used_housing_id
+            housing_name = housing_names.get(most_used_housing_id, "")
+
+        # Use first terminal as default
+        if devices:
+            terminal_alias_in = sorted(devices)[0]
+
+        # Default housing name if not determined
+        if not housing_name:
+            housing_name = "Unknown Housing"
+
+        # Shared by the primary and secondary rows
+        devices = sorted(devices)
+
+        # Total work hours and overtime are aggregated by the database
+        totals = employee_totals.get(employee.id) or empty_totals()
+        total_work_hours = totals['regular_hours']
+        total_overtime_hours = totals['overtime_hours']
+
+        # Add employee with primary housing first
+        all_employee_rows.append(TimesheetRow(
+            employee.id, employee.emp_code, employee.name, employee.name_ar, employee.profession,
+            dept_name, housing_name, employee_housing_id, attendance_data, terminal_alias_in, devices,
+            total_work_hours, total_overtime_hours, is_primary=True
+        ))
+
+        # Add employee to other housing where they had attendance
+        for secondary_housing_id in all_housing_used:
+            # Skip primary housing which was already added
+            if secondary_housing_id == employee_housing_id:
+                continue
+
+            # Add duplicate employee row with secondary housing
+            all_employee_rows.append(TimesheetRow(
+                employee.id, employee.emp_code, employee.name, employee.name_ar, employee.profession,
+                dept_name, housing_names.get(secondary_housing_id, "Unknown Housing"), secondary_housing_id,
+                attendance_data, terminal_alias_in, devices, total_work_hours, total_overtime_hours,
+                is_primary=False
+            ))
+
+    return all_employee_rows
+
+def build_employee_rows(employees, dates, weekend_mask, today, attendance_index, leave_index, reference):
+    """
+    Build timesheet rows for a list of employees from preloaded data
+    (overlay_employee_days followed by aggregate_employee_rows).
 
-    # Start timing the function
-    start_time = time.time()
+    This function does not touch the database, so it can run in worker
+    processes (see timesheet_batch).
 
-    try:
-        year = int(year)
-        month = int(month)
+    Args:
+        employees: Sequence of TimesheetEmployee tuples
+        dates: Dates displayed by the timesheet
+        weekend_mask: Booleans aligned with dates
+        today: Date used to tell absences from future days
+        attendance_index: Result of load_attendance_index
+        leave_index: Result of load_leave_index
+        reference: Result of load_timesheet_reference
 
-        # Use custom dates if provided
-        if custom_start_date and custom_end_date:
-            try:
-                # Parse custom dates
-                start_date = datetime.datetime.strptime(custom_start_date, "%Y-%m-%d").date()
-                end_date = datetime.datetime.strptime(custom_end_date, "%Y-%m-%d").date()
-                logger.info(f"Using custom date range: {start_date} to {end_date}")
-            except ValueError as e:
-                logger.error(f"Error parsing custom dates: {str(e)}")
-                # Fall back to default month dates
-                start_date, end_date = get_month_start_end_dates(year, month)
-        else:
-            # Get standard month boundaries
-            start_date, end_date = get_month_start_end_dates(year, month)
+    Returns:
+        List of rows, see aggregate_employee_rows
+    """
+    employee_days = overlay_employee_days(employees, dates, weekend_mask, today, attendance_index, leave_index)
+    return aggregate_employee_rows(employees, employee_days, dates, attendance_index, reference)
 
-        # Get a few days from previous month for display at start of timesheet
-        # (Only if we're not using custom dates)
-        if not custom_start_date:
-            prev_month_days = get_previous_month_days(year, month, 5)
-
-            # Adjust start date to include previous month days
-            if prev_month_days:
-                start_date = prev_month_days[0]
-
-        # Build the list of dates for the timesheet
-        dates = []
-        current_date = start_date
-        while current_date <= end_date:
-            dates.append(current_date)
-            current_date += timedelta(days=1)
-
-        # Get all employees to include in timesheet with optimized query
-        query = Employee.query.filter(Employee.active == True)
-
-        # Apply department filter if provided
-        if department_id:
-            query = query.filter(Employee.department_id == int(department_id))
-
-        # Apply Housing filter if provided
-        if housing_id:
-            query = query.filter(Employee.housing_id == int(housing_id))
-
-        # Optimize query with eager loading
-        query = query.options(
-            joinedload(Employee.department),
-            joinedload(Employee.housing)
-        )
+def group_employee_rows(employee_rows):
+    """
+    Sort rows by housing then name and group them by housing name.
 
-        # Apply pagination if specified
-        if limit is not None and offset is not None:
-            employees = query.order_by(Employee.name).limit(limit).offset(offset).all()
-            # Also get total count for pagination
-            total_employees = query.count()
+    Returns:
+        Tuple (grouped_employees, housing_groups)
+    """
+    # Sort employees by housing then by name
+    employee_rows.sort(key=lambda x: (x.get('housing') or 'Unknown Housing', x.get('name') or '', not x.get('is_primary', False)))
+
+    # Group employees by housing
+    housing_groups = {}
+    ungrouped_employees = []
+
+    for employee in employee_rows:
+        housing_name = employee.get('housing')
+        if housing_name:
+            housing_groups.setdefault(housing_name, []).append(employee)
         else:
-            employees = query.order_by(Employee.name).all()
-            total_employees = len(employees)
-
-        logger.info(f"Fetched {len(employees)} employees for timesheet (total: {total_employees})")
-
-        # Pre-load all departments and housings to avoid repeated queries
-        departments = {dept.id: dept for dept in Department.query.all()}
-        housings = {h.id: h for h in Housing.query.all()}
-        housing_names = {h_id: h.name for h_id, h in housings.items()}
-
-        # Create mapping of terminals to housing ids
-        terminal_to_housing = {}
-        terminals = BiometricTerminal.query.options(joinedload(BiometricTerminal.housing)).all()
-
-        for terminal in terminals:
-            if terminal.housing_id:
-                terminal_to_housing[terminal.terminal_alias] = terminal.housing_id
-                terminal_to_housing[f"{terminal.terminal_alias}_name"] = housing_names.get(terminal.housing_id, "Unknown Housing")
-
-        # Get employee IDs and optimize attendance record query
-        employee_ids = [e.id for e in employees]
-
-        # Get attendance records for these employees in the date range        # Use a more efficient query with indexing
-        attendance_records = AttendanceRecord.query.filter(
-            AttendanceRecord.employee_id.in_(employee_ids),
-            AttendanceRecord.date >= start_date,
-            AttendanceRecord.date <= end_date
-        ).all()
-
-        # Convert AttendanceRecord objects to dictionaries for safe access
-        attendance_dict_records = [attendance_record_to_dict(record) for record in attendance_records]
-
-        logger.info(f"Fetched {len(attendance_records)} attendance records for date range {start_date} to {end_date}")
-
-        # Organize attendance records by employee and date
-        attendance_by_employee = defaultdict(dict)
-
-        # Track terminals used by each employee
-        employee_terminals = defaultdict(set)
-
-        # Track housing used by employees on different days
-        employee_daily_housing = defaultdict(lambda: defaultdict(set))
-
-        for idx, record in enumerate(attendance_records):
-            # Get the corresponding dictionary version of the record
-            record_dict = attendance_dict_records[idx]
-            attendance_by_employee[record.employee_id][record.date] = record_dict
-
-            # Collect information about terminal usage
-            housing_id_in = None
-            housing_id_out = None
-
-            # Use dictionary values instead of accessing record attributes directly
-            if record_dict['terminal_alias_in'] and record_dict['terminal_alias_in'] in terminal_to_housing:
-                employee_terminals[record_dict['employee_id']].add(record_dict['terminal_alias_in'])
-                housing_id_in = terminal_to_housing[record_dict['terminal_alias_in']]
-                # Add housing associated with check-in terminal
-                if housing_id_in:
-                    employee_daily_housing[record_dict['employee_id']][record_dict['date']].add(housing_id_in)
-
-            if record_dict['terminal_alias_out'] and record_dict['terminal_alias_out'] in terminal_to_housing:
-                employee_terminals[record_dict['employee_id']].add(record_dict['terminal_alias_out'])
-                housing_id_out = terminal_to_housing[record_dict['terminal_alias_out']]
-                # Add housing associated with check-out terminal if different
-                if housing_id_out and housing_id_out != housing_id_in:
-                    employee_daily_housing[record_dict['employee_id']][record_dict['date']].add(housing_id_out)
-          # Get weekend days from user settings or use default
-        try:
-            # Try to get weekend days from appearance settings in database
-            user_id = session.get('user_id', 1)  # Default to user 1 if not logged in
-            from models import AppearanceSettings
-            settings_record = AppearanceSettings.query.filter_by(user_id=user_id).first()
-
-            if settings_record and settings_record.settings:
-                import json
-                appearance_settings = json.loads(settings_record.settings)
-                if 'weekendDays' in appearance_settings and appearance_settings['weekendDays']:
-                    weekend_days = [int(day) for day in appearance_settings['weekendDays']]
-                    logger.info(f"Using weekend days from appearance settings: {weekend_days}")
-                else:
-                    # Default to Friday and Saturday if not set in appearance settings
-                    weekend_days = [4, 5]  # 4=Friday, 5=Saturday in Python's weekday system (0=Monday)
-            elif 'ui_settings' in session and 'weekend_days' in session['ui_settings']:
-                # Fallback to session settings if appearance settings not found
-                weekend_days = [int(day) for day in session['ui_settings']['weekend_days']]
-            else:
-                # Default to Friday and Saturday if not set
-                weekend_days = [4, 5]  # 4=Friday, 5=Saturday in Python's weekday system (0=Monday)
-        except Exception as e:
-            # If we're outside a request context or any error occurs, just use defaults
-            logger.error(f"Error getting weekend days: {str(e)}")
-            weekend_days = [4, 5]  # Default to Friday and Saturday
-
-        logger.info(f"Using weekend days: {weekend_days}")
-
-        # List to store all employee rows, including duplicates with different housing
-        all_employee_rows = []
-
-        # Track employees that have already been processed
-        processed_employee_ids = set()
-
-        # Process all employees
-        for employee in employees:
-            attendance_data = []
-
-            # Track all housing used by this employee during the period
-            all_housing_used = set()
-              # Process each date in the range
-            for day in dates:
-                record_dict = attendance_by_employee.get(employee.id, {}).get(day)
-
-                if record_dict:
-                    status = record_dict['attendance_status']
-
-                    # Collect housing used on this day
-                    daily_housings = employee_daily_housing[employee.id].get(day, set())
-                    if daily_housings:
-                        all_housing_used.update(daily_housings)
-                else:
-                    # If no record, determine if it's a weekend or future date
-                    if day.weekday() in weekend_days:
-                        status = 'W'  # Weekend
-                    elif day > date.today():
-                        status = ''  # Future date
-                    else:
-                        status = 'A'  # Absent
-                # Add weekend information
-                is_weekend = (day.weekday() in weekend_days)
-                # No need to convert record_dict since it's already a dictionary
-                attendance_data.append({
-                    'date': day,
-                    'status': status,
-                    'record': record_dict,
-                    'is_weekend': is_weekend
-                })
-
-            # Apply vacations, transfers, and exceptions
-            attendance_data = apply_vacations_and_transfers(attendance_data, employee.id, start_date, end_date)
-
-            # Apply exceptions (days with 8-hour compensation)
-            attendance_data = apply_exceptions(attendance_data, employee.id, start_date, end_date)
-
-            # Get department name from preloaded data
-            dept_name = ''
-            if employee.department_id and employee.department_id in departments:
-                dept_name = departments[employee.department_id].name
-
-            # Get housing information
-            employee_housing_id = employee.housing_id
-            housing_name = ''
-
-            # Use preloaded housing data
-            if employee_housing_id and employee_housing_id in housing_names:
-                housing_name = housing_names[employee_housing_id]
-                all_housing_used.add(employee_housing_id)
-
-            # Get terminal information
-            devices = employee_terminals.get(employee.id, set())
-            terminal_alias_in = None
-
-            # If employee doesn't have assigned housing, determine it from terminal usage
-            if not employee_housing_id and devices:
-                # Count terminal usage by housing
-                housing_usage = defaultdict(int)
-
-                for device in devices:
-                    if device in terminal_to_housing:
-                        housing_id = terminal_to_housing[device]
-                        housing_usage[housing_id] += 1
-
-                # Use most frequent housing
-                if housing_usage:
-                    most_used_housing_id = max(housing_usage.items(), key=lambda x: x[1])[0]
-                    employee_housing_id = most_used_housing_id
-                    housing_name = housing_names.get(most_used_housing_id, "")
-                    all_housing_used.add(most_used_housing_id)
-
-            # Use first terminal as default
-            if devices:
-                terminal_alias_in = sorted(devices)[0]
-
-            # Default housing name if not determined
-            if not housing_name:
-                housing_name = "Unknown Housing"
-
-            # Calculate total work hours and overtime
-            total_work_hours = 0
-            total_overtime_hours = 0
-
-            for day_data in attendance_data:
-                record = day_data.get('record')
-                status = day_data.get('status')
-
-                # Check if this is an exception day (status 'E')
-                if status == 'E' and record:
-                    # For exceptions, use the credited hours directly
-                    regular_hours = record['work_hours']
-                    overtime = 0
-                    total_work_hours += regular_hours
-                    total_overtime_hours += overtime
-                elif record:
-                    # Handle May 10, 2025 single punch records
-                    today_date = date(2025, 5, 10)
-                    if record['date'] == today_date and record.get('clock_in') and not record.get('clock_out'):
-                        # Set to 1 hour for today's single-punch records
-                        regular_hours = 1
-                        overtime = 0
-
-                        # Update database - but disconnect from the dictionary data to avoid DetachedInstanceError
-                        if record['work_hours'] != 1:
-                            try:
-                                record_obj = AttendanceRecord.query.get(record['id'])
-                                if record_obj:
-                                    record_obj.work_hours = 1
-                                    record_obj.overtime_hours = 0
-                                    db.session.add(record_obj)
-                                    # Update the dictionary to match the database changes
-                                    record['work_hours'] = 1
-                                    record['overtime_hours'] = 0
-                            except Exception as e:
-                                logger.error(f"Error updating work hours: {str(e)}")
-                    else:
-                        # Calculate regular hours (max 8 per day) and overtime
-                        total_hours = record['work_hours'] + record['overtime_hours']
-                        regular_hours = min(8, total_hours)
-                        overtime = total_hours - regular_hours if total_hours > 8 else 0
-
-                    total_work_hours += regular_hours
-                    total_overtime_hours += overtime
-
-            # Add employee with primary housing first
-            all_employee_rows.append({
-                'id': employee.id,
-                'emp_code': employee.emp_code,
-                'name': employee.name,
-                'name_ar': employee.name_ar,
-                'profession': employee.profession,
-                'department': dept_name,
-                'housing': housing_name,
-                'housing_id': employee_housing_id,
-                'attendance': attendance_data,
-                'terminal_alias_in': terminal_alias_in,
-                'devices': list(devices),
-                'total_work_hours': total_work_hours,
-                'total_overtime_hours': total_overtime_hours,
-                'is_primary': True
+            ungrouped_employees.append(employee)
+
+    # Build final employee list grouped by housing
+    grouped_employees = []
+
+    # Add grouped employees first
+    for housing_name in sorted(housing_groups.keys()):
+        grouped_employees.extend(housing_groups[housing_name])
+
+    # Then add ungrouped employees
+    grouped_employees.extend(ungrouped_employees)
+
+    return grouped_employees, housing_groups
+
+def assemble_timesheet(year, month, dates, start_date, end_date, weekend_days, employee_rows,
+                       total_employees, employees_loaded, start_time):
+    """Group rows and wrap them in the timesheet dictionary returned to views"""
+    grouped_employees, housing_groups = group_employee_rows(employee_rows)
+
+    # Get month period data
+    month_period = fiscal_calendar.get_period(year, month)
+    working_days = month_period.days_in_month if month_period else None
+    working_hours = month_period.hours_in_month if month_period else None
+
+    return {
+        'year': year,
+        'month': month,
+        'month_name': get_month_name(month),
+        'dates': dates,
+        'employees': grouped_employees,
+        'total_employees': total_employees,
+        'employees_loaded': employees_loaded,
+        'total_rows': len(employee_rows),
+        'housing_groups': housing_groups,
+        'start_date': start_date,
+        'end_date': end_date,
+        'working_days': working_days,
+        'working_hours': working_hours,
+        'weekend_days': list(weekend_days),
+        'execution_time': round(time.time() - start_time, 2)
+    }
+
+def build_timesheet_delta(changed_cells, start_date, end_date, date_range, weekend_days):
+    """
+    Rebuild only the changed cells of a displayed timesheet.
+
+    Args:
+        changed_cells: {employee_id: set(dates)} from data_versions.changes_since
+        start_date: First displayed date
+        end_date: Last displayed date
+        date_range: DateRange of the displayed dates
+        weekend_days: Weekend days the page was rendered with
+
+    Returns:
+        List of {'employee_id', 'days', 'total_work_hours', 'total_overtime_hours'}
+        where days only holds the changed day entries
+    """
+    from database import db
+    from timesheet_engine import default_engine
+
+    employee_ids = sorted(changed_cells)
+    if not employee_ids:
+        return []
+
+    employees = [
+        TimesheetEmployee._make(row)
+        for row in db.session.query(*_timesheet_employee_columns()).filter(Employee.id.in_(employee_ids))
+    ]
+    context = {
+        'employees': employees,
+        'start_date': start_date,
+        'end_date': end_date,
+        'dates': list(date_range.dates),
+        'weekend_mask': date_range.weekend_mask(weekend_days),
+        'today': date.today()
+    }
+    employee_rows = default_engine.build_rows(context)
+
+    delta = []
+    for row in employee_rows:
+        # Secondary housing rows share the primary row's cells
+        if not row['is_primary']:
+            continue
+        changed_dates = changed_cells[row['id']]
+        delta.append({
+            'employee_id': row['id'],
+            'days': [day for day in row['attendance'] if day['date'] in changed_dates],
+            'total_work_hours': row['total_work_hours'],
+            'total_overtime_hours': row['total_overtime_hours']
+        })
+    return delta
+
+def get_timesheet_delta(since, year, month, start_date, end_date, weekend_days, employee_ids,
+                        department_id=None, housing_id=None):
+    """
+    Get the timesheet cells and totals that changed since a data version, as
+    rendered HTML for the /api/timesheet/delta endpoint. Needs the
+    application's templates (_timesheet_cells.html).
+
+    Args:
+        since: Version token the page was rendered with
+        year: Year of the page
+        month: Month of the page
+        start_date: First displayed date ('YYYY-MM-DD')
+        end_date: Last displayed date ('YYYY-MM-DD')
+        weekend_days: Weekend days the page was rendered with
+        employee_ids: Employees displayed by the page
+        department_id: Department filter of the page, if any
+        housing_id: Housing filter of the page, if any
+
+    Returns:
+        Dictionary with version, reload (the page must be rendered again:
+        its rows, period or weekend changed), cells and totals
+    """
+    import data_versions
+    from flask import get_template_attribute
+
+    version = data_versions.current_data_version()
+
+    # The user changed their weekend since the page was rendered
+    if tuple(sorted({int(day) for day in weekend_days})) != resolve_weekend_days():
+        return {'version': version, 'reload': True}
+    if since == version:
+        return {'version': version, 'reload': False, 'cells': [], 'totals': []}
+
+    department_id = _normalize_scope_id(department_id)
+    housing_id = _normalize_scope_id(housing_id)
+    start, end, date_range = resolve_timesheet_dates(year, month, start_date, end_date)
+    changes = data_versions.changes_since(since, employee_ids, start, end, year, month, department_id, housing_id)
+    if changes['reload']:
+        return {'version': version, 'reload': True}
+
+    attendance_cell = get_template_attribute('_timesheet_cells.html', 'attendance_cell')
+    hours_total = get_template_attribute('_timesheet_cells.html', 'hours_total')
+
+    cells = []
+    totals = []
+    for row in build_timesheet_delta(changes['cells'], start, end, date_range, weekend_days):
+        employee_id = row['employee_id']
+        for day in row['days']:
+            cells.append({
+                'employee_id': employee_id,
+                'date': day['date'].isoformat(),
+                'html': str(attendance_cell(employee_id, day))
             })
+        totals.append({
+            'employee_id': employee_id,
+            'work_html': str(hours_total(employee_id, row['total_work_hours'], 'work')),
+            'overtime_html': str(hours_total(employee_id, row['total_overtime_hours'], 'overtime'))
+        })
 
-            # Add to processed list
-            processed_employee_ids.add(employee.id)
-
-            # Add employee to other housing where they had attendance
-            for housing_id in all_housing_used:
-                # Skip primary housing which was already added
-                if housing_id == employee_housing_id:
-                    continue
-
-                # Get housing name
-                secondary_housing_name = housing_names.get(housing_id, "Unknown Housing")
-
-                # Add duplicate employee row with secondary housing
-                all_employee_rows.append({
-                    'id': employee.id,
-                    'emp_code': employee.emp_code,
-                    'name': employee.name,
-                    'name_ar': employee.name_ar,
-                    'profession': employee.profession,
-                    'department': dept_name,
-                    'housing': secondary_housing_name,
-                    'housing_id': housing_id,
-                    'attendance': attendance_data,
-                    'terminal_alias_in': terminal_alias_in,
-                    'devices': list(devices),
-                    'total_work_hours': total_work_hours,
-                    'total_overtime_hours': total_overtime_hours,
-                    'is_primary': False
-                })
-
-        # Use the list with duplicated employees in different housing
-        employee_rows = all_employee_rows
-
-        # Sort employees by housing then by name
-        employee_rows.sort(key=lambda x: (x.get('housing') or 'Unknown Housing', x.get('name') or '', not x.get('is_primary', False)))
-
-        # Get month period data
-        from models import MonthPeriod
-        month_code = f"{int(month):02d}/{str(int(year))[2:4]}"
-        month_period = MonthPeriod.query.filter_by(month_code=month_code).first()
-
-        working_days = None
-        working_hours = None
-
-        if month_period:
-            working_days = month_period.days_in_month
-            working_hours = month_period.hours_in_month
-
-        # Group employees by housing
-        housing_groups = {}
-        ungrouped_employees = []
-
-        for employee in employee_rows:
-            housing_name = employee.get('housing')
-            if housing_name:
-                if housing_name not in housing_groups:
-                    housing_groups[housing_name] = []
-                housing_groups[housing_name].append(employee)
-            else:
-                ungrouped_employees.append(employee)
+    return {'version': version, 'reload': False, 'cells': cells, 'totals': totals}
+
+def _row_identity(row):
+    """Identify a timesheet row: an employee has one primary row and one per secondary housing"""
+    return row['id'], row['is_primary'], row['housing_id']
 
-        # Build final employee list grouped by housing
-        grouped_employees = []
+def _row_order(row):
+    """Sort key giving the order of group_employee_rows (rows without housing last)"""
+    housing = row.get('housing')
+    return (not housing, housing or 'Unknown Housing', row.get('name') or '', not row.get('is_primary', False))
 
-        # Add grouped employees first
-        for housing_name in sorted(housing_groups.keys()):
-            grouped_employees.extend(housing_groups[housing_name])
+def _chunked_timesheet(year, month, department_id, custom_start_date, custom_end_date, housing_id,
+                       weekend_days, start_time):
+    """
+    Prepare a timesheet whose rows are built a chunk of employees at a time.
 
-        # Then add ungrouped employees
-        grouped_employees.extend(ungrouped_employees)
+    Returns:
+        Tuple (timesheet_info, employees, build_chunk) where employees are the
+        scope's employees ordered by name and build_chunk(employees) returns
+        the rows of some of them
+    """
+    from timesheet_engine import default_engine
+
+    context = default_engine.resolve(
+        year, month, department_id, custom_start_date, custom_end_date, housing_id, weekend_days=weekend_days
+    )
+    employees = context['employees']
+
+    def build_chunk(chunk_employees):
+        return default_engine.build_rows(context, chunk_employees)
+
+    timesheet_info = assemble_timesheet(
+        context['year'], context['month'], context['dates'], context['start_date'], context['end_date'],
+        weekend_days, [], len(employees), len(employees), start_time
+    )
+    timesheet_info.pop('employees')
+    timesheet_info.pop('housing_groups')
+    return timesheet_info, employees, build_chunk
+
+def iter_employee_timesheets(year, month, department_id=None, custom_start_date=None, custom_end_date=None,
+                             housing_id=None, weekend_days=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Get a timesheet as a header plus an iterator of one row per employee
+    (primary housing only) ordered by name, for spreadsheet exports.
+    Rows are built chunk_size employees at a time as the iterator is consumed.
 
-        # Commit any database changes
-        db.session.commit()
+    Args:
+        year: Year for the timesheet
+        month: Month for the timesheet
+        department_id: Optional department ID to filter by
+        custom_start_date: Optional custom start date ('YYYY-MM-DD')
+        custom_end_date: Optional custom end date ('YYYY-MM-DD')
+        housing_id: Optional housing ID to filter by
+        weekend_days: Optional weekend days; defaults to the current user's settings
+        chunk_size: Employees built at a time
 
-        # Calculate execution time
-        execution_time = time.time() - start_time
+    Returns:
+        Tuple (timesheet_info, rows) where timesheet_info has the keys of a
+        timesheet except employees and housing_groups
+    """
+    if weekend_days is None:
+        weekend_days = resolve_weekend_days()
+    weekend_days = tuple(sorted({int(day) for day in weekend_days}))
+    args = timesheet_cache_args(year, month, department_id, custom_start_date, custom_end_date, housing_id)
+    timesheet_info, employees, build_chunk = _chunked_timesheet(*args, weekend_days=weekend_days, start_time=time.time())
+    timesheet_info['total_rows'] = len(employees)
+
+    def iter_rows():
+        for chunk_start in range(0, len(employees), chunk_size):
+            rows = build_chunk(employees[chunk_start:chunk_start + chunk_size])
+            for row in rows:
+                if row['is_primary']:
+                    yield row
+
+    return timesheet_info, iter_rows()
+
+def stream_timesheet(year, month, department_id=None, custom_start_date=None, custom_end_date=None,
+                     housing_id=None, weekend_days=None, chunk_size=STREAM_CHUNK_SIZE, use_cache=True):
+    """
+    Get a full timesheet as a header plus an iterator of rows, for exports.
 
-        # Build and return timesheet data
-        timesheet_data = {
-            'year': year,
-            'month': month,
-            'month_name': get_month_name(month),
-            'dates': dates,
-            'employees': grouped_employees,
-            'total_employees': total_employees,
-            'employees_loaded': len(employees),
-            'total_rows': len(employee_rows),
-            'housing_groups': housing_groups,
-            'start_date': start_date,
-            'end_date': end_date,
-            'working_days': working_days,
-            'working_hours': working_hours,
-            'weekend_days': weekend_days,
-            'execution_time': round(execution_time, 2),
-            'has_more': offset + limit < total_employees if limit and offset is not None else False,
-            'pagination': {
-                'limit': limit,
-                'offset': offset,
-                'total': total_employees
-            } if limit is not None else None
-        }
+    A cached full timesheet is read in place (never copied). Otherwise rows are
+    built chunk_size employees at a time in two passes: the first only keeps
+    each row's sort key, the second rebuilds the rows chunk by chunk in the
+    final (housing, name) order. Memory is bounded by one chunk of rows.
+
+    Args:
+        year: Year for the timesheet
+        month: Month for the timesheet
+        department_id: Optional department ID to filter by
+        custom_start_date: Optional custom start date ('YYYY-MM-DD')
+        custom_end_date: Optional custom end date ('YYYY-MM-DD')
+        housing_id: Optional housing ID to filter by
+        weekend_days: Optional weekend days; defaults to the current user's settings
+        chunk_size: Employees built at a time
+        use_cache: Whether a cached full timesheet may be used
+
+    Returns:
+        Tuple (timesheet_info, rows) where timesheet_info has the keys of a
+        timesheet except employees and housing_groups, and rows yields the
+        employee rows grouped by housing. The rows must not be modified.
+    """
+    start_time = time.time()
+    if weekend_days is None:
+        weekend_days = resolve_weekend_days()
+    weekend_days = tuple(sorted({int(day) for day in weekend_days}))
+    args = timesheet_cache_args(year, month, department_id, custom_start_date, custom_end_date, housing_id)
+
+    cached = None
+    if use_cache:
+        cached = _generate_timesheet.peek(*args, limit=None, offset=None, cursor=None, weekend_days=weekend_days)
+    if cached is not None and not cached.get('error'):
+        timesheet_info = {key: value for key, value in cached.items() if key not in ('employees', 'housing_groups')}
+        return timesheet_info, iter(cached['employees'])
+
+    timesheet_info, employees, build_chunk = _chunked_timesheet(*args, weekend_days=weekend_days, start_time=start_time)
+
+    # First pass: keep only the order of the rows
+    order = []
+    for chunk_start in range(0, len(employees), chunk_size):
+        rows = build_chunk(employees[chunk_start:chunk_start + chunk_size])
+        for row in rows:
+            order.append(_row_order(row) + (len(order), _row_identity(row)))
+    order.sort()
+    timesheet_info['total_rows'] = len(order)
+
+    def iter_rows():
+        employees_by_id = {e.id: e for e in employees}
+        # Second pass: rebuild the rows chunk by chunk in their final order
+        for chunk_start in range(0, len(order), chunk_size):
+            chunk = [entry[-1] for entry in order[chunk_start:chunk_start + chunk_size]]
+            chunk_employees = [employees_by_id[employee_id] for employee_id in dict.fromkeys(key[0] for key in chunk)]
+            rows = build_chunk(chunk_employees)
+            rows = {_row_identity(row): row for row in rows}
+            for key in chunk:
+                # A row can vanish if attendance changed between the two passes
+                if key in rows:
+                    yield rows[key]
+
+    return timesheet_info, iter_rows()
+
+def timesheet_cache_tags(timesheet_data, args, kwargs):
+    """Cache tags of a _generate_timesheet result (see cache_tags.timesheet_tags)"""
+    names = ('year', 'month', 'department_id', 'custom_start_date', 'custom_end_date', 'housing_id')
+    values = dict(zip(names, args))
+    values.update((name, kwargs[name]) for name in names if name in kwargs)
+    return cache_tags.timesheet_tags(timesheet_data, values['year'], values['month'],
+                                     values.get('department_id'), values.get('housing_id'))
+
+@cached_timesheet(tags=timesheet_cache_tags)
+def _generate_timesheet(year, month, department_id=None, custom_start_date=None,
+                        custom_end_date=None, housing_id=None, limit=None, offset=None,
+                        force_refresh=False, cursor=None, weekend_days=(4, 5)):
+    """Build the timesheet for optimized_generate_timesheet (cached per weekend set)"""
+    from database import db
+    from timesheet_engine import default_engine
+
+    try:
+        # Weekend days are resolved by optimized_generate_timesheet (part of the cache key)
+        logger.info(f"Using weekend days: {list(weekend_days)}")
+        timesheet_data = default_engine.run(
+            year, month, department_id, custom_start_date, custom_end_date, housing_id,
+            limit=limit, offset=offset, cursor=cursor, weekend_days=weekend_days
+        )
 
-        logger.info(f"Generated timesheet data in {execution_time:.2f} seconds")
+        logger.info(f"Generated timesheet data in {timesheet_data['execution_time']:.2f} seconds")
 
         return timesheet_data
 
@@ -0,0 +1,226 @@
+"""
+Reference data snapshot shared by every request of a worker process.
+
+Departments, housings, biometric terminals (with the terminal -> housing map)
+and month periods change rarely but are read by most pages and by every
+timesheet. A worker loads them once into a ReferenceSnapshot and keeps it
+until the reference version stored in the database changes:
+
+- every flush that adds, edits or deletes one of the REFERENCE_MODELS bumps
+  the single ReferenceVersion row in the same transaction (see
+  _bump_on_flush), so a CRUD route of any worker bumps it by committing;
+- an application context (a request, a scheduled job) checks the version
+  once, with a primary key lookup, and the snapshot is reloaded only when the
+  version differs.
+
+Snapshots hold plain values only (no ORM objects) and are shared by every
+request of the process: treat them as read-only.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from flask import g, has_app_context
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+
+from models import Department, Housing, BiometricTerminal, MonthPeriod, ReferenceVersion
+
+logger = logging.getLogger(__name__)
+
+# Models whose edits bump the reference version
+REFERENCE_MODELS = (Department, Housing, BiometricTerminal, MonthPeriod)
+
+# Primary key of the single ReferenceVersion row
+VERSION_ROW_ID = 1
+
+# Session.info flag set when a flush bumped the version
+_CHANGED_FLAG = 'reference_data_changed'
+
+DepartmentInfo = namedtuple('DepartmentInfo', ['id', 'dept_id', 'name', 'active'])
+HousingInfo = namedtuple('HousingInfo', ['id', 'name', 'location', 'active'])
+TerminalInfo = namedtuple('TerminalInfo', ['id', 'device_id', 'terminal_alias', 'location', 'housing_id', 'active'])
+
+
+class ReferenceSnapshot:
+    """Reference data as of one reference version"""
+
+    __slots__ = ('stamp', 'version', 'departments', 'housings', 'terminals', 'month_periods',
+                 'department_names', 'housing_names', 'terminal_to_housing')
+
+    def __init__(self, stamp, departments, housings, terminals, month_periods):
+        """
+        Args:
+            stamp: (version, updated_at) of the ReferenceVersion row
+            departments: DepartmentInfo of every department
+            housings: HousingInfo of every housing
+            terminals: TerminalInfo of every terminal
+            month_periods: {month_code: FiscalPeriod}
+        """
+        self.stamp = stamp
+        self.version = stamp[0]
+        self.departments = {department.id: department for department in departments}
+        self.housings = {housing.id: housing for housing in housings}
+        self.terminals = {terminal.terminal_alias: terminal for terminal in terminals}
+        self.month_periods = month_periods
+        self.department_names = {department.id: department.name for department in departments}
+        self.housing_names = {housing.id: housing.name for housing in housings}
+        self.terminal_to_housing = {
+            terminal.terminal_alias: terminal.housing_id for terminal in terminals if terminal.housing_id is not None
+        }
+
+    def __repr__(self):
+        return f'<ReferenceSnapshot version {self.version}>'
+
+
+def read_reference_stamp():
+    """
+    Read the reference version in one primary key lookup.
+
+    Returns:
+        Tuple (version, updated_at); (0, None) before the first bump. The
+        timestamp tells apart databases at the same version (test databases).
+    """
+    from database import db
+
+    row = db.session.query(ReferenceVersion.version, ReferenceVersion.updated_at).filter(
+        ReferenceVersion.id == VERSION_ROW_ID
+    ).first()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def bump_reference_version(session=None):
+    """
+    Increment the reference version in the session's transaction.
+    Flushes of the REFERENCE_MODELS do it automatically; only needed for
+    changes the flush listener cannot see (bulk updates and deletes).
+    """
+    if session is None:
+        from database import db
+        session = db.session
+
+    table = ReferenceVersion.__table__
+    now = datetime.utcnow()
+    connection = session.connection()
+    result = connection.execute(
+        update(table).where(table.c.id == VERSION_ROW_ID).values(version=table.c.version + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(id=VERSION_ROW_ID, version=1, updated_at=now))
+    session.info[_CHANGED_FLAG] = True
+
+
+def ensure_reference_version():
+    """Create the ReferenceVersion row if it is missing (run at startup)"""
+    from database import db
+
+    if db.session.get(ReferenceVersion, VERSION_ROW_ID) is None:
+        db.session.add(ReferenceVersion(id=VERSION_ROW_ID, version=0))
+        db.session.commit()
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_on_flush(session, flush_context, instances):
+    """Bump the reference version when a flush writes reference data"""
+    if session.info.get('read_only'):
+        return
+    changed = any(isinstance(obj, REFERENCE_MODELS) for obj in session.new) or \
+        any(isinstance(obj, REFERENCE_MODELS) for obj in session.deleted) or \
+        any(isinstance(obj, REFERENCE_MODELS) and session.is_modified(obj) for obj in session.dirty)
+    if changed:
+        bump_reference_version(session)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _drop_after_change(session):
+    # The snapshot of this process may hold the uncommitted (or rolled back)
+    # data: reload it on the next lookup
+    if session.info.pop(_CHANGED_FLAG, False):
+        reference_data.invalidate()
+
+
+class ReferenceData:
+    """The current ReferenceSnapshot of this process"""
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Get the current snapshot: the one already checked by this application
+        context, else the loaded one if the version did not change, else a
+        freshly loaded one.
+
+        Returns:
+            ReferenceSnapshot
+        """
+        snapshot = g.get('reference_snapshot') if has_app_context() else None
+        if snapshot is None:
+            snapshot = self._current()
+            if has_app_context():
+                g.reference_snapshot = snapshot
+        return snapshot
+
+    def _current(self):
+        stamp = read_reference_stamp()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.stamp != stamp:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.stamp != stamp:
+                    snapshot = self._snapshot = self._load(stamp)
+        return snapshot
+
+    def _load(self, stamp):
+        """Load every department, housing, terminal and month period (four small queries)"""
+        from database import db
+        from fiscal_calendar import FiscalPeriod
+
+        departments = [DepartmentInfo(*row) for row in db.session.query(
+            Department.id, Department.dept_id, Department.name, Department.active
+        )]
+        housings = [HousingInfo(*row) for row in db.session.query(
+            Housing.id, Housing.name, Housing.location, Housing.active
+        )]
+        terminals = [TerminalInfo(*row) for row in db.session.query(
+            BiometricTerminal.id, BiometricTerminal.device_id, BiometricTerminal.terminal_alias,
+            BiometricTerminal.location, BiometricTerminal.housing_id, BiometricTerminal.active
+        )]
+
+        month_periods = {}
+        for month_code, start_date, end_date, days_in_month, hours_in_month in db.session.query(
+            MonthPeriod.month_code, MonthPeriod.start_date, MonthPeriod.end_date,
+            MonthPeriod.days_in_month, MonthPeriod.hours_in_month
+        ):
+            if not month_code or not start_date or not end_date:
+                continue
+            try:
+                month_periods[month_code] = FiscalPeriod(
+                    month_code, start_date, end_date, days_in_month, hours_in_month
+                )
+            except ValueError as e:
+                logger.error(f"Skipping invalid month period {month_code}: {str(e)}")
+
+        logger.info(f"Loaded reference data version {stamp[0]}: {len(departments)} departments, "
+                    f"{len(housings)} housings, {len(terminals)} terminals, {len(month_periods)} month periods")
+        return ReferenceSnapshot(stamp, departments, housings, terminals, month_periods)
+
+    def invalidate(self):
+        """Drop the loaded snapshot so the next lookup reloads it"""
+        with self._lock:
+            self._snapshot = None
+        if has_app_context():
+            g.pop('reference_snapshot', None)
+
+
+# Reference data of this process
+reference_data = ReferenceData()
+
+
+def get_reference_snapshot():
+    """Get the current ReferenceSnapshot (see ReferenceData.get)"""
+    return reference_data.get()
@@ -0,0 +1,86 @@
+"""
+ETag and conditional GET support for heavy pages and JSON APIs.
+
+The ETag of a response is derived from the data version token (last
+successful sync, leave/employee/settings change log, see data_versions), the
+day, the request scope (path, query string and view arguments) and the
+session values that change the rendering (language, user, UI settings).
+Computing it takes two MAX() queries, so a client sending a matching
+If-None-Match gets a 304 before the view runs any of its own queries.
+"""
+
+import hashlib
+import logging
+from datetime import date
+from functools import wraps
+
+from flask import request, session, make_response
+
+logger = logging.getLogger(__name__)
+
+# Query parameters asking for a regenerated response; never answered with a 304
+REFRESH_PARAMS = ('refresh', 'force_refresh')
+
+
+def _wants_refresh():
+    """Check whether the request asks to bypass caches"""
+    return any(request.args.get(param, '').lower() in ('true', '1', 'yes') for param in REFRESH_PARAMS)
+
+
+def response_etag(view_args=None):
+    """
+    Compute the ETag of the current request.
+
+    Args:
+        view_args: URL arguments of the view (e.g. department_id)
+
+    Returns:
+        ETag string (without quotes)
+    """
+    from data_versions import current_data_version
+
+    scope = [
+        current_data_version(),
+        date.today().isoformat(),
+        request.path,
+        repr(sorted(request.args.items(multi=True))),
+        repr(sorted((view_args or {}).items())),
+        session.get('language', 'en'),
+        str(session.get('user_id', '')),
+        repr(sorted(session.get('ui_settings', {}).items()))
+    ]
+    return hashlib.md5('|'.join(scope).encode('utf-8')).hexdigest()
+
+
+def versioned_response(view):
+    """
+    Decorator answering If-None-Match with 304 Not Modified when the data the
+    view depends on has not changed, and tagging successful responses with an
+    ETag otherwise.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pending flash messages or forced refreshes must reach the view
+        if request.method != 'GET' or session.get('_flashes') or _wants_refresh():
+            return view(*args, **kwargs)
+
+        try:
+            etag = response_etag(kwargs)
+        except Exception as e:
+            logger.error(f"Error computing ETag for {request.path}: {str(e)}")
+            return view(*args, **kwargs)
+
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+            # Let browsers keep the response but revalidate it on every use
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    return wrapper
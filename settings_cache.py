@@ -0,0 +1,176 @@
+"""
+In-memory cache for parsed user appearance settings and system settings.
+
+Appearance settings are stored as a JSON blob per user and system settings as
+key/value rows. Both are read on hot paths (timesheet generation, every page
+render), so they are parsed once and kept here until they change. Saves are
+logged as DataVersion rows by whichever worker makes them (see data_versions),
+so every worker drops its parsed settings once the last change id moves; the
+change id is read once per application context.
+"""
+
+import json
+import logging
+import threading
+
+from flask import g, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# Default weekend: Friday and Saturday in Python's weekday system (0=Monday)
+DEFAULT_WEEKEND_DAYS = (4, 5)
+
+# Default user when nobody is logged in
+DEFAULT_USER_ID = 1
+
+_MISSING = object()
+
+
+class SettingsCache:
+    """Per-user appearance settings and system-wide settings, parsed once"""
+
+    def __init__(self):
+        self._appearance = {}
+        self._system = None
+        self._change_id = None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        """
+        Drop everything parsed before the last logged data change (checked
+        once per application context).
+
+        Returns:
+            The change id the cached settings are valid for, or None outside
+            an application context
+        """
+        if not has_app_context():
+            return None
+        change_id = g.get('settings_change_id')
+        if change_id is None:
+            from data_versions import current_change_id
+
+            change_id = g.settings_change_id = current_change_id()
+            with self._lock:
+                if change_id != self._change_id:
+                    self._appearance.clear()
+                    self._system = None
+                    self._change_id = change_id
+        return change_id
+
+    def get_appearance_settings(self, user_id=DEFAULT_USER_ID):
+        """
+        Get the parsed appearance settings for a user.
+
+        Returns:
+            Dictionary of settings (a copy), or None if the user has none saved
+        """
+        change_id = self._check_version()
+        with self._lock:
+            cached = self._appearance.get(user_id, _MISSING)
+
+        if cached is _MISSING:
+            from models import AppearanceSettings
+
+            cached = None
+            record = AppearanceSettings.query.filter_by(user_id=user_id).first()
+            if record and record.settings:
+                try:
+                    cached = json.loads(record.settings)
+                except ValueError as e:
+                    logger.error(f"Invalid appearance settings for user {user_id}: {str(e)}")
+
+            with self._lock:
+                # Settings read before a newer change was seen are not kept
+                if change_id == self._change_id:
+                    self._appearance[user_id] = cached
+
+        return dict(cached) if cached is not None else None
+
+    def get_system_settings(self):
+        """Get all system settings as a {key: value} dictionary (a copy)"""
+        change_id = self._check_version()
+        with self._lock:
+            cached = self._system
+
+        if cached is None:
+            from models import SystemSettings
+
+            cached = {setting.key: setting.value for setting in SystemSettings.query.all()}
+            with self._lock:
+                if change_id == self._change_id:
+                    self._system = cached
+
+        return dict(cached)
+
+    def get_system_setting(self, key, default=None):
+        """Get a single system setting value"""
+        value = self.get_system_settings().get(key)
+        return value if value else default
+
+    def invalidate_appearance(self, user_id=None):
+        """Forget cached appearance settings for one user, or for everyone"""
+        with self._lock:
+            if user_id is None:
+                self._appearance.clear()
+            else:
+                self._appearance.pop(user_id, None)
+
+    def invalidate_system(self):
+        """Forget cached system settings"""
+        with self._lock:
+            self._system = None
+
+    def clear(self):
+        """Forget everything"""
+        self.invalidate_appearance()
+        self.invalidate_system()
+
+
+# Shared settings cache
+settings_cache = SettingsCache()
+
+
+def get_current_user_id():
+    """Get the current session's user ID, or the default user outside a request"""
+    try:
+        from flask import session
+        return session.get('user_id', DEFAULT_USER_ID)
+    except RuntimeError:
+        return DEFAULT_USER_ID
+
+
+def resolve_weekend_days(user_id=None):
+    """
+    Get the effective weekend days for a user.
+
+    Appearance settings win, then the session's UI settings, then the default
+    Friday/Saturday weekend.
+
+    Returns:
+        Sorted tuple of Python weekday numbers
+    """
+    if user_id is None:
+        user_id = get_current_user_id()
+
+    try:
+        appearance_settings = settings_cache.get_appearance_settings(user_id)
+        if appearance_settings:
+            if appearance_settings.get('weekendDays'):
+                return tuple(sorted({int(day) for day in appearance_settings['weekendDays']}))
+            return DEFAULT_WEEKEND_DAYS
+    except Exception as e:
+        logger.error(f"Error getting weekend days from appearance settings: {str(e)}")
+
+    try:
+        from flask import session
+        ui_settings = session.get('ui_settings') or {}
+        if ui_settings.get('weekend_days'):
+            return tuple(sorted({int(day) for day in ui_settings['weekend_days']}))
+    except RuntimeError:
+        # Outside a request context
+        pass
+    except (TypeError, ValueError) as e:
+        logger.error(f"Invalid weekend days in session: {str(e)}")
+
+    return DEFAULT_WEEKEND_DAYS
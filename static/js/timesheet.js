@@ -143,6 +143,91 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Live updates: poll the delta endpoint and patch only the changed cells
+    const DELTA_POLL_INTERVAL = 15000;
+    const timesheetTable = document.getElementById('timesheet-table');
+
+    function replaceCell(cell, html) {
+        const existingTooltip = window.bootstrap ? bootstrap.Tooltip.getInstance(cell) : null;
+        if (existingTooltip) {
+            existingTooltip.dispose();
+        }
+
+        const template = document.createElement('template');
+        template.innerHTML = `<table><tr>${html}</tr></table>`;
+        const newCell = template.content.querySelector('td');
+        if (!newCell) return;
+
+        cell.replaceWith(newCell);
+        if (window.bootstrap && newCell.dataset.bsToggle === 'tooltip') {
+            new bootstrap.Tooltip(newCell);
+        }
+    }
+
+    function applyTimesheetDelta(delta) {
+        (delta.cells || []).forEach(change => {
+            // Secondary housing rows repeat the employee, so patch every copy
+            timesheetTable.querySelectorAll(
+                `td.attendance-cell[data-employee-id="${change.employee_id}"][data-day="${change.date}"]`
+            ).forEach(cell => replaceCell(cell, change.html));
+        });
+
+        (delta.totals || []).forEach(total => {
+            timesheetTable.querySelectorAll(`td.total-work-hours[data-employee-id="${total.employee_id}"]`)
+                .forEach(cell => replaceCell(cell, total.work_html));
+            timesheetTable.querySelectorAll(`td.total-overtime-hours[data-employee-id="${total.employee_id}"]`)
+                .forEach(cell => replaceCell(cell, total.overtime_html));
+        });
+    }
+
+    function pollTimesheetDelta() {
+        if (document.hidden) return;
+
+        const data = timesheetTable.dataset;
+        const employeeIds = new Set();
+        timesheetTable.querySelectorAll('td.total-work-hours[data-employee-id]').forEach(cell => {
+            employeeIds.add(cell.dataset.employeeId);
+        });
+
+        const params = new URLSearchParams({
+            since: data.version,
+            year: data.year,
+            month: data.month,
+            start_date: data.startDate,
+            end_date: data.endDate,
+            weekend_days: data.weekendDays,
+            department: data.department || '',
+            housing: data.housing || '',
+            employees: Array.from(employeeIds).join(',')
+        });
+
+        fetch(`${data.deltaUrl}?${params.toString()}`)
+            .then(response => response.json())
+            .then(delta => {
+                if (!delta.success) {
+                    console.error('Timesheet delta failed:', delta.error);
+                    return;
+                }
+                if (delta.reload) {
+                    // Rows, the month period or the weekend changed: only a full render is correct
+                    window.location.reload();
+                    return;
+                }
+                applyTimesheetDelta(delta);
+                data.version = delta.version;
+            })
+            .catch(error => console.error('Error polling timesheet delta:', error));
+    }
+
+    if (timesheetTable && timesheetTable.dataset.deltaUrl) {
+        setInterval(pollTimesheetDelta, DELTA_POLL_INTERVAL);
+        document.addEventListener('visibilitychange', function() {
+            if (!document.hidden) {
+                pollTimesheetDelta();
+            }
+        });
+    }
+
     // Handle export to various formats
     document.getElementById('export-pdf')?.addEventListener('click', function() {
         prepareForPrint();
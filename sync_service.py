@@ -34,6 +34,10 @@ SYNC_END_DATE = os.environ.get("SYNC_END_DATE", "")
 CONNECT_TIMEOUT = 30  # Timeout for establishing connection
 READ_TIMEOUT = 180    # Timeout for reading response
 
+# Attendance records committed at a time while processing a sync, so open
+# timesheets (see /api/timesheet/delta) see new punches before the sync ends
+PROCESS_COMMIT_BATCH = int(os.environ.get("SYNC_COMMIT_BATCH", 500))
+
 # متغير عالمي للتحكم في حالة المزامنة
 CANCEL_SYNC = False
 SYNC_THREAD = None
@@ -344,6 +348,7 @@ def process_attendance_data(db, sync_id):
         # Step 5: Calculate work hours and create or update attendance records
         records_created = 0
         records_updated = 0
+        records_committed = 0
 
         for key, data in attendance_data.items():
             # Calculate work hours if both clock_in and clock_out exist
@@ -419,6 +424,19 @@ def process_attendance_data(db, sync_id):
                 db.session.add(new_record)
                 records_created += 1
 
+            # Commit in batches so the records become visible while the sync runs
+            if records_created + records_updated - records_committed >= PROCESS_COMMIT_BATCH:
+                db.session.commit()
+                records_committed = records_created + records_updated
+
+        # Apply the attendance correction rules to the records written by this sync
+        from attendance_corrections import apply_corrections
+        apply_corrections(sync_id=sync_id)
+
+        # Attribute the days written by this sync to housings (check-in terminal first)
+        from housing_attribution import refresh_daily_housing
+        refresh_daily_housing(sync_id=sync_id)
+
         # Commit all changes to avoid detached instances
         db.session.commit()
 
@@ -795,6 +813,15 @@ def simple_sync_data(app=None, request_start_date=None, request_end_date=None):
         sync_log.step = "complete"
         db.session.commit()
 
+        # New attendance invalidates every cached timesheet; rebuild the most used ones
+        from enhanced_cache_optimized import invalidate_timesheets
+        invalidate_timesheets()
+        try:
+            from cache_warmup import start_warmup
+            start_warmup(app)
+        except Exception as e:
+            logger.error(f"Could not start cache warm-up: {str(e)}")
+
         # Update final status
         update_sync_status("complete", 100, f"تمت المزامنة بنجاح - {synced_records} سجل", records=synced_records, status="success")
 
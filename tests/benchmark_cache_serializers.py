@@ -0,0 +1,83 @@
+"""
+Benchmark the cache serializers on a cached timesheet.
+
+Seeds a SQLite database with the tests.timesheet_fixtures dataset, builds a
+full-month timesheet, then stores it in a timesheet-like namespace (disk,
+copy_on_read) of a scratch tiered cache with each serializer, and in a
+frozen one (the timesheet cache's memory tier), and reports the payload size,
+the memory tier size, the write time and the hit latency from the memory tier
+and from the disk tier. Run from the repository root:
+
+    python -m tests.benchmark_cache_serializers --employees 300 --repeat 5
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+
+from tests.benchmark_timesheet_engine import best_time
+from tests.timesheet_fixtures import (
+    FIXTURE_YEAR, FIXTURE_MONTH, FIXTURE_WEEKEND_DAYS, create_timesheet_app, seed_timesheet_data
+)
+
+# Namespace name -> (serializer, frozen)
+CONFIGURATIONS = {
+    'pickle': ('pickle', False),
+    'timesheet': ('timesheet', False),
+    'frozen': ('timesheet', True),
+}
+
+
+def run_benchmark(employee_count, repeat):
+    from timesheet_engine import default_engine
+    from tiered_cache import TieredCache
+
+    database_path = os.path.join(tempfile.mkdtemp(), 'cache_benchmark.db')
+    app = create_timesheet_app(f'sqlite:///{database_path}')
+    with app.app_context():
+        seed_timesheet_data(employee_count=employee_count)
+    with app.test_request_context():
+        timesheet = default_engine.run(FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS)
+
+    cache = TieredCache(cache_dir=tempfile.mkdtemp())
+    results = []
+    for name, (serializer, frozen) in CONFIGURATIONS.items():
+        namespace = cache.namespace(name, ttl=3600, disk=True, copy_on_read=not frozen, frozen=frozen,
+                                    serializer=serializer)
+        payload = namespace.serializer.dumps(timesheet)
+        if namespace.serializer.loads(payload) != timesheet:
+            raise AssertionError(f"{name} serializer does not round-trip the timesheet")
+
+        # Frozen namespaces freeze the rows in place: store a fresh copy each time
+        values = iter([namespace.serializer.loads(payload) for _ in range(repeat)] if frozen else [timesheet] * repeat)
+        write = best_time(lambda: namespace.set('month', next(values)), repeat)
+        memory_hit = best_time(lambda: namespace.get('month'), repeat)
+        memory_size = namespace.stats()['memory_bytes']
+
+        def disk_hit():
+            namespace.clear_memory()
+            namespace.get('month')
+
+        results.append((name, len(payload), memory_size, write, memory_hit, best_time(disk_hit, repeat)))
+    return len(timesheet['employees']), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--employees', type=int, default=300, help='Number of employees to seed')
+    parser.add_argument('--repeat', type=int, default=5, help='Operations timed per serializer (best one is reported)')
+    options = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    rows, results = run_benchmark(options.employees, options.repeat)
+
+    print(f"Timesheet for {FIXTURE_MONTH}/{FIXTURE_YEAR}, {rows} rows, best of {options.repeat}")
+    print(f"{'namespace':<12}{'size KB':>10}{'memory KB':>11}{'write ms':>10}{'memory hit ms':>15}{'disk hit ms':>13}")
+    for name, size, memory_size, write, memory_hit, disk_hit in results:
+        print(f"{name:<12}{size / 1024:>10.1f}{memory_size / 1024:>11.1f}{write:>10.1f}{memory_hit:>15.3f}"
+              f"{disk_hit:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
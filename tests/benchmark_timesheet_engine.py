@@ -0,0 +1,77 @@
+"""
+Benchmark the timesheet engine stage by stage.
+
+Seeds a SQLite database with the tests.timesheet_fixtures dataset, then times
+full-month builds through an engine whose stages are the default ones, timed
+(see TimesheetEngine). The older entry points are adapters over the same
+engine, so they are not timed separately. Run from the repository root:
+
+    python -m tests.benchmark_timesheet_engine --employees 300 --repeat 5
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from tests.timesheet_fixtures import (
+    FIXTURE_YEAR, FIXTURE_MONTH, FIXTURE_WEEKEND_DAYS, create_timesheet_app, seed_timesheet_data
+)
+
+
+def best_time(function, repeat):
+    """Best wall-clock time of several calls, in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def timed_stages(timings):
+    """Default engine stages, each adding its duration (in milliseconds) to timings[name]"""
+    from timesheet_engine import DEFAULT_STAGES
+
+    def timed(name, stage):
+        def run(context):
+            started = time.perf_counter()
+            stage(context)
+            timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        return run
+
+    return {name: timed(name, stage) for name, stage in DEFAULT_STAGES.items()}
+
+
+def run_benchmark(employee_count, repeat):
+    from timesheet_engine import STAGES, TimesheetEngine
+
+    database_path = os.path.join(tempfile.mkdtemp(), 'timesheet_benchmark.db')
+    app = create_timesheet_app(f'sqlite:///{database_path}')
+    with app.app_context():
+        seed_timesheet_data(employee_count=employee_count)
+
+    timings = {}
+    engine = TimesheetEngine(**timed_stages(timings))
+    with app.test_request_context():
+        total = best_time(lambda: engine.run(FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS), repeat)
+    return [(name, min(timings[name])) for name in STAGES] + [('total', total)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--employees', type=int, default=300, help='Number of employees to seed')
+    parser.add_argument('--repeat', type=int, default=5, help='Builds timed per path (best one is reported)')
+    options = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = run_benchmark(options.employees, options.repeat)
+
+    print(f"Timesheet for {FIXTURE_MONTH}/{FIXTURE_YEAR}, {options.employees} employees, best of {options.repeat}")
+    print(f"{'stage':<12}{'ms':>10}")
+    for name, milliseconds in results:
+        print(f"{name:<12}{milliseconds:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -5,4 +5,28 @@ def test_client():
     from myapp import create_app
     app = create_app()
     with app.test_client() as client:
-        yield client
\ No newline at end of file
+        yield client
+
+@pytest.fixture(scope='session', autouse=True)
+def scratch_cache(tmp_path_factory):
+    """
+    Point the timesheet, statistics and leave caches at a throwaway tiered
+    cache, so tests never write into the repository's instance/cache
+    """
+    import cache_manager
+    import enhanced_cache_optimized
+    from tiered_cache import TieredCache
+
+    cache = TieredCache(cache_dir=str(tmp_path_factory.mktemp('cache')))
+    timesheets = enhanced_cache_optimized.timesheet_cache
+    stats = enhanced_cache_optimized.stats_cache
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(enhanced_cache_optimized, 'timesheet_cache', cache.namespace(
+            'timesheets', ttl=timesheets.ttl, disk=True, frozen=True, stale_ttl=timesheets.stale_ttl,
+            serializer=timesheets.serializer, max_memory_bytes=timesheets.max_memory_bytes))
+        monkeypatch.setattr(enhanced_cache_optimized, 'stats_cache', cache.namespace(
+            'stats', ttl=stats.ttl, disk=True, stale_ttl=stats.stale_ttl))
+        monkeypatch.setattr(cache_manager, 'cache', cache)
+        monkeypatch.setattr(cache_manager, 'leave_cache', cache.namespace('leave_periods',
+                                                                          ttl=cache_manager.leave_cache.ttl))
+        yield cache
@@ -0,0 +1,49 @@
+"""
+Tests for the ETag / 304 Not Modified support of response_versions, on a bare
+Flask application bound to a throwaway database.
+"""
+
+from flask import jsonify
+
+from tests.timesheet_fixtures import create_timesheet_app
+
+
+def test_conditional_get_skips_the_view_until_the_data_changes():
+    from database import db
+    from models import DataVersion
+    from response_versions import versioned_response
+
+    app = create_timesheet_app()
+    calls = []
+
+    @app.route('/report')
+    @versioned_response
+    def report():
+        calls.append(True)
+        return jsonify(rows=len(calls))
+
+    client = app.test_client()
+    response = client.get('/report?month=4')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    # Unchanged data: 304 without running the view
+    response = client.get('/report?month=4', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert len(calls) == 1
+
+    # Another scope, or a forced refresh, runs the view
+    assert client.get('/report?month=5', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/report?month=4&refresh=true', headers={'If-None-Match': etag}).status_code == 200
+    assert len(calls) == 3
+
+    # A logged data change moves the ETag
+    with app.app_context():
+        db.session.add(DataVersion(kind='leave', employee_id=1))
+        db.session.commit()
+    response = client.get('/report?month=4', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(calls) == 4
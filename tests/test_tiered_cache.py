@@ -0,0 +1,293 @@
+"""
+Tests for the tiered cache (tiered_cache, cache_index), on throwaway cache
+directories. Two TieredCache instances sharing a directory stand in for two
+worker processes.
+"""
+
+from tiered_cache import TieredCache
+
+
+def make_cache(tmp_path, **kwargs):
+    return TieredCache(cache_dir=str(tmp_path), **kwargs)
+
+
+def test_invalidation_reaches_the_memory_tier_of_other_processes(tmp_path):
+    first = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+    second = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+
+    first.set('department', 'before', tags=['department:1'])
+    first.set('housing', 'kept', tags=['housing:2'])
+    assert second.get('department') == 'before'
+    assert second.get('housing') == 'kept'
+
+    first.invalidate('department:1')
+
+    assert first.get('department') is None
+    assert second.get('department') is None
+    assert second.get('housing') == 'kept'
+
+
+def test_clear_reaches_the_memory_tier_of_other_processes(tmp_path):
+    first = make_cache(tmp_path)
+    second = make_cache(tmp_path)
+
+    first.namespace('timesheets', ttl=60, disk=True).set('month', 'before the sync')
+    first.namespace('stats', ttl=60, disk=True).set('summary', 'kept')
+    assert second.namespace('timesheets', ttl=60, disk=True).get('month') == 'before the sync'
+    assert second.namespace('stats', ttl=60, disk=True).get('summary') == 'kept'
+
+    first.namespace('timesheets').clear()
+
+    assert second.namespace('timesheets').get('month') is None
+    assert second.namespace('stats').get('summary') == 'kept'
+
+    # What the clearing process stores afterwards stays in its memory tier
+    settings = first.namespace('settings', ttl=60)
+    settings.clear()
+    settings.set('appearance', 'after the clear')
+    assert settings.get('appearance') == 'after the clear'
+
+    # A value computed before the clear is not stored after it
+    namespace = second.namespace('timesheets')
+    generation = namespace.tag_generation()
+    first.clear()
+    assert namespace.set('month', 'before the sync', generation=generation) is False
+    assert second.namespace('stats').get('summary') is None
+
+
+def test_values_computed_before_an_invalidation_are_not_stored(tmp_path):
+    namespace = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+    other = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+
+    def compute_while_edited():
+        # The data changes (and its tag is invalidated) while the value is built
+        other.invalidate('department:1')
+        return 'before the edit'
+
+    assert namespace.get_or_compute('department', compute_while_edited, tags=['department:1']) == 'before the edit'
+    assert namespace.get('department') is None
+    assert other.get('department') is None
+
+    assert namespace.get_or_compute('department', lambda: 'after the edit', tags=['department:1']) == 'after the edit'
+    assert other.get('department') == 'after the edit'
+
+    # Prebuilt values carry the generation read before they were built
+    generation = namespace.tag_generation()
+    other.invalidate('housing:2')
+    assert namespace.set('housing', 'stale', tags=['housing:2'], generation=generation) is False
+    assert namespace.set('housing', 'fresh', tags=['housing:2'], generation=namespace.tag_generation()) is True
+    assert other.get('housing') == 'fresh'
+
+
+def test_concurrent_misses_compute_once(tmp_path):
+    import threading
+    import time
+
+    first = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+    # Another process: coalesced through the lock file next to the entry
+    second = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+    calls = []
+
+    def compute():
+        calls.append(threading.get_ident())
+        time.sleep(0.2)
+        return 'built'
+
+    results = []
+    threads = [threading.Thread(target=lambda namespace=namespace: results.append(
+        namespace.get_or_compute('month', compute))) for namespace in [first] * 4 + [second]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['built'] * 5
+    assert len(calls) == 1
+    assert first.stats()['coalesced'] + second.stats()['coalesced'] == 4
+
+
+def test_stale_value_served_while_one_caller_recomputes(tmp_path):
+    import threading
+    import time
+
+    namespace = make_cache(tmp_path).namespace('timesheets', ttl=0.1, disk=True, stale_ttl=60)
+    namespace.set('month', 'old')
+    time.sleep(0.15)
+    assert namespace.get('month') is None  # expired for plain reads
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def recompute():
+        started.set()
+        release.wait(5)
+        return 'new'
+
+    revalidated = []
+    thread = threading.Thread(target=lambda: revalidated.append(namespace.get_or_compute('month', recompute)))
+    thread.start()
+    assert started.wait(5)
+    try:
+        # Served the stale value at once, without computing or waiting
+        assert namespace.get_or_compute('month', lambda: 'not computed') == 'old'
+        assert namespace.stats()['stale_hits'] == 1
+    finally:
+        release.set()
+        thread.join()
+
+    assert revalidated == ['new']
+    assert namespace.get('month') == 'new'
+
+
+def test_disk_entries_are_replaced_atomically(tmp_path, monkeypatch):
+    import os
+    import tiered_cache
+
+    namespace = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+    namespace.set('month', {'rows': [1, 2, 3]})
+
+    def interrupted_replace(source, destination):
+        raise OSError('disk full')
+
+    # A write failing before the rename leaves the previous entry and no temporary file
+    monkeypatch.setattr(tiered_cache.os, 'replace', interrupted_replace)
+    assert namespace.set('month', {'rows': [4, 5, 6]}) is False
+    monkeypatch.undo()
+
+    assert not [name for name in os.listdir(namespace.directory) if name.endswith(tiered_cache.TEMP_SUFFIX)]
+    namespace.clear_memory()
+    assert namespace.get('month') == {'rows': [1, 2, 3]}
+
+
+def test_corrupt_disk_entries_are_discarded(tmp_path):
+    import os
+    from tiered_cache import ENTRY_HEADER, decode_entry, encode_entry
+
+    entry = encode_entry(b'payload', 123.0, tags=('department:1',))
+    assert decode_entry(entry) == (123.0, 0, ('department:1',), b'payload')
+    flipped = entry[:-1] + bytes([entry[-1] ^ 0xFF])
+    assert decode_entry(flipped) is None
+    assert decode_entry(entry[:-1]) is None
+    assert decode_entry(entry[:ENTRY_HEADER.size - 1]) is None
+
+    namespace = make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True)
+    namespace.set('month', 'value')
+    path = namespace._path('month')
+    with open(path, 'r+b') as entry_file:
+        entry_file.seek(-1, os.SEEK_END)
+        last_byte = entry_file.read(1)
+        entry_file.seek(-1, os.SEEK_END)
+        entry_file.write(bytes([last_byte[0] ^ 0xFF]))
+
+    namespace.clear_memory()
+    assert namespace.get('month') is None
+    assert namespace.stats()['corrupt'] == 1
+    assert not os.path.exists(path)
+    assert namespace.disk_usage() == (0, 0)
+
+
+def test_sweep_keeps_the_disk_tier_within_its_byte_budget(tmp_path):
+    import os
+    import time
+
+    cache = make_cache(tmp_path, max_disk_bytes=6000, max_disk_entries=100)
+    namespace = cache.namespace('timesheets', ttl=60, disk=True)
+    short_lived = cache.namespace('stats', ttl=0.01, disk=True)
+
+    for number in range(10):
+        namespace.set(f'month-{number}', os.urandom(1000))
+    short_lived.set('summary', os.urandom(1000))
+    entry_size = namespace.disk_usage()[1] // 10
+    assert cache.stats()['disk_bytes'] > 6000
+
+    # Read back the two oldest entries: least recently used are the next ones
+    time.sleep(0.05)
+    namespace.clear_memory()
+    assert namespace.get('month-0') is not None
+    assert namespace.get('month-1') is not None
+
+    result = cache.sweep()
+
+    assert result['expired'] == 1
+    assert result['bytes'] <= 6000
+    assert result['entries'] == 6000 // entry_size
+    assert result['evicted'] == 10 - result['entries']
+    assert cache.stats()['disk_bytes'] == result['bytes']
+    assert namespace.stats()['disk_evictions'] == result['evicted']
+
+    namespace.clear_memory()
+    kept = [number for number in range(10) if namespace.get(f'month-{number}') is not None]
+    assert kept[:2] == [0, 1]
+    assert kept[2:] == list(range(10 - (len(kept) - 2), 10))
+    assert len(os.listdir(namespace.directory)) == len(kept)
+
+
+def test_stats_report_counters_and_metrics_until_reset(tmp_path, monkeypatch):
+    import cache_manager
+
+    cache = make_cache(tmp_path)
+    namespace = cache.namespace('timesheets', ttl=60, disk=True)
+    namespace.get('missing')
+    namespace.get_or_compute('month', lambda: 'x' * 1000)
+    namespace.get('month')
+    namespace.clear_memory()
+    namespace.get('month')
+
+    stats = namespace.stats()
+    assert (stats['hits'], stats['disk_hits'], stats['misses'], stats['sets']) == (1, 1, 2, 1)
+    assert stats['hit_rate'] == 0.5
+    assert stats['latency']['memory_hit']['count'] == 1
+    assert stats['latency']['disk_hit']['count'] == 1
+    assert stats['latency']['compute']['count'] == 1
+    assert stats['serialized']['count'] == 1 and stats['serialized']['max_bytes'] > 1000
+    assert sorted(stats['top_missed_keys']) == [['missing', 1], ['month', 1]]
+
+    # What /api/cache/stats and /api/cache/stats/reset report and do
+    monkeypatch.setattr(cache_manager, 'cache', cache)
+    report = cache_manager.get_cache_stats()
+    assert report['namespaces']['timesheets']['hits'] == 1
+    assert (report['disk_cache_entries'], report['memory_cache_entries']) == (1, 1)
+    assert report['disk_cache_size_mb'] == round(namespace.disk_usage()[1] / (1024 * 1024), 2)
+
+    cache_manager.reset_cache_stats()
+    stats = cache_manager.get_cache_stats()['namespaces']['timesheets']
+    assert (stats['hits'], stats['disk_hits'], stats['misses'], stats['sets'], stats['hit_rate']) == (0, 0, 0, 0, None)
+    assert stats['latency']['compute']['count'] == 0
+    assert stats['top_missed_keys'] == []
+    # Only the counters go: the entries stay cached
+    assert (stats['memory_items'], stats['disk_items']) == (1, 1)
+
+
+def test_latency_percentiles_use_the_nearest_rank():
+    from cache_metrics import CacheMetrics, percentile
+
+    assert percentile([], 50) is None
+    assert [percentile(list(range(1, 101)), percent) for percent in (50, 95, 99)] == [50, 95, 99]
+
+    metrics = CacheMetrics()
+    for milliseconds in range(1, 11):
+        metrics.record_latency('compute', milliseconds / 1000)
+    latency = metrics.summary()['latency']['compute']
+    assert (latency['count'], latency['p50_ms'], latency['p99_ms'], latency['max_ms']) == (10, 5.0, 10.0, 10.0)
+
+
+def test_failed_timesheet_builds_are_not_cached(tmp_path, monkeypatch):
+    import enhanced_cache_optimized
+    from enhanced_cache_optimized import cached_timesheet
+
+    monkeypatch.setattr(enhanced_cache_optimized, 'timesheet_cache',
+                        make_cache(tmp_path).namespace('timesheets', ttl=60, disk=True))
+    builds = []
+
+    @cached_timesheet
+    def build(year, month):
+        builds.append(True)
+        if len(builds) == 1:
+            # What a timesheet builder returns when the database is briefly unavailable
+            return {'employees': [], 'error': 'connection reset'}
+        return {'employees': [{'id': 1}]}
+
+    assert build(2025, 4)['error'] == 'connection reset'
+    assert build(2025, 4) == {'employees': [{'id': 1}]}
+    assert build(2025, 4) == {'employees': [{'id': 1}]}
+    assert len(builds) == 2
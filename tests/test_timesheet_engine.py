@@ -0,0 +1,412 @@
+"""
+Golden-output tests for the timesheet engine.
+
+tests/golden/timesheet_engine.json holds the timesheets built for the
+tests.timesheet_fixtures dataset by optimized_generate_timesheet as it was
+before keyset pagination, SQL totals and the engine (the second page through
+an offset). The engine and every entry point adapted to it must keep
+producing them exactly.
+"""
+
+import json
+import os
+
+import pytest
+
+from tests.timesheet_fixtures import (
+    FIXTURE_YEAR, FIXTURE_MONTH, FIXTURE_WEEKEND_DAYS,
+    create_timesheet_app, seed_timesheet_data, timesheet_snapshot
+)
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'golden', 'timesheet_engine.json')
+
+# Golden case -> (positional timesheet arguments, keyword arguments)
+GOLDEN_CASES = {
+    'full': ((None, None, None, None), {}),
+    'department': ((2, None, None, None), {}),
+    'housing': ((None, None, None, 3), {}),
+    'custom_range': ((None, '2025-04-07', '2025-04-20', None), {}),
+    'first_page': ((None, None, None, None), {'limit': 10}),
+    # Months of the older entry points: the fiscal month with and without the
+    # last 5 days of the previous month
+    'prefixed_fiscal_month': ((None, '2025-03-27', '2025-04-27', None), {}),
+    'fiscal_month': ((None, '2025-03-29', '2025-04-27', None), {}),
+}
+
+
+@pytest.fixture(scope='module')
+def golden():
+    with open(GOLDEN_PATH, encoding='utf-8') as golden_file:
+        return json.load(golden_file)
+
+
+@pytest.fixture(scope='module')
+def timesheet_app():
+    app = create_timesheet_app()
+    with app.app_context():
+        seed_timesheet_data()
+    return app
+
+
+@pytest.fixture
+def app_context(timesheet_app):
+    with timesheet_app.test_request_context():
+        yield
+
+
+@pytest.mark.parametrize('case', sorted(GOLDEN_CASES))
+def test_engine_matches_golden(app_context, golden, case):
+    from timesheet_engine import default_engine
+
+    args, kwargs = GOLDEN_CASES[case]
+    timesheet_data = default_engine.run(FIXTURE_YEAR, FIXTURE_MONTH, *args,
+                                        weekend_days=FIXTURE_WEEKEND_DAYS, **kwargs)
+    assert timesheet_snapshot(timesheet_data) == golden[case]
+
+
+def test_engine_cursor_page_matches_golden(app_context, golden):
+    from timesheet_engine import default_engine
+
+    first_page = default_engine.run(FIXTURE_YEAR, FIXTURE_MONTH, limit=10, weekend_days=FIXTURE_WEEKEND_DAYS)
+    second_page = default_engine.run(FIXTURE_YEAR, FIXTURE_MONTH, limit=10,
+                                     cursor=first_page['pagination']['next_cursor'],
+                                     weekend_days=FIXTURE_WEEKEND_DAYS)
+    assert timesheet_snapshot(second_page) == golden['second_page']
+
+
+@pytest.mark.parametrize('case', sorted(GOLDEN_CASES))
+def test_page_entry_point_matches_golden(app_context, golden, case):
+    from optimized_timesheet import optimized_generate_timesheet
+
+    args, kwargs = GOLDEN_CASES[case]
+    timesheet_data = optimized_generate_timesheet(FIXTURE_YEAR, FIXTURE_MONTH, *args, force_refresh=True, **kwargs)
+    assert timesheet_snapshot(timesheet_data) == golden[case]
+
+
+@pytest.mark.parametrize('entry_point, month_case', [
+    ('optimized_timesheet.optimized_generate_timesheet', 'full'),
+    ('data_processor.generate_timesheet', 'prefixed_fiscal_month'),
+    ('optimized_data_processor.generate_optimized_timesheet', 'fiscal_month'),
+])
+def test_entry_points_keep_their_month_ranges(app_context, golden, entry_point, month_case):
+    import importlib
+
+    module_name, function_name = entry_point.rsplit('.', 1)
+    generate = getattr(importlib.import_module(module_name), function_name)
+
+    month = generate(FIXTURE_YEAR, FIXTURE_MONTH, force_refresh=True)
+    assert timesheet_snapshot(month) == golden[month_case]
+
+    args, kwargs = GOLDEN_CASES['custom_range']
+    custom_range = generate(FIXTURE_YEAR, FIXTURE_MONTH, *args, force_refresh=True, **kwargs)
+    assert timesheet_snapshot(custom_range) == golden['custom_range']
+
+
+def test_streamed_rows_match_golden(app_context, golden):
+    from optimized_timesheet import stream_timesheet
+
+    timesheet_info, rows = stream_timesheet(FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS,
+                                            chunk_size=7, use_cache=False)
+    snapshot = timesheet_snapshot(dict(timesheet_info, employees=list(rows)))
+    assert snapshot['employees'] == golden['full']['employees']
+
+
+def test_stages_are_pluggable(app_context, golden):
+    from timesheet_engine import TimesheetEngine, overlay_statuses
+
+    def overlay_without_leave(context):
+        overlay_statuses(context)
+        for days in context['employee_days'].values():
+            for day in days:
+                day['status'] = 'X'
+
+    timesheet_data = TimesheetEngine(overlay=overlay_without_leave).run(
+        FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS
+    )
+    snapshot = timesheet_snapshot(timesheet_data)
+    assert len(snapshot['employees']) == len(golden['full']['employees'])
+    assert all(set(row['statuses']) == {'X'} for row in snapshot['employees'])
+
+    with pytest.raises(ValueError):
+        TimesheetEngine(render=overlay_statuses)
+
+
+def test_single_punch_correction_keeps_exception_days(monkeypatch):
+    from datetime import datetime, time
+    import attendance_totals
+    from database import db
+    from models import AttendanceRecord, Employee, EmployeeException
+    from attendance_corrections import apply_corrections
+
+    app = create_timesheet_app()
+    with app.app_context():
+        seed_timesheet_data()
+        # One of the fixture's exception days stands in for the single-punch day
+        day = EmployeeException.query.order_by(EmployeeException.id).first().date
+        monkeypatch.setattr(attendance_totals, 'SINGLE_PUNCH_DATE', day)
+        excepted = {exception.employee_id for exception in EmployeeException.query.filter_by(date=day)}
+        others = [employee.id for employee in Employee.query.order_by(Employee.id)
+                  if employee.id not in excepted][:3]
+
+        # Single punches marked present: only the exception rows tell them apart
+        AttendanceRecord.query.filter_by(date=day).delete()
+        db.session.add_all([
+            AttendanceRecord(employee_id=employee_id, date=day, weekday=day.strftime('%A'),
+                             clock_in=datetime.combine(day, time(7)), clock_out=None,
+                             work_hours=8, overtime_hours=0, attendance_status='P')
+            for employee_id in sorted(excepted) + others
+        ])
+        db.session.commit()
+
+        corrected = apply_corrections()
+        hours = {record.employee_id: record.work_hours for record in AttendanceRecord.query.filter_by(date=day)}
+
+    assert corrected == {'single_punch_may_10': len(others)}
+    assert {employee_id: hours[employee_id] for employee_id in excepted} == dict.fromkeys(excepted, 8)
+    assert {employee_id: hours[employee_id] for employee_id in others} == dict.fromkeys(others, 1)
+
+
+def test_frozen_cache_serves_shared_read_only_timesheet(app_context, golden, tmp_path):
+    import copy
+    from timesheet_engine import default_engine
+    from tiered_cache import TieredCache
+    from timesheet_rows import Overlay
+
+    namespace = TieredCache(cache_dir=str(tmp_path)).namespace(
+        'timesheets', ttl=60, disk=True, frozen=True, serializer='timesheet'
+    )
+    namespace.set('month', default_engine.run(FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS))
+
+    cached = namespace.get('month')
+    assert namespace.get('month') is cached
+    assert timesheet_snapshot(cached) == golden['full']
+
+    row = cached['employees'][0]
+    with pytest.raises(TypeError):
+        cached['pagination_info'] = {}
+    with pytest.raises(TypeError):
+        row['name'] = 'Changed'
+    with pytest.raises(TypeError):
+        row['attendance'][0]['status'] = 'X'
+
+    decorated = Overlay(row, present_days=3)
+    decorated['name'] = 'Changed'
+    assert (decorated['present_days'], decorated.name, row.name) == (3, 'Changed', golden['full']['employees'][0]['name'])
+
+    thawed = copy.deepcopy(cached)
+    thawed['employees'][0]['attendance'][0]['status'] = 'X'
+    assert cached['employees'][0]['attendance'][0]['status'] != 'X'
+
+    # Promoted from the disk tier frozen as well
+    namespace.clear_memory()
+    assert timesheet_snapshot(namespace.get('month')) == golden['full']
+    with pytest.raises(TypeError):
+        namespace.get('month')['employees'][0]['name'] = 'Changed'
+
+
+def test_timesheet_cursor_round_trip():
+    import base64
+    from optimized_timesheet import encode_timesheet_cursor, decode_timesheet_cursor
+
+    def raw_cursor(payload):
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    cursor = encode_timesheet_cursor('موظف 1', 42, 'prev')
+    assert '=' not in cursor
+    assert decode_timesheet_cursor(cursor) == ('موظف 1', 42, 'prev')
+    assert decode_timesheet_cursor(encode_timesheet_cursor('Employee 07', 7)) == ('Employee 07', 7, 'next')
+    assert decode_timesheet_cursor(raw_cursor('{"n":"A","i":"3","d":"sideways"}')) == ('A', 3, 'next')
+
+    for invalid in (None, '', 'not a cursor', raw_cursor('[1, 2]'), raw_cursor('{"n":"A"}'),
+                    raw_cursor('{"n":"A","i":"three"}')):
+        assert decode_timesheet_cursor(invalid) is None
+
+
+def test_employee_count_follows_changes_of_other_workers():
+    from sqlalchemy import func, insert, update
+    from database import db
+    from models import DataVersion, Employee
+    from optimized_timesheet import get_employee_count, invalidate_employee_count_cache
+
+    app = create_timesheet_app()
+    with app.app_context():
+        seed_timesheet_data(employee_count=6)
+        invalidate_employee_count_cache()
+        try:
+            count = get_employee_count()
+            assert get_employee_count() == count
+
+            # Deactivate an employee the way another worker would: this process
+            # sees no ORM event, only the change logged in the database
+            employee_id = db.session.query(func.min(Employee.id)).scalar()
+            employees = Employee.__table__
+            db.session.execute(update(employees).where(employees.c.id == employee_id).values(active=False))
+            db.session.execute(insert(DataVersion.__table__).values(kind='employee', employee_id=employee_id))
+            db.session.commit()
+
+            assert get_employee_count() == count - 1
+        finally:
+            invalidate_employee_count_cache()
+
+
+def test_timesheet_build_reads_leave_periods_from_the_cache():
+    from datetime import date
+    from sqlalchemy import event, insert
+    from database import db
+    from models import DataVersion, EmployeeVacation
+    from cache_manager import clear_leave_cache
+    from timesheet_engine import default_engine
+
+    def build():
+        return timesheet_snapshot(default_engine.run(FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS))
+
+    app = create_timesheet_app()
+    with app.app_context():
+        seed_timesheet_data()
+    clear_leave_cache()
+    try:
+        with app.test_request_context():
+            first = build()
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.test_request_context():
+            event.listen(db.engine, 'before_cursor_execute', record_statement)
+            try:
+                assert build() == first
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record_statement)
+        assert statements
+        assert not [statement for statement in statements
+                    if 'employee_vacations' in statement or 'employee_transfers' in statement]
+
+        # A vacation added by another worker: this process sees no ORM event,
+        # only the change logged in the database
+        employee_id = first['employees'][0]['id']
+        with app.app_context():
+            db.session.execute(insert(EmployeeVacation.__table__).values(
+                employee_id=employee_id, start_date=date(2025, 4, 28), end_date=date(2025, 4, 29)))
+            db.session.execute(insert(DataVersion.__table__).values(
+                kind='leave', employee_id=employee_id, start_date=date(2025, 4, 28), end_date=date(2025, 4, 29)))
+            db.session.commit()
+
+        with app.test_request_context():
+            rebuilt = build()
+        day = first['dates'].index('2025-04-28')
+        row = next(row for row in rebuilt['employees'] if row['id'] == employee_id)
+        assert row['statuses'][day:day + 2] == 'VV'
+    finally:
+        clear_leave_cache()
+
+
+def test_settings_follow_saves_of_other_workers():
+    import json
+    from sqlalchemy import insert, update
+    from database import db
+    from models import AppearanceSettings, DataVersion
+    from settings_cache import settings_cache, resolve_weekend_days
+
+    app = create_timesheet_app()
+    with app.app_context():
+        db.session.add(AppearanceSettings(user_id=1, settings=json.dumps({'weekendDays': [4, 5]})))
+        db.session.commit()
+    settings_cache.clear()
+    try:
+        with app.app_context():
+            assert resolve_weekend_days(1) == (4, 5)
+
+        # Saved by another worker: this process only sees the logged change
+        with app.app_context():
+            appearance = AppearanceSettings.__table__
+            db.session.execute(update(appearance).where(appearance.c.user_id == 1).values(
+                settings=json.dumps({'weekendDays': [5, 6]})))
+            db.session.execute(insert(DataVersion.__table__).values(kind='settings'))
+            db.session.commit()
+
+        with app.app_context():
+            assert resolve_weekend_days(1) == (5, 6)
+    finally:
+        settings_cache.clear()
+
+
+def test_batch_worker_processes_match_serial_build(app_context):
+    from timesheet_batch import build_month_timesheets
+
+    serial = build_month_timesheets(FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS,
+                                    processes=0, prime_cache=False)
+    parallel = build_month_timesheets(FIXTURE_YEAR, FIXTURE_MONTH, weekend_days=FIXTURE_WEEKEND_DAYS,
+                                      processes=2, prime_cache=False)
+    assert list(parallel) == list(serial)
+    assert all(timesheet_snapshot(parallel[scope]) == timesheet_snapshot(serial[scope]) for scope in serial)
+
+
+def test_timesheet_delta_reloads_only_for_changes_to_the_page():
+    import json
+    from datetime import date
+    from database import db
+    from models import AppearanceSettings, Employee, EmployeeVacation
+    from data_versions import current_data_version
+    from enhanced_cache_optimized import invalidate_timesheets
+    from optimized_timesheet import get_timesheet_delta, invalidate_employee_count_cache, optimized_generate_timesheet
+    from settings_cache import settings_cache
+    from cache_manager import clear_leave_cache
+
+    app = create_timesheet_app()
+    with app.app_context():
+        seed_timesheet_data()
+    invalidate_timesheets()
+    settings_cache.clear()
+    invalidate_employee_count_cache()
+    clear_leave_cache()
+    try:
+        with app.test_request_context():
+            department_id = db.session.query(Employee.department_id).order_by(Employee.id).first()[0]
+            page_args = (FIXTURE_YEAR, FIXTURE_MONTH, department_id, '2025-04-01', '2025-04-30', None)
+            page = optimized_generate_timesheet(*page_args, weekend_days=FIXTURE_WEEKEND_DAYS)
+            shown = [row['id'] for row in page['employees']]
+
+            def delta(since=None, weekend_days=FIXTURE_WEEKEND_DAYS):
+                return get_timesheet_delta(since or page['data_version'], FIXTURE_YEAR, FIXTURE_MONTH,
+                                           '2025-04-01', '2025-04-30', weekend_days, shown, department_id)
+
+            assert delta() == {'version': page['data_version'], 'reload': False, 'cells': [], 'totals': []}
+
+            # Another user's theme and an employee outside the page's scope change nothing on the page
+            db.session.add(AppearanceSettings(user_id=2, settings=json.dumps({'theme': 'light'})))
+            outsider = Employee.query.filter(Employee.department_id != department_id, Employee.active == True).first()
+            outsider.housing_id = None
+            db.session.commit()
+            result = delta()
+            assert (result['reload'], result['cells']) == (False, [])
+            assert result['version'] != page['data_version']
+
+            # A vacation of a shown employee patches their cells
+            db.session.add(EmployeeVacation(employee_id=shown[0], start_date=date(2025, 4, 14),
+                                            end_date=date(2025, 4, 15)))
+            db.session.commit()
+            result = delta()
+            assert result['reload'] is False
+            assert {(cell['employee_id'], cell['date']) for cell in result['cells']} == \
+                {(shown[0], '2025-04-14'), (shown[0], '2025-04-15')}
+            assert [total['employee_id'] for total in result['totals']] == [shown[0]]
+
+            # Another weekend than the user's own reloads
+            assert delta(weekend_days=(5, 6))['reload'] is True
+
+            # An employee moving into the department reloads, and the reloaded
+            # page is rebuilt instead of served with the old version again
+            outsider.department_id = department_id
+            db.session.commit()
+            assert delta()['reload'] is True
+            reloaded = optimized_generate_timesheet(*page_args, weekend_days=FIXTURE_WEEKEND_DAYS)
+            assert reloaded['data_version'] == current_data_version()
+            assert outsider.id in [row['id'] for row in reloaded['employees']]
+            assert delta(reloaded['data_version'])['reload'] is False
+    finally:
+        invalidate_timesheets()
+        settings_cache.clear()
+        invalidate_employee_count_cache()
+        clear_leave_cache()
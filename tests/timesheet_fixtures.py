@@ -0,0 +1,160 @@
+"""
+Deterministic timesheet dataset shared by the timesheet engine tests and benchmark.
+
+The data lives in a throwaway SQLite database, so neither the tests nor the
+benchmark need the production PostgreSQL server.
+"""
+
+import os
+import json
+import random
+from datetime import date, datetime, time, timedelta
+
+from flask import Flask
+
+# Month covered by the dataset (fully in the past, so no day is a future day)
+FIXTURE_YEAR = 2025
+FIXTURE_MONTH = 4
+FIXTURE_WEEKEND_DAYS = (4, 5)
+
+# The application's templates (the timesheet cell macros)
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
+def create_timesheet_app(database_uri='sqlite://'):
+    """Create a bare Flask application, with the application's templates, bound to an empty database"""
+    from database import db
+    import models  # noqa: F401 - registers the tables
+
+    app = Flask(__name__, template_folder=TEMPLATE_FOLDER)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.secret_key = 'timesheet-tests'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def seed_timesheet_data(employee_count=24, seed=1):
+    """
+    Fill the database with housings, terminals, employees, a month of
+    attendance and some vacations, transfers and exceptions.
+    Must run inside an application context.
+    """
+    from database import db
+    from models import (Housing, Department, BiometricTerminal, Employee, AttendanceRecord, MonthPeriod,
+                        EmployeeVacation, EmployeeTransfer, EmployeeException)
+    from housing_attribution import refresh_daily_housing
+
+    rnd = random.Random(seed)
+
+    housings = [Housing(name=f'Housing {i}') for i in range(3)]
+    departments = [Department(dept_id=str(i), name=f'Department {i}', active=True) for i in range(3)]
+    db.session.add_all(housings + departments)
+    db.session.flush()
+
+    # T3 belongs to no housing
+    db.session.add_all([
+        BiometricTerminal(device_id=f'D{i}', terminal_alias=f'T{i}',
+                          housing_id=housings[i].id if i < 3 else None)
+        for i in range(4)
+    ])
+
+    employees = [
+        Employee(emp_code=f'E{i:04d}', name=f'Employee {i % 17:02d}', name_ar=f'موظف {i}', profession='Technician',
+                 department_id=departments[i % 3].id, housing_id=housings[i % 3].id if i % 5 else None,
+                 active=i % 13 != 12)
+        for i in range(employee_count)
+    ]
+    db.session.add_all(employees)
+    db.session.flush()
+
+    # Each day has at most one housing: employees check out where they checked
+    # in or at T3, and employees without a housing only use one housing's
+    # terminal (the pre-engine timesheet picked among ties in set order)
+    first_day = date(FIXTURE_YEAR, FIXTURE_MONTH, 1) - timedelta(days=6)
+    for index, employee in enumerate(employees):
+        terminals = [f'T{i}' for i in range(4)] if employee.housing_id else [f'T{index % 3}', 'T3']
+        for offset in range(40):
+            day = first_day + timedelta(days=offset)
+            if rnd.random() >= 0.7:
+                continue
+            hours = rnd.choice([0, 4, 8, 9.5, 11])
+            single_punch = rnd.random() < 0.1
+            terminal_in = rnd.choice(terminals)
+            db.session.add(AttendanceRecord(
+                employee_id=employee.id, date=day, weekday=day.strftime('%A'),
+                clock_in=datetime.combine(day, time(7)),
+                clock_out=None if single_punch else datetime.combine(day, time(17)),
+                work_hours=min(hours, 8), overtime_hours=max(hours - 8, 0),
+                attendance_status=rnd.choice('PPPPA'),
+                terminal_alias_in=terminal_in, terminal_alias_out=rnd.choice([terminal_in, 'T3'])
+            ))
+
+    for index in range(1, employee_count, 7):
+        start = date(FIXTURE_YEAR, FIXTURE_MONTH, 1 + index % 20)
+        db.session.add(EmployeeVacation(employee_id=employees[index].id, start_date=start,
+                                        end_date=start + timedelta(days=3)))
+    for index in range(2, employee_count, 9):
+        start = date(FIXTURE_YEAR, FIXTURE_MONTH, 5 + index % 15)
+        db.session.add(EmployeeTransfer(employee_id=employees[index].id, from_housing_id=housings[0].id,
+                                        to_housing_id=housings[1].id, start_date=start,
+                                        end_date=start + timedelta(days=2)))
+    for index in range(3, employee_count, 6):
+        db.session.add(EmployeeException(employee_id=employees[index].id,
+                                         date=date(FIXTURE_YEAR, FIXTURE_MONTH, 1 + index % 28),
+                                         hours_credited=8))
+
+    # A fiscal month that is not the calendar month
+    db.session.add(MonthPeriod(month_code=f'{FIXTURE_MONTH:02d}/{str(FIXTURE_YEAR)[2:]}',
+                               start_date=date(FIXTURE_YEAR, FIXTURE_MONTH, 1) - timedelta(days=3),
+                               end_date=date(FIXTURE_YEAR, FIXTURE_MONTH, 27),
+                               days_in_month=30, hours_in_month=240))
+    db.session.flush()
+    refresh_daily_housing()
+    db.session.commit()
+
+
+def _jsonable(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def timesheet_snapshot(timesheet_data):
+    """
+    Reduce a timesheet to the values it displays, as plain JSON types, so two
+    timesheets can be compared (timings and version tokens are left out).
+    """
+    return json.loads(json.dumps({
+        'error': timesheet_data.get('error'),
+        'dates': timesheet_data.get('dates', []),
+        'start_date': timesheet_data.get('start_date'),
+        'end_date': timesheet_data.get('end_date'),
+        'working_days': timesheet_data.get('working_days'),
+        'working_hours': timesheet_data.get('working_hours'),
+        'weekend_days': list(timesheet_data.get('weekend_days') or []),
+        'total_employees': timesheet_data.get('total_employees'),
+        'housing_groups': {name: len(rows) for name, rows in (timesheet_data.get('housing_groups') or {}).items()},
+        'employees': [
+            {
+                'id': row['id'],
+                'emp_code': row['emp_code'],
+                'name': row['name'],
+                'department': row['department'],
+                'housing': row['housing'],
+                'housing_id': row['housing_id'],
+                'is_primary': row['is_primary'],
+                'terminal_alias_in': row['terminal_alias_in'],
+                'devices': sorted(row['devices']),
+                'total_work_hours': row['total_work_hours'],
+                'total_overtime_hours': row['total_overtime_hours'],
+                # One character per day ('.' for a day without status)
+                'statuses': ''.join(day['status'] or '.' for day in row['attendance']),
+                'weekends': ''.join('W' if day['is_weekend'] else '.' for day in row['attendance']),
+                'hours': [day['record']['work_hours'] if day.get('record') else None for day in row['attendance']]
+            }
+            for row in timesheet_data.get('employees', [])
+        ]
+    }, default=_jsonable, sort_keys=True))
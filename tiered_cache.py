@@ -0,0 +1,1116 @@
+"""
+Tiered cache shared by every cache of the application.
+
+One in-process memory tier, an LRU bounded by bytes, sits over a disk tier
+(one directory per namespace under instance/cache). Callers work with
+namespaces, each with its own TTL:
+
+    timesheets = cache.namespace('timesheets', ttl=7200, disk=True, copy_on_read=True)
+    timesheets.set(key, value)
+    timesheets.get(key)
+
+- disk: entries are also written to disk, so they survive restarts and are
+  shared by the worker processes; a memory miss falls back to the disk tier.
+  The disk tier is indexed (see cache_index) and kept within
+  CACHE_DISK_MAX_BYTES and CACHE_DISK_MAX_ENTRIES by sweep(), which the
+  scheduler runs, evicting by CACHE_EVICTION_POLICY (lru or lfu).
+  Each file has a header with the entry's expiry and a checksum, and is
+  written to a temporary file then renamed, so readers never see a partial
+  entry and never wait for writers. Invalid files are treated as misses.
+- copy_on_read: the memory tier keeps the serialized bytes and every read
+  returns a fresh copy, for callers that modify what they get.
+- frozen: the memory tier keeps the value itself, made read-only by the
+  serializer's freeze(), and every read returns that same object (no copy,
+  no deserialization); its size is the serializer's memory_size() estimate.
+- max_memory_bytes: a namespace's own share of the memory tier; past it, the
+  namespace's least recently used entries are evicted.
+- serializer: how values are turned into bytes for the disk tier and for
+  copy_on_read (see cache_serializers): 'pickle' by default, or 'timesheet'
+  for the compressed columnar timesheet format.
+
+The memory tier evicts the least recently used entries, of any namespace,
+once the total size goes over CACHE_MEMORY_MAX_BYTES. Sizes are the
+serialized size of a value (an estimate for namespaces kept in memory only).
+stats() reports hits, misses and sizes for every namespace, with the latency
+of hits and computations, the serialized sizes and the most missed keys (see
+cache_metrics).
+
+Entries can be tagged when stored (set(key, value, tags=[...])); invalidate(tag)
+then drops every entry carrying the tag, in any namespace, reading only those
+entries (a tag map in memory; on disk, the index, rebuilt from the tags kept
+in each entry file). It also gives the tag a new generation in the index:
+the other worker processes drop the tag's entries from their own memory tier
+when they next hit a tagged entry, and a value computed before the
+invalidation (get_or_compute, or set with a generation) is not stored. Every
+entry also carries its namespace's tag (namespace:<name>), so clear() reaches
+the other processes the same way.
+
+get_or_compute(key, compute) protects expensive values against stampedes:
+concurrent misses for one key are coalesced so only the first caller
+computes, in this process (a lock per key) and across worker processes (a
+lock file next to the entry, for disk namespaces). With a stale_ttl, an
+expired value is still served for that long to the other callers while one
+of them recomputes it (stale-while-revalidate).
+"""
+
+import os
+import sys
+import time
+import struct
+import zlib
+import hashlib
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+from weakref import WeakValueDictionary
+
+from cache_index import DiskIndex, EVICTION_ORDERS
+from cache_metrics import CacheMetrics
+from cache_serializers import get_serializer, serializer_for_code
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Root of the disk tier (one sub-directory per namespace)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cache')
+
+# Byte budget of the memory tier, shared by all namespaces
+DEFAULT_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+
+# Budget of the disk tier (bytes and entries), enforced by sweep()
+DEFAULT_DISK_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_DISK_MAX_ENTRIES = 2000
+
+# Index of the disk tier, in the cache root
+INDEX_FILENAME = 'index.sqlite3'
+
+# Age after which reindex() removes leftover temporary and lock files
+ORPHAN_FILE_AGE = 3600
+
+# Disk entry header: magic, serializer code, expiry timestamp, tags length,
+# payload length, CRC32 of the tags and payload
+ENTRY_MAGIC = b'HMC3'
+ENTRY_HEADER = struct.Struct('>4sBdIQI')
+
+# Suffix of the temporary files entries are written to before being renamed
+TEMP_SUFFIX = '.tmp'
+
+# Interval between two attempts to take a busy lock file
+LOCK_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+def estimate_size(value, depth=0):
+    """Approximate memory size of a value in bytes (containers and object attributes, a few levels deep)"""
+    size = sys.getsizeof(value)
+    if depth >= 4:
+        return size
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, depth + 1) + estimate_size(v, depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, depth + 1) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += estimate_size(vars(value), depth + 1)
+    return size
+
+
+def encode_tags(tags):
+    """Tags as stored in a disk entry (one per line)"""
+    return '\n'.join(tags).encode('utf-8')
+
+
+def decode_tags(data):
+    """Tags stored in a disk entry"""
+    return tuple(data.decode('utf-8').split('\n')) if data else ()
+
+
+def encode_entry(payload, expires_at, serializer_code=0, tags=()):
+    """
+    Disk entry: header (magic, serializer code, expiry, tags length, payload
+    length, CRC32) followed by the tags and the serialized value
+    """
+    tag_data = encode_tags(tags)
+    checksum = zlib.crc32(payload, zlib.crc32(tag_data))
+    header = ENTRY_HEADER.pack(ENTRY_MAGIC, serializer_code, expires_at, len(tag_data), len(payload), checksum)
+    return header + tag_data + payload
+
+
+def decode_entry(data):
+    """
+    Parse a disk entry.
+
+    Args:
+        data: Entry bytes
+
+    Returns:
+        Tuple (expires_at, serializer_code, tags, payload), or None if the
+        entry is partial, corrupted or not in this format
+    """
+    if len(data) < ENTRY_HEADER.size:
+        return None
+    magic, serializer_code, expires_at, tags_length, length, checksum = ENTRY_HEADER.unpack_from(data)
+    payload_start = ENTRY_HEADER.size + tags_length
+    if magic != ENTRY_MAGIC or len(data) != payload_start + length:
+        return None
+    tag_data = data[ENTRY_HEADER.size:payload_start]
+    payload = data[payload_start:]
+    if zlib.crc32(payload, zlib.crc32(tag_data)) != checksum:
+        return None
+    return expires_at, serializer_code, decode_tags(tag_data), payload
+
+
+def read_entry_header(path):
+    """
+    Read the header and tags of a disk entry (not its payload), checking only
+    the sizes.
+
+    Returns:
+        Tuple (expires_at, tags), or None if the entry is partial or not in
+        this format
+    """
+    with open(path, 'rb') as f:
+        header = f.read(ENTRY_HEADER.size)
+        if len(header) != ENTRY_HEADER.size:
+            return None
+        magic, serializer_code, expires_at, tags_length, length, checksum = ENTRY_HEADER.unpack(header)
+        if magic != ENTRY_MAGIC or os.fstat(f.fileno()).st_size != ENTRY_HEADER.size + tags_length + length:
+            return None
+        tag_data = f.read(tags_length)
+    try:
+        return expires_at, decode_tags(tag_data)
+    except UnicodeDecodeError:
+        return None
+
+
+def read_entry(path, load):
+    """
+    Read a disk entry and deserialize its payload.
+
+    Args:
+        path: Entry file
+        load: Callable (expires_at, serializer_code, tags, payload) returning
+            the value
+
+    Returns:
+        What load returned, or None when the entry is invalid
+
+    Raises:
+        OSError: The file cannot be read (FileNotFoundError when absent)
+    """
+    with open(path, 'rb') as f:
+        entry = decode_entry(f.read())
+    return load(*entry) if entry is not None else None
+
+
+def write_entry(path, payload, expires_at, serializer_code=0, tags=()):
+    """
+    Write a disk entry atomically: to a temporary file in the same directory,
+    synced, then renamed over the entry. Readers see the old entry or the new
+    one, never a partial file.
+
+    Returns:
+        Size of the entry file in bytes
+    """
+    data = encode_entry(payload, expires_at, serializer_code, tags)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=TEMP_SUFFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        _remove_file(temp_path)
+        raise
+    return len(data)
+
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _remove_lock_file(path):
+    """Remove a lock file nobody holds"""
+    lock = _FileLock(path)
+    if lock.acquire(0):
+        try:
+            _remove_file(path)
+        finally:
+            lock.release()
+
+
+class _FileLock:
+    """Exclusive lock on a file, shared by every process using the cache directory"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self, timeout):
+        """Take the lock, waiting up to timeout seconds (returns False when it could not be taken)"""
+        deadline = time.time() + timeout
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(self.fd, msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if time.time() >= deadline:
+                    os.close(self.fd)
+                    self.fd = None
+                    return False
+                time.sleep(LOCK_POLL_INTERVAL)
+
+    def release(self):
+        if self.fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+class _Flight:
+    """Lock held while one caller computes a key: a thread lock, plus a lock file for disk namespaces"""
+
+    def __init__(self, namespace, key):
+        self.thread_lock = namespace.cache._flight_lock(namespace, key)
+        self.file_lock = _FileLock(namespace._path(key)[:-len('.pkl')] + '.lock') if namespace.disk else None
+
+    def acquire(self, timeout):
+        """Take both locks within timeout seconds (0 to only try)"""
+        started = time.time()
+        if timeout > 0:
+            acquired = self.thread_lock.lock.acquire(timeout=timeout)
+        else:
+            acquired = self.thread_lock.lock.acquire(blocking=False)
+        if not acquired:
+            return False
+        if self.file_lock is not None:
+            try:
+                acquired = self.file_lock.acquire(max(0, timeout - (time.time() - started)))
+            except OSError as e:
+                logger.warning(f"Cannot lock {self.file_lock.path}: {str(e)}")
+                acquired = True
+            if not acquired:
+                self.thread_lock.lock.release()
+                return False
+        return True
+
+    def release(self):
+        try:
+            if self.file_lock is not None:
+                self.file_lock.release()
+        finally:
+            self.thread_lock.lock.release()
+
+
+class _KeyLock:
+    """Thread lock of one key, dropped from the registry once no caller holds a reference"""
+
+    __slots__ = ('lock', '__weakref__')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+class _MemoryEntry:
+    """Value held by the memory tier (or its serialized bytes and their serializer, for copy_on_read)"""
+
+    __slots__ = ('value', 'payload', 'serializer', 'size', 'expires_at', 'tags')
+
+    def __init__(self, value, payload, serializer, size, expires_at, tags=()):
+        self.value = value
+        self.payload = payload
+        self.serializer = serializer
+        self.size = size
+        self.expires_at = expires_at
+        self.tags = tags
+
+
+class CacheNamespace:
+    """A named part of the cache with its own TTL and tiers"""
+
+    def __init__(self, cache, name, ttl, disk=False, copy_on_read=False, directory=None, stale_ttl=0,
+                 lock_timeout=60, serializer='pickle', frozen=False, max_memory_bytes=None):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.disk = disk
+        self.copy_on_read = copy_on_read
+        self.serializer = get_serializer(serializer)
+        self.frozen = frozen
+        if frozen and copy_on_read:
+            raise ValueError(f"Cache namespace {name} cannot be both frozen and copy_on_read")
+        if frozen and not hasattr(self.serializer, 'freeze'):
+            raise ValueError(f"Cache serializer {self.serializer.name} cannot freeze values")
+        self.max_memory_bytes = max_memory_bytes
+        self.memory_bytes = 0
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+        self.directory = os.path.join(cache.cache_dir, directory or name) if disk else None
+        # Implicit tag of every entry, bumped by clear()
+        self.tag = f"namespace:{name}"
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.corrupt = 0
+        self.sets = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_evictions = 0
+        self.metrics = CacheMetrics()
+
+    def _path(self, key):
+        """Disk file of a key"""
+        return os.path.join(self.directory, f"{hashlib.md5(str(key).encode()).hexdigest()}.pkl")
+
+    def _index_path(self, path):
+        """Path of a disk file as recorded in the index (relative to the cache root)"""
+        return os.path.relpath(path, self.cache.cache_dir)
+
+    def _load(self, entry):
+        """Value of a memory entry as returned to callers"""
+        return entry.serializer.loads(entry.payload) if entry.payload is not None else entry.value
+
+    def _count(self, counter):
+        with self.cache._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _lookup(self, key):
+        """
+        Find a key in memory, then on disk. Fresh hits are counted.
+
+        Returns:
+            Tuple (value, stale): value is _MISSING when absent, stale is True
+            for a value past its TTL but within stale_ttl
+        """
+        started = time.perf_counter()
+        entry, stale = self.cache._memory_get(self, key)
+        if entry is not None and entry.tags and self.cache._sync_invalidations():
+            # Another process invalidated tags since the last check: the entry may be gone
+            entry, stale = self.cache._memory_get(self, key)
+        if entry is not None:
+            value = self._load(entry)
+            if not stale:
+                self._count('hits')
+                self.metrics.record_latency('memory_hit', time.perf_counter() - started)
+            return value, stale
+
+        if self.disk:
+            value, stale = self._disk_get(key)
+            if value is not _MISSING and not stale:
+                self._count('disk_hits')
+                self.metrics.record_latency('disk_hit', time.perf_counter() - started)
+            return value, stale
+
+        return _MISSING, False
+
+    def get(self, key, default=None):
+        """Get a value (memory tier first, then disk), or default when missing or expired"""
+        value, stale = self._lookup(key)
+        if value is _MISSING or stale:
+            self._count('misses')
+            self.metrics.record_miss(key)
+            return default
+        return value
+
+    def get_or_compute(self, key, compute, should_cache=None, tags=None):
+        """
+        Get a value, computing and storing it on a miss. Concurrent misses for
+        the key wait for the first caller's result instead of computing it too;
+        while a stale value is available, they get it without waiting.
+
+        Args:
+            key: Cache key
+            compute: Callable returning the value
+            should_cache: Optional callable telling whether a computed value is stored
+            tags: Optional tags of the stored value, or a callable returning
+                them from the computed value (see set)
+
+        Returns:
+            The cached or computed value
+        """
+        value, stale = self._lookup(key)
+        if value is not _MISSING and not stale:
+            return value
+
+        flight = _Flight(self, key)
+        if value is not _MISSING:
+            # Stale: one caller revalidates, the others keep using the stale value
+            if not flight.acquire(0):
+                self._count('stale_hits')
+                return value
+        elif not flight.acquire(self.lock_timeout):
+            logger.warning(f"Timed out waiting for cache {self.name} key {key}, computing it anyway")
+            flight = None
+
+        if flight is not None:
+            # Another caller (thread or process) may have stored it in the meantime
+            value, stale = self._lookup(key)
+            if value is not _MISSING and not stale:
+                self._count('coalesced')
+                flight.release()
+                return value
+
+        try:
+            self._count('misses')
+            self.metrics.record_miss(key)
+            # Read before computing: a tag invalidated (or a clear) meanwhile keeps the result out of the cache
+            generation = self.cache.tag_generation()
+            started = time.perf_counter()
+            result = compute()
+            self.metrics.record_latency('compute', time.perf_counter() - started)
+            if should_cache is None or should_cache(result):
+                if self.frozen:
+                    # Every caller, this one included, gets the shared read-only value
+                    result = self.serializer.freeze(result)
+                self.set(key, result, tags=tags(result) if callable(tags) else tags, generation=generation)
+            return result
+        finally:
+            if flight is not None:
+                flight.release()
+
+    def _disk_get(self, key):
+        """Read a key from the disk tier and promote it to memory (see _lookup)"""
+        path = self._path(key)
+        now = time.time()
+
+        def load(expires_at, serializer_code, tags, payload):
+            if now > expires_at + self.stale_ttl:
+                return expires_at, None, _MISSING, None, 0, tags
+            serializer = serializer_for_code(serializer_code)
+            if serializer is None:
+                raise ValueError(f"unknown serializer code {serializer_code}")
+            value = serializer.loads(payload)
+            if self.frozen:
+                value = self.serializer.freeze(value)
+                return expires_at, serializer, value, None, self.serializer.memory_size(value), tags
+            # The memory tier keeps the bytes of copy_on_read values
+            kept = payload if self.copy_on_read else None
+            return expires_at, serializer, value, kept, len(payload), tags
+
+        try:
+            entry = read_entry(path, load)
+        except FileNotFoundError:
+            return _MISSING, False
+        except OSError as e:
+            logger.error(f"Error reading cache file {path}: {str(e)}")
+            return _MISSING, False
+        except Exception as e:
+            logger.error(f"Error loading cache file {path}: {str(e)}")
+            return _MISSING, False
+
+        if entry is None:
+            # Partial, corrupted or older format: a miss, and the file goes
+            self._count('corrupt')
+            logger.warning(f"Discarding invalid cache file {path}")
+            _remove_file(path)
+            self.cache._update_index('remove', [self._index_path(path)])
+            return _MISSING, False
+
+        expires_at, serializer, value, payload, size, tags = entry
+        if value is _MISSING:
+            self._count('expirations')
+            _remove_file(path)
+            self.cache._update_index('remove', [self._index_path(path)])
+            return _MISSING, False
+
+        self.cache._update_index('record_access', self._index_path(path))
+        self.cache._memory_put(self, key, value, payload, expires_at, size=size, serializer=serializer, tags=tags)
+        return value, now > expires_at
+
+    def set(self, key, value, tags=None, generation=None):
+        """
+        Store a value in memory and, for disk namespaces, on disk.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            tags: Optional tags (strings) of the entry, to drop it with every
+                other entry carrying one of them (see TieredCache.invalidate);
+                the namespace's tag is always added
+            generation: Optional tag generation read before the value was
+                computed (see TieredCache.tag_generation); the value is not
+                stored if one of its tags was invalidated, or the namespace
+                cleared, since
+
+        Returns:
+            Whether the value was stored
+        """
+        tags = tuple(sorted({str(tag) for tag in tags or ()} | {self.tag}))
+        if generation is not None and self.cache._invalidated_since(tags, generation):
+            logger.info(f"Not caching {self.name} key {key}: its tags were invalidated while it was computed")
+            return False
+        size = None
+        if self.frozen:
+            value = self.serializer.freeze(value)
+            size = self.serializer.memory_size(value)
+        payload = None
+        if self.disk or self.copy_on_read:
+            try:
+                payload = self.serializer.dumps(value)
+            except Exception as e:
+                logger.error(f"Cannot serialize value for cache {self.name}: {str(e)}")
+                return False
+            self.metrics.record_size(len(payload))
+
+        expires_at = time.time() + self.ttl
+        with self.cache._lock:
+            self.sets += 1
+        self.cache._memory_put(self, key, value, payload, expires_at, size=size, serializer=self.serializer, tags=tags)
+
+        if self.disk:
+            path = self._path(key)
+            try:
+                size = write_entry(path, payload, expires_at, self.serializer.code, tags)
+            except Exception as e:
+                logger.error(f"Error writing to cache file {path}: {str(e)}")
+                return False
+            self.cache._update_index('record_write', self.name, self._index_path(path), size,
+                                     expires_at + self.stale_ttl, tags)
+
+        if generation is not None and self.cache._invalidated_since(tags, generation):
+            # Invalidated while it was being stored
+            self.delete(key)
+            return False
+        return True
+
+    def delete(self, key):
+        """Remove a key from both tiers"""
+        removed = self.cache._memory_drop(self, key)
+        if self.disk:
+            self.cache._update_index('remove', [self._index_path(self._path(key))])
+            try:
+                os.unlink(self._path(key))
+                removed = True
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error removing cache file for {key}: {str(e)}")
+        return removed
+
+    def invalidate(self, *tags):
+        """Drop this namespace's entries carrying any of the tags (see TieredCache.invalidate)"""
+        return self.cache.invalidate(*tags, namespace=self.name)
+
+    def tag_generation(self):
+        """Current tag generation, for set (see TieredCache.tag_generation)"""
+        return self.cache.tag_generation()
+
+    def clear_memory(self, pattern=None):
+        """
+        Drop this namespace's entries from the memory tier.
+
+        Args:
+            pattern: Optional substring of the keys to drop
+
+        Returns:
+            Number of entries dropped
+        """
+        return self.cache._memory_clear(self, pattern)
+
+    def clear_expired(self):
+        """Drop this namespace's expired entries from the memory tier (they are otherwise dropped when read)"""
+        return self.cache._memory_clear(self, expired_only=True)
+
+    def clear(self):
+        """
+        Drop this namespace's entries from both tiers. The namespace's tag
+        gets a new generation first, so the other processes drop the namespace
+        from their memory tier too (see TieredCache._sync_invalidations). To
+        drop only some entries, invalidate their tags.
+
+        Returns:
+            Number of disk files removed
+        """
+        generation = self.cache._bump_tags([self.tag])
+        self.clear_memory()
+        self.cache._applied(generation)
+        if not self.disk:
+            return 0
+
+        removed = 0
+        try:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.pkl'):
+                    try:
+                        os.unlink(os.path.join(self.directory, filename))
+                        removed += 1
+                    except OSError:
+                        pass
+        except Exception as e:
+            logger.error(f"Error clearing cache {self.name}: {str(e)}")
+
+        self.cache._update_index('remove_namespace', self.name)
+        return removed
+
+    def disk_usage(self):
+        """Number of files and bytes of this namespace on disk (from the index)"""
+        if not self.disk:
+            return 0, 0
+        return self.cache._update_index('usage', self.name) or (0, 0)
+
+    def stats(self):
+        """Counters, sizes and metrics (see CacheMetrics.summary) of this namespace"""
+        items, size = self.cache._memory_usage(self)
+        disk_items, disk_size = self.disk_usage()
+        lookups = self.hits + self.disk_hits + self.stale_hits + self.misses
+        return {
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+            'disk': self.disk,
+            'serializer': self.serializer.name,
+            'frozen': self.frozen,
+            'memory_max_bytes': self.max_memory_bytes,
+            'memory_items': items,
+            'memory_bytes': size,
+            'disk_items': disk_items,
+            'disk_bytes': disk_size,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': round((self.hits + self.disk_hits + self.stale_hits) / lookups, 3) if lookups else None,
+            'sets': self.sets,
+            'evictions': self.evictions,
+            'disk_evictions': self.disk_evictions,
+            'expirations': self.expirations,
+            'corrupt': self.corrupt,
+            **self.metrics.summary()
+        }
+
+    def reset_stats(self):
+        """Zero the counters and metrics of this namespace"""
+        with self.cache._lock:
+            for counter in ('hits', 'disk_hits', 'stale_hits', 'misses', 'coalesced', 'corrupt', 'sets',
+                            'evictions', 'expirations', 'disk_evictions'):
+                setattr(self, counter, 0)
+        self.metrics.reset()
+
+
+class TieredCache:
+    """Byte-bounded LRU memory tier over a disk tier, divided into namespaces"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_memory_bytes=DEFAULT_MEMORY_MAX_BYTES,
+                 max_disk_bytes=DEFAULT_DISK_MAX_BYTES, max_disk_entries=DEFAULT_DISK_MAX_ENTRIES,
+                 eviction_policy='lru'):
+        if eviction_policy not in EVICTION_ORDERS:
+            raise ValueError(f"Unknown cache eviction policy: {eviction_policy}")
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_disk_entries = max_disk_entries
+        self.eviction_policy = eviction_policy
+        self.index = DiskIndex(os.path.join(cache_dir, INDEX_FILENAME))
+        self._namespaces = {}
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_tags = {}
+        # Last tag generation applied to the memory tier (see _sync_invalidations)
+        self._tag_generation = 0
+        self._flights = WeakValueDictionary()
+        self._lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def namespace(self, name, ttl=3600, disk=False, copy_on_read=False, directory=None, stale_ttl=0,
+                  lock_timeout=60, serializer='pickle', frozen=False, max_memory_bytes=None):
+        """
+        Get a namespace, creating it on first use (later calls return it as is).
+
+        Args:
+            name: Namespace name
+            ttl: Lifetime of the entries in seconds
+            disk: Whether entries are also kept on disk
+            copy_on_read: Whether every read returns a fresh copy
+            directory: Disk directory under the cache root (defaults to the name)
+            stale_ttl: Seconds an expired entry may still be served by
+                get_or_compute while it is recomputed (0 disables it)
+            lock_timeout: Seconds get_or_compute waits for another caller
+                computing the same key before computing it too
+            serializer: Name of the serializer of the disk and copy_on_read
+                entries (see cache_serializers), or a serializer object
+            frozen: Whether the memory tier keeps read-only values (frozen by
+                the serializer) returned to every reader as is
+            max_memory_bytes: Optional memory budget of the namespace, within
+                the memory tier's
+
+        Returns:
+            CacheNamespace
+        """
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            if namespace is None:
+                namespace = CacheNamespace(self, name, ttl, disk, copy_on_read, directory, stale_ttl, lock_timeout,
+                                           serializer, frozen, max_memory_bytes)
+                self._namespaces[name] = namespace
+            return namespace
+
+    def namespaces(self):
+        """All namespaces by name"""
+        with self._lock:
+            return dict(self._namespaces)
+
+    def _flight_lock(self, namespace, key):
+        """Thread lock coalescing the computations of one key"""
+        with self._lock:
+            lock = self._flights.get((namespace.name, key))
+            if lock is None:
+                lock = self._flights[(namespace.name, key)] = _KeyLock()
+            return lock
+
+    def _memory_get(self, namespace, key):
+        """
+        Memory entry of a key, marked most recently used.
+
+        Returns:
+            Tuple (entry or None, stale)
+        """
+        memory_key = (namespace.name, key)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(memory_key)
+            if entry is None:
+                return None, False
+            if entry.expires_at + namespace.stale_ttl <= now:
+                self._discard(memory_key)
+                namespace.expirations += 1
+                return None, False
+            self._memory.move_to_end(memory_key)
+            return entry, entry.expires_at <= now
+
+    def _memory_put(self, namespace, key, value, payload, expires_at, size=None, serializer=None, tags=()):
+        """
+        Store an entry in the memory tier and evict down to the byte budgets
+        (the namespace's, then the tier's). The serialized payload is kept
+        (instead of the value) for copy_on_read namespaces; size defaults to
+        the payload's, or to an estimate.
+        """
+        if size is None:
+            size = len(payload) if payload is not None else estimate_size(value)
+        if not namespace.copy_on_read:
+            payload = None
+
+        memory_key = (namespace.name, key)
+        with self._lock:
+            self._discard(memory_key)
+            if size > self.max_memory_bytes or (namespace.max_memory_bytes and size > namespace.max_memory_bytes):
+                return
+            self._memory[memory_key] = _MemoryEntry(value if payload is None else None, payload, serializer, size,
+                                                    expires_at, tags)
+            self._memory_bytes += size
+            namespace.memory_bytes += size
+            for tag in tags:
+                self._memory_tags.setdefault(tag, set()).add(memory_key)
+
+            if namespace.max_memory_bytes:
+                while namespace.memory_bytes > namespace.max_memory_bytes:
+                    evicted_key = next(k for k in self._memory if k[0] == namespace.name)
+                    self._discard(evicted_key)
+                    namespace.evictions += 1
+
+            while self._memory_bytes > self.max_memory_bytes:
+                evicted_key = next(iter(self._memory))
+                self._discard(evicted_key)
+                evicted_namespace = self._namespaces.get(evicted_key[0])
+                if evicted_namespace is not None:
+                    evicted_namespace.evictions += 1
+
+    def _discard(self, memory_key):
+        """Remove a memory entry (lock held)"""
+        entry = self._memory.pop(memory_key, None)
+        if entry is not None:
+            self._memory_bytes -= entry.size
+            namespace = self._namespaces.get(memory_key[0])
+            if namespace is not None:
+                namespace.memory_bytes -= entry.size
+            for tag in entry.tags:
+                keys = self._memory_tags.get(tag)
+                if keys is not None:
+                    keys.discard(memory_key)
+                    if not keys:
+                        del self._memory_tags[tag]
+        return entry is not None
+
+    def _memory_drop(self, namespace, key):
+        with self._lock:
+            return self._discard((namespace.name, key))
+
+    def _memory_clear(self, namespace, pattern=None, expired_only=False):
+        now = time.time()
+        with self._lock:
+            keys = [memory_key for memory_key, entry in self._memory.items()
+                    if memory_key[0] == namespace.name and (not pattern or pattern in str(memory_key[1]))
+                    and (not expired_only or entry.expires_at + namespace.stale_ttl <= now)]
+            for memory_key in keys:
+                self._discard(memory_key)
+            if expired_only:
+                namespace.expirations += len(keys)
+            return len(keys)
+
+    def _memory_usage(self, namespace):
+        with self._lock:
+            sizes = [entry.size for memory_key, entry in self._memory.items() if memory_key[0] == namespace.name]
+        return len(sizes), sum(sizes)
+
+    def _update_index(self, method, *args):
+        """Call a DiskIndex method; index errors are logged, never raised to cache users"""
+        try:
+            return getattr(self.index, method)(*args)
+        except Exception as e:
+            logger.error(f"Cache index {method} failed: {str(e)}")
+            return None
+
+    def _remove_entries(self, entries, counter):
+        """Delete indexed (path, namespace, size) entries, counting them on their namespaces"""
+        with self._lock:
+            namespaces = dict(self._namespaces)
+        for path, namespace_name, size in entries:
+            _remove_file(os.path.join(self.cache_dir, path))
+            namespace = namespaces.get(namespace_name)
+            if namespace is not None:
+                namespace._count(counter)
+        self.index.remove([path for path, namespace_name, size in entries])
+
+    def sweep(self):
+        """
+        Enforce the disk budget: delete the entries past their purge time, then
+        evict entries by the eviction policy until the disk tier is within
+        max_disk_bytes and max_disk_entries. Uses the index only.
+
+        Returns:
+            Dictionary with the expired and evicted counts and the remaining
+            entries and bytes
+        """
+        self.index.flush()
+        expired = self.index.expired()
+        self._remove_entries(expired, 'expirations')
+
+        entries, size = self.index.usage()
+        evicted = 0
+        while entries > self.max_disk_entries or size > self.max_disk_bytes:
+            victims = []
+            for victim in self.index.victims(self.eviction_policy, max(entries - self.max_disk_entries, 20)):
+                if entries <= self.max_disk_entries and size <= self.max_disk_bytes:
+                    break
+                victims.append(victim)
+                entries -= 1
+                size -= victim[2]
+            if not victims:
+                break
+            self._remove_entries(victims, 'disk_evictions')
+            evicted += len(victims)
+
+        if expired or evicted:
+            logger.info(f"Cache sweep removed {len(expired)} expired and {evicted} evicted entries "
+                        f"({entries} entries, {size / (1024 * 1024):.1f} MB left)")
+        return {'expired': len(expired), 'evicted': evicted, 'entries': entries, 'bytes': size}
+
+    def reindex(self):
+        """
+        Rebuild the index of every disk namespace from the files (reading only
+        their headers and tags), dropping invalid entries and leftover temporary and
+        lock files. For startup and occasional maintenance; stats() and
+        sweep() rely on the index alone.
+
+        Returns:
+            Number of indexed entries
+        """
+        now = time.time()
+        indexed = 0
+        for namespace in self.namespaces().values():
+            if not namespace.disk:
+                continue
+            entries = []
+            tags = []
+            try:
+                files = list(os.scandir(namespace.directory))
+            except OSError:
+                continue
+            for entry in files:
+                try:
+                    if entry.name.endswith('.pkl'):
+                        header = read_entry_header(entry.path)
+                        if header is None:
+                            _remove_file(entry.path)
+                            continue
+                        expires_at, entry_tags = header
+                        path = namespace._index_path(entry.path)
+                        entries.append((path, namespace.name, entry.stat().st_size,
+                                        expires_at + namespace.stale_ttl, entry.stat().st_mtime))
+                        tags.extend((tag, path) for tag in entry_tags)
+                    elif entry.name.endswith(TEMP_SUFFIX) and now - entry.stat().st_mtime > ORPHAN_FILE_AGE:
+                        _remove_file(entry.path)
+                    elif entry.name.endswith('.lock') and now - entry.stat().st_mtime > ORPHAN_FILE_AGE:
+                        _remove_lock_file(entry.path)
+                except OSError:
+                    continue
+            self.index.replace_namespace(namespace.name, entries, tags)
+            indexed += len(entries)
+        return indexed
+
+    def tag_generation(self):
+        """
+        Current tag generation: read it before computing a value and pass it
+        to CacheNamespace.set, which then skips values whose tags were
+        invalidated meanwhile. None when the index cannot be read.
+        """
+        return self._update_index('generation')
+
+    def _invalidated_since(self, tags, generation):
+        """Whether any of the tags was invalidated after a generation"""
+        current = self._update_index('generation', tags)
+        return current is not None and current > generation
+
+    def _sync_invalidations(self):
+        """
+        Drop from the memory tier the entries carrying tags invalidated (by
+        any process) since the last check.
+
+        Returns:
+            Number of memory entries dropped
+        """
+        current = self._update_index('generation')
+        with self._lock:
+            last = self._tag_generation
+        if current is None or current <= last:
+            return 0
+        invalidated = self._update_index('invalidated_since', last)
+        if invalidated is None:
+            return 0
+
+        with self._lock:
+            memory_keys = set()
+            for tag, generation in invalidated:
+                memory_keys.update(self._memory_tags.get(tag, ()))
+            for memory_key in memory_keys:
+                self._discard(memory_key)
+            self._tag_generation = max([self._tag_generation, current] + [g for tag, g in invalidated])
+        return len(memory_keys)
+
+    def _bump_tags(self, tags):
+        """
+        Give tags a new generation (see DiskIndex.bump_tags), after applying
+        the other processes' invalidations.
+
+        Returns:
+            The new generation, or None when the index cannot be written
+        """
+        self._sync_invalidations()
+        return self._update_index('bump_tags', sorted(tags))
+
+    def _applied(self, generation):
+        """
+        Record that this process dropped what its own invalidation at a
+        generation (see _bump_tags) covers, so _sync_invalidations does not
+        drop entries stored since. Only when no other process invalidated tags
+        in between; otherwise the next sync applies both.
+        """
+        with self._lock:
+            if generation is not None and self._tag_generation == generation - 1:
+                self._tag_generation = generation
+
+    def invalidate(self, *tags, namespace=None):
+        """
+        Drop every entry carrying any of the tags, from both tiers. Only the
+        tagged entries are read: a tag map in memory, the index on disk.
+        The tags get a new generation first, so the other processes drop them
+        from their memory tier too and values computed before are not stored
+        (see _sync_invalidations and CacheNamespace.set).
+
+        Args:
+            tags: Tags to drop (see CacheNamespace.set)
+            namespace: Optional namespace name to restrict to
+
+        Returns:
+            Number of entries dropped from memory plus disk files removed
+        """
+        tags = {str(tag) for tag in tags}
+        if not tags:
+            return 0
+
+        generation = self._bump_tags(tags)
+        with self._lock:
+            memory_keys = set()
+            for tag in tags:
+                memory_keys.update(self._memory_tags.get(tag, ()))
+            if namespace is not None:
+                memory_keys = {memory_key for memory_key in memory_keys if memory_key[0] == namespace}
+            for memory_key in memory_keys:
+                self._discard(memory_key)
+        self._applied(generation)
+
+        entries = self._update_index('tagged', sorted(tags), namespace) or []
+        for path, namespace_name, size in entries:
+            _remove_file(os.path.join(self.cache_dir, path))
+        self._update_index('remove', [path for path, namespace_name, size in entries])
+
+        logger.info(f"Invalidated cache tags {', '.join(sorted(tags))}: "
+                    f"{len(memory_keys)} memory entries, {len(entries)} disk files")
+        return len(memory_keys) + len(entries)
+
+    def clear(self):
+        """Drop every namespace's entries from both tiers"""
+        return sum(namespace.clear() for namespace in self.namespaces().values())
+
+    def reset_stats(self):
+        """Zero the counters and metrics of every namespace"""
+        for namespace in self.namespaces().values():
+            namespace.reset_stats()
+
+    def stats(self):
+        """
+        Statistics of the whole cache.
+
+        Returns:
+            Dictionary with the memory and disk tier usage and budgets, and
+            namespaces ({name: CacheNamespace.stats()})
+        """
+        with self._lock:
+            memory_bytes = self._memory_bytes
+            memory_items = len(self._memory)
+        disk_items, disk_bytes = self._update_index('usage') or (0, 0)
+        return {
+            'memory_bytes': memory_bytes,
+            'memory_max_bytes': self.max_memory_bytes,
+            'memory_items': memory_items,
+            'disk_bytes': disk_bytes,
+            'disk_max_bytes': self.max_disk_bytes,
+            'disk_items': disk_items,
+            'disk_max_items': self.max_disk_entries,
+            'eviction_policy': self.eviction_policy,
+            'namespaces': {name: namespace.stats() for name, namespace in sorted(self.namespaces().items())}
+        }
+
+
+# The application's cache
+cache = TieredCache(
+    max_memory_bytes=int(os.environ.get('CACHE_MEMORY_MAX_BYTES', DEFAULT_MEMORY_MAX_BYTES)),
+    max_disk_bytes=int(os.environ.get('CACHE_DISK_MAX_BYTES', DEFAULT_DISK_MAX_BYTES)),
+    max_disk_entries=int(os.environ.get('CACHE_DISK_MAX_ENTRIES', DEFAULT_DISK_MAX_ENTRIES)),
+    eviction_policy=os.environ.get('CACHE_EVICTION_POLICY', 'lru')
+)
@@ -0,0 +1,280 @@
+"""
+Batch builder for month-end timesheets.
+
+Produces one timesheet per department and one per housing for a month.
+Employees, attendance, leave and reference data are loaded once. The rows for
+each scope are then built in parallel worker processes, and every result is
+written to the timesheet cache. Later requests for those scopes (exports,
+minimal/elegant timesheets) are served from the cache. The first /timesheet
+page of each scope is a separate cache entry (page-sized, over the configured
+month period) and is built afterwards through the regular cached path.
+
+The workers are fresh interpreters running this module (python -m
+timesheet_batch) fed through pipes: nothing is forked from the calling
+process, whose other threads (requests, the scheduler) may be holding locks,
+and the workers import only the row builder, not the application.
+"""
+
+import os
+import sys
+import copy
+import time
+import pickle
+import logging
+import subprocess
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes (0 or 1 builds every scope in the calling process)
+BATCH_PROCESSES = int(os.environ.get('TIMESHEET_BATCH_PROCESSES', min(4, os.cpu_count() or 1)))
+
+
+def _slice_index(index, employee_ids):
+    """Keep only the given employees' entries of a {emp_id: ...} mapping"""
+    return {emp_id: index[emp_id] for emp_id in employee_ids if emp_id in index}
+
+
+def _build_scope(task):
+    """Worker entry point: build the rows of one scoped timesheet"""
+    from optimized_timesheet import build_employee_rows
+
+    scope, employees, dates, weekend_mask, today, attendance_index, leave_index, reference = task
+    rows = build_employee_rows(
+        employees, dates, weekend_mask, today, attendance_index, leave_index, reference
+    )
+    return scope, rows
+
+
+def _run_worker_processes(tasks, processes):
+    """
+    Build the tasks in worker processes, each given an interleaved share of
+    them through its stdin and returning its (scope, rows) through its stdout.
+
+    Returns:
+        List of (scope, rows) in the order of the tasks
+    """
+    shares = [tasks[index::processes] for index in range(min(processes, len(tasks)))]
+    workers = [
+        subprocess.Popen([sys.executable, '-m', 'timesheet_batch'], stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        for share in shares
+    ]
+    try:
+        # Workers read their whole share before building, so they all run while the others are fed
+        for worker, share in zip(workers, shares):
+            worker.stdin.write(pickle.dumps(share, protocol=pickle.HIGHEST_PROTOCOL))
+            worker.stdin.close()
+
+        results = []
+        for worker in workers:
+            output = worker.stdout.read()
+            if worker.wait() != 0:
+                raise RuntimeError(f"timesheet worker exited with code {worker.returncode}")
+            results.extend(pickle.loads(output))
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+                worker.wait()
+
+    order = {task[0]: index for index, task in enumerate(tasks)}
+    return sorted(results, key=lambda result: order[result[0]])
+
+
+def _run_tasks(tasks, processes):
+    """Run scope tasks in worker processes, or in-process when parallelism is off"""
+    if processes and processes > 1 and len(tasks) > 1:
+        try:
+            return _run_worker_processes(tasks, processes)
+        except (OSError, RuntimeError, EOFError, pickle.PickleError) as e:
+            logger.warning(f"Worker processes unavailable, building timesheets serially: {str(e)}")
+
+    # Serial fallback: copy each task so shared record dicts are not mutated twice
+    return [_build_scope(copy.deepcopy(task)) for task in tasks]
+
+
+def _worker_main():
+    """Worker process body: build the pickled tasks read from stdin, write the pickled results to stdout"""
+    output = sys.stdout.buffer
+    # Keep anything printed while importing the row builder out of the results
+    sys.stdout = sys.stderr
+    tasks = pickle.load(sys.stdin.buffer)
+    pickle.dump([_build_scope(task) for task in tasks], output, protocol=pickle.HIGHEST_PROTOCOL)
+    output.flush()
+
+
+def prime_first_pages(year, month, scopes, weekend_days, page_size=None):
+    """
+    Build the first /timesheet page of each scope into the timesheet cache.
+    The page covers the configured month period (like the /timesheet view)
+    and only page_size employees, so it is not one of the batch's full
+    timesheets: it is built through optimized_generate_timesheet.
+
+    Args:
+        year: Year of the timesheets
+        month: Month of the timesheets
+        scopes: ('department', id) or ('housing', id) scopes
+        weekend_days: Weekend days of the pages
+        page_size: Employees per page (defaults to the /timesheet page size)
+
+    Returns:
+        Number of pages built
+    """
+    from cache_warmup import DEFAULT_TIMESHEET_PAGE_SIZE
+    from enhanced_cache_optimized import cache_access_log
+    from fiscal_calendar import fiscal_calendar
+    from optimized_timesheet import optimized_generate_timesheet
+
+    period = fiscal_calendar.month_dates_config().get(int(month), {})
+    built = 0
+    # Prebuilt pages must not count as user demand
+    with cache_access_log.suppressed():
+        for kind, scope_id in scopes:
+            try:
+                optimized_generate_timesheet(
+                    year, month, scope_id if kind == 'department' else None, period.get('start'),
+                    period.get('end'), scope_id if kind == 'housing' else None,
+                    limit=page_size or DEFAULT_TIMESHEET_PAGE_SIZE, weekend_days=weekend_days
+                )
+                built += 1
+            except Exception as e:
+                logger.error(f"Error building the first {kind} {scope_id} timesheet page of {month}/{year}: {str(e)}")
+    return built
+
+
+def build_month_timesheets(year, month, weekend_days=None, processes=None, prime_cache=True):
+    """
+    Build every department and housing timesheet for a month in one pass.
+
+    Args:
+        year: Year of the timesheets
+        month: Month of the timesheets
+        weekend_days: Weekend days to use (defaults to the default user's settings)
+        processes: Number of worker processes (defaults to BATCH_PROCESSES)
+        prime_cache: Whether to write each result, and the first /timesheet
+            page of each scope (see prime_first_pages), into the timesheet cache
+
+    Returns:
+        Dictionary {('department', id) or ('housing', id): timesheet_data}
+    """
+    from database import db, read_only_session
+    from models import Employee
+    from data_versions import current_data_version
+    from enhanced_cache_optimized import timesheet_cache
+    from settings_cache import resolve_weekend_days, DEFAULT_USER_ID
+    from optimized_timesheet import (
+        TimesheetEmployee, _timesheet_employee_columns, resolve_timesheet_dates,
+        load_timesheet_reference, load_attendance_index, load_leave_index,
+        assemble_timesheet, prime_timesheet_cache
+    )
+
+    start_time = time.time()
+    year = int(year)
+    month = int(month)
+    if weekend_days is None:
+        weekend_days = resolve_weekend_days(DEFAULT_USER_ID)
+    weekend_days = tuple(sorted({int(day) for day in weekend_days}))
+    if processes is None:
+        processes = BATCH_PROCESSES
+
+    start_date, end_date, date_range = resolve_timesheet_dates(year, month)
+    dates = list(date_range.dates)
+    weekend_mask = date_range.weekend_mask(weekend_days)
+    today = date.today()
+
+    # Results whose tags are invalidated while the batch runs are not primed
+    generation = timesheet_cache.tag_generation() if prime_cache else None
+
+    # Load everything once for the whole month (read-only, on the replica when configured)
+    with read_only_session():
+        data_version = current_data_version()
+        employees = [
+            TimesheetEmployee._make(row)
+            for row in db.session.query(*_timesheet_employee_columns())
+            .filter(Employee.active == True)
+            .order_by(Employee.name, Employee.id)
+        ]
+        reference = load_timesheet_reference()
+        attendance_index = load_attendance_index(None, start_date, end_date, reference['terminal_to_housing'])
+        leave_index = load_leave_index(None, start_date, end_date)
+
+    # Partition employees by department and by housing
+    scopes = {}
+    for employee in employees:
+        if employee.department_id:
+            scopes.setdefault(('department', employee.department_id), []).append(employee)
+        if employee.housing_id:
+            scopes.setdefault(('housing', employee.housing_id), []).append(employee)
+
+    tasks = []
+    for scope, scope_employees in scopes.items():
+        employee_ids = [e.id for e in scope_employees]
+        tasks.append((
+            scope,
+            scope_employees,
+            dates,
+            weekend_mask,
+            today,
+            {key: _slice_index(attendance_index[key], employee_ids)
+             for key in ('by_employee', 'terminals', 'daily_housing', 'totals')},
+            {key: _slice_index(leave_index[key], employee_ids)
+             for key in ('vacations', 'transfers', 'exceptions')},
+            reference
+        ))
+
+    logger.info(f"Building {len(tasks)} scoped timesheets for {month}/{year} "
+                f"({len(employees)} employees, {attendance_index['count']} attendance records)")
+
+    results = {}
+    for scope, rows in _run_tasks(tasks, processes):
+        scope_employees = scopes[scope]
+        timesheet_data = assemble_timesheet(
+            year, month, dates, start_date, end_date, weekend_days, rows,
+            len(scope_employees), len(scope_employees), start_time
+        )
+        timesheet_data['has_more'] = False
+        timesheet_data['data_version'] = data_version
+        timesheet_data['pagination'] = None
+        results[scope] = timesheet_data
+
+        if prime_cache:
+            kind, scope_id = scope
+            prime_timesheet_cache(
+                timesheet_data, year, month,
+                department_id=scope_id if kind == 'department' else None,
+                housing_id=scope_id if kind == 'housing' else None,
+                weekend_days=weekend_days, generation=generation
+            )
+
+    if prime_cache:
+        prime_first_pages(year, month, results, weekend_days)
+
+    logger.info(f"Built {len(results)} scoped timesheets for {month}/{year} in {time.time() - start_time:.2f} seconds")
+    return results
+
+
+def run_scheduled_batch(app=None):
+    """
+    Scheduler entry point: prebuild the current month's scoped timesheets, and
+    the previous month's during the first days of a new month.
+    """
+    from contextlib import nullcontext
+
+    context = app.app_context() if app is not None else nullcontext()
+    with context:
+        today = date.today()
+        months = [(today.year, today.month)]
+        if today.day <= 5:
+            previous = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+            months.append(previous)
+
+        for year, month in months:
+            try:
+                build_month_timesheets(year, month)
+            except Exception as e:
+                logger.error(f"Error building batch timesheets for {month}/{year}: {str(e)}")
+
+
+if __name__ == '__main__':
+    _worker_main()
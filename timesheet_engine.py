@@ -0,0 +1,298 @@
+"""
+Timesheet engine.
+
+Every timesheet is built by TimesheetEngine: optimized_generate_timesheet,
+the streamed exports and the delta endpoint, as well as the older
+data_processor.generate_timesheet and
+optimized_data_processor.generate_optimized_timesheet entry points, which are
+now thin adapters. A build is a pipeline of stages sharing one context
+dictionary:
+
+    scope      resolve the dates, the weekend mask and the (page of) employees
+    load       bulk-load reference data, attendance and leave for those employees
+    overlay    work out each day's status (attendance, weekend, absence, leave)
+    aggregate  build the rows: totals, primary and secondary housing
+    present    group the rows and wrap them in the timesheet dictionary
+
+A stage is a callable taking the context. Pass replacements to the constructor
+to plug in a different one, e.g. TimesheetEngine(load=my_loader).
+
+Builds never write: the stages run on a read-only session (on the read replica
+when one is configured). Data repairs belong to attendance_corrections.
+"""
+
+import time
+import logging
+from contextlib import nullcontext
+from datetime import date
+
+from sqlalchemy import and_, or_
+
+from database import read_only_session
+from models import Employee
+from optimized_timesheet import (
+    TimesheetEmployee, _timesheet_employee_columns, decode_timesheet_cursor, encode_timesheet_cursor,
+    get_employee_count, resolve_timesheet_dates, load_timesheet_reference, load_attendance_index,
+    load_leave_index, overlay_employee_days, aggregate_employee_rows, assemble_timesheet
+)
+
+logger = logging.getLogger(__name__)
+
+# Stages in the order they run
+STAGES = ('scope', 'load', 'overlay', 'aggregate', 'present')
+
+# Stages building rows for a resolved scope (see TimesheetEngine.build_rows)
+ROW_STAGES = ('load', 'overlay', 'aggregate')
+
+
+def resolve_scope(context):
+    """
+    Scope stage: resolve the displayed dates and select the employees.
+
+    Reads year, month, department_id, housing_id, custom_start_date,
+    custom_end_date, limit, offset, cursor and weekend_days from the context.
+    Sets dates, date_range, weekend_mask, employees, total_employees and the
+    pagination values (has_more, next_cursor, prev_cursor).
+    """
+    from database import db
+    from data_versions import current_data_version
+
+    year = context['year'] = int(context['year'])
+    month = context['month'] = int(context['month'])
+    department_id = context.get('department_id')
+    housing_id = context.get('housing_id')
+    limit = context.get('limit')
+    offset = context.get('offset')
+
+    # Taken before loading anything, so later changes are picked up by the delta endpoint
+    context['data_version'] = current_data_version()
+
+    start_date, end_date, date_range = resolve_timesheet_dates(
+        year, month, context.get('custom_start_date'), context.get('custom_end_date')
+    )
+    context['start_date'] = start_date
+    context['end_date'] = end_date
+    context['date_range'] = date_range
+    context['dates'] = list(date_range.dates)
+    context['weekend_mask'] = date_range.weekend_mask(context['weekend_days'])
+    context['today'] = date.today()
+
+    # Get all employees to include in timesheet as column tuples (no ORM objects)
+    query = db.session.query(*_timesheet_employee_columns()).filter(Employee.active == True)
+
+    # Apply department filter if provided
+    if department_id:
+        query = query.filter(Employee.department_id == int(department_id))
+
+    # Apply Housing filter if provided
+    if housing_id:
+        query = query.filter(Employee.housing_id == int(housing_id))
+
+    # Apply pagination if specified
+    has_more = False
+    has_prev = False
+    if limit is not None:
+        position = decode_timesheet_cursor(context.get('cursor'))
+        if position:
+            cursor_name, cursor_id, direction = position
+            if direction == 'prev':
+                query = query.filter(or_(
+                    Employee.name < cursor_name,
+                    and_(Employee.name == cursor_name, Employee.id < cursor_id)
+                )).order_by(Employee.name.desc(), Employee.id.desc())
+            else:
+                query = query.filter(or_(
+                    Employee.name > cursor_name,
+                    and_(Employee.name == cursor_name, Employee.id > cursor_id)
+                )).order_by(Employee.name, Employee.id)
+        else:
+            direction = 'next'
+            query = query.order_by(Employee.name, Employee.id)
+            if offset:
+                query = query.offset(offset)
+
+        # Fetch one extra row to know whether another page exists
+        employees = [TimesheetEmployee._make(row) for row in query.limit(limit + 1)]
+        has_extra = len(employees) > limit
+        employees = employees[:limit]
+
+        if direction == 'prev':
+            employees.reverse()
+            has_prev = has_extra
+            has_more = True
+        else:
+            has_more = has_extra
+            has_prev = bool(position) or bool(offset)
+
+        # Total count comes from the per-scope cache instead of COUNT(*) per page
+        total_employees = get_employee_count(department_id, housing_id)
+    else:
+        employees = [TimesheetEmployee._make(row) for row in query.order_by(Employee.name, Employee.id)]
+        total_employees = len(employees)
+
+    next_cursor = None
+    prev_cursor = None
+    if employees:
+        if has_more:
+            next_cursor = encode_timesheet_cursor(employees[-1].name, employees[-1].id, 'next')
+        if has_prev:
+            prev_cursor = encode_timesheet_cursor(employees[0].name, employees[0].id, 'prev')
+
+    logger.info(f"Fetched {len(employees)} employees for timesheet (total: {total_employees})")
+
+    context['employees'] = employees
+    context['total_employees'] = total_employees
+    context['has_more'] = has_more
+    context['next_cursor'] = next_cursor
+    context['prev_cursor'] = prev_cursor
+
+
+def load_data(context):
+    """
+    Load stage: reference data (kept in the context, so row chunks share it),
+    then the attendance and leave of the context's employees.
+    """
+    if context.get('reference') is None:
+        context['reference'] = load_timesheet_reference()
+
+    employee_ids = [e.id for e in context['employees']]
+    context['attendance_index'] = load_attendance_index(
+        employee_ids, context['start_date'], context['end_date'], context['reference']['terminal_to_housing']
+    )
+    context['leave_index'] = load_leave_index(employee_ids, context['start_date'], context['end_date'])
+
+
+def overlay_statuses(context):
+    """Overlay stage: each employee's day statuses, with vacations, transfers and exceptions"""
+    context['employee_days'] = overlay_employee_days(
+        context['employees'], context['dates'], context['weekend_mask'], context['today'],
+        context['attendance_index'], context['leave_index']
+    )
+
+
+def aggregate_rows(context):
+    """Aggregate stage: totals and primary/secondary housing rows"""
+    context['rows'] = aggregate_employee_rows(
+        context['employees'], context['employee_days'], context['dates'],
+        context['attendance_index'], context['reference']
+    )
+
+
+def present_timesheet(context):
+    """Present stage: group the rows and build the timesheet dictionary"""
+    timesheet_data = assemble_timesheet(
+        context['year'], context['month'], context['dates'], context['start_date'], context['end_date'],
+        context['weekend_days'], context['rows'], context['total_employees'], len(context['employees']),
+        context['start_time']
+    )
+    timesheet_data['has_more'] = context['has_more']
+    timesheet_data['data_version'] = context['data_version']
+    timesheet_data['pagination'] = {
+        'limit': context.get('limit'),
+        'offset': context.get('offset'),
+        'total': context['total_employees'],
+        'next_cursor': context['next_cursor'],
+        'prev_cursor': context['prev_cursor']
+    } if context.get('limit') is not None else None
+
+    context['timesheet'] = timesheet_data
+
+
+DEFAULT_STAGES = {
+    'scope': resolve_scope,
+    'load': load_data,
+    'overlay': overlay_statuses,
+    'aggregate': aggregate_rows,
+    'present': present_timesheet
+}
+
+
+class TimesheetEngine:
+    """Build timesheets by running the scope, load, overlay, aggregate and present stages"""
+
+    def __init__(self, read_only=True, **stages):
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown timesheet stages: {', '.join(sorted(unknown))}")
+        self.stages = dict(DEFAULT_STAGES, **stages)
+        self.read_only = read_only
+
+    def _session(self):
+        """Session scope of a build: read-only unless disabled"""
+        return read_only_session() if self.read_only else nullcontext()
+
+    def new_context(self, year, month, department_id=None, custom_start_date=None, custom_end_date=None,
+                    housing_id=None, limit=None, offset=None, cursor=None, weekend_days=(4, 5)):
+        """Create the context of a build from the timesheet parameters"""
+        return {
+            'year': year,
+            'month': month,
+            'department_id': department_id,
+            'custom_start_date': custom_start_date,
+            'custom_end_date': custom_end_date,
+            'housing_id': housing_id,
+            'limit': limit,
+            'offset': offset,
+            'cursor': cursor,
+            'weekend_days': tuple(weekend_days),
+            'start_time': time.time()
+        }
+
+    def resolve(self, *args, **kwargs):
+        """
+        Run the scope stage only, for callers building rows chunk by chunk.
+
+        Returns:
+            The context, ready for build_rows
+        """
+        context = self.new_context(*args, **kwargs)
+        with self._session():
+            self.stages['scope'](context)
+        return context
+
+    def build_rows(self, context, employees=None):
+        """
+        Run the load, overlay and aggregate stages for some employees of a
+        resolved scope (all of them by default). The context is not modified,
+        except that the reference data is loaded once and kept.
+
+        Returns:
+            List of rows
+        """
+        chunk = dict(context)
+        if employees is not None:
+            chunk['employees'] = employees
+        with self._session():
+            for name in ROW_STAGES:
+                self.stages[name](chunk)
+        context['reference'] = chunk['reference']
+        return chunk['rows']
+
+    def run(self, *args, **kwargs):
+        """
+        Build a timesheet.
+
+        Args:
+            year: Year for the timesheet (string or int)
+            month: Month for the timesheet (string or int)
+            department_id: Optional department ID to filter by
+            custom_start_date: Optional custom start date ('YYYY-MM-DD')
+            custom_end_date: Optional custom end date ('YYYY-MM-DD')
+            housing_id: Optional housing ID to filter by
+            limit: Optional number of employees per page
+            offset: Optional offset (legacy pagination)
+            cursor: Optional keyset cursor (see encode_timesheet_cursor)
+            weekend_days: Weekend days (Python weekday numbers)
+
+        Returns:
+            Dictionary with timesheet data
+        """
+        context = self.new_context(*args, **kwargs)
+        with self._session():
+            for name in STAGES:
+                self.stages[name](context)
+        return context['timesheet']
+
+
+# Engine with the default stages, used by every timesheet entry point
+default_engine = TimesheetEngine()
@@ -0,0 +1,187 @@
+"""
+Spreadsheet (CSV and XLSX) timesheet exports for payroll.
+
+Both formats are written row by row while the response is sent: rows come
+from iter_employee_timesheets, which builds a chunk of employees at a time, so
+memory stays constant whatever the size of the workforce.
+
+The XLSX file is a minimal SpreadsheetML package written through a
+non-seekable zip stream with inline strings, so bytes can be sent as soon as
+the first rows are compressed.
+"""
+
+import io
+import re
+import csv
+import zipfile
+import logging
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# Rows written between two flushes to the client
+EXPORT_FLUSH_ROWS = 100
+
+# Leading columns before one column per day
+EXPORT_EMPLOYEE_COLUMNS = ('Employee Code', 'Name', 'Profession', 'Department', 'Housing')
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Timesheet" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _hours(value):
+    """Show whole hours without decimals, like the timesheet templates"""
+    value = value or 0
+    return int(value) if value == int(value) else round(value, 1)
+
+
+def timesheet_header(timesheet_info):
+    """Build the header row: employee columns, one column per day, then totals"""
+    return (list(EXPORT_EMPLOYEE_COLUMNS)
+            + [day.isoformat() for day in timesheet_info.get('dates', [])]
+            + ['Regular Hours', 'Overtime Hours'])
+
+
+def timesheet_row(row):
+    """Flatten an employee row into spreadsheet values (one status per day)"""
+    return ([row.get('emp_code') or '', row.get('name') or '', row.get('profession') or '',
+             row.get('department') or '', row.get('housing') or '']
+            + [day['status'] for day in row['attendance']]
+            + [_hours(row.get('total_work_hours')), _hours(row.get('total_overtime_hours'))])
+
+
+def stream_csv(timesheet_info, rows):
+    """
+    Generate a CSV export chunk by chunk.
+
+    Args:
+        timesheet_info: Timesheet header from iter_employee_timesheets
+        rows: Employee rows from iter_employee_timesheets
+
+    Yields:
+        UTF-8 encoded chunks (with a BOM so Excel reads Arabic names correctly)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    buffer.write('\ufeff')
+    writer.writerow(timesheet_header(timesheet_info))
+    for count, row in enumerate(rows, 1):
+        writer.writerow(timesheet_row(row))
+        if count % EXPORT_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _StreamBuffer:
+    """Write-only file object collecting what zipfile writes until it is taken"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _xlsx_cell(value):
+    """Build one worksheet cell (numbers as numbers, everything else as inline text)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_INVALID_XML_CHARS.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+def stream_xlsx(timesheet_info, rows):
+    """
+    Generate an XLSX export chunk by chunk.
+
+    Args:
+        timesheet_info: Timesheet header from iter_employee_timesheets
+        rows: Employee rows from iter_employee_timesheets
+
+    Yields:
+        Chunks of the zipped workbook
+    """
+    buffer = _StreamBuffer()
+
+    # zipfile writes data descriptors instead of seeking back on unseekable streams
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES_XML)
+        archive.writestr('_rels/.rels', _ROOT_RELS_XML)
+        archive.writestr('xl/workbook.xml', _WORKBOOK_XML)
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS_XML)
+        yield buffer.take()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         '<sheetData>').encode('utf-8'))
+            sheet.write(_xlsx_row(timesheet_header(timesheet_info)).encode('utf-8'))
+            for count, row in enumerate(rows, 1):
+                sheet.write(_xlsx_row(timesheet_row(row)).encode('utf-8'))
+                if count % EXPORT_FLUSH_ROWS == 0:
+                    data = buffer.take()
+                    if data:
+                        yield data
+            sheet.write('</sheetData></worksheet>'.encode('utf-8'))
+
+    yield buffer.take()
+
+
+def export_filename(timesheet_info, extension):
+    """Build the download file name, e.g. timesheet_2025_05.csv"""
+    return f"timesheet_{timesheet_info.get('year')}_{int(timesheet_info.get('month') or 0):02d}.{extension}"
@@ -0,0 +1,450 @@
+"""
+Compact value types for timesheet data.
+
+A cached month holds one row per employee (plus secondary housing rows), one
+cell per day and most cells point at an attendance record. As dictionaries
+these dominate the memory and the pickle size and latency of the timesheet
+caches, so they are stored compactly instead:
+
+- rows and records are __slots__ classes (no per-instance __dict__), pickled
+  as (class, values) so attribute names are not repeated for every object;
+- a row's days are a TimesheetDays struct of arrays: the dates and weekend
+  flags are shared by every row of the timesheet, and only the statuses and
+  records are stored per row. Day cells (TimesheetCell) are lightweight views
+  created while iterating, never stored;
+- statuses, terminal aliases, housing and department names are interned, so
+  every occurrence shares one string and a pickle writes it once.
+
+Everything still reads like the dictionaries it replaces (row['name'],
+row.get('housing'), day['status'], 'record' in day), so templates and existing
+code keep working through either attribute or item access.
+
+Cached timesheets are shared by every request of a process, so they are
+frozen (freeze_timesheet): rows, days and records become read-only in place,
+lists become tuples and dictionaries FrozenDicts. Code that decorates rows
+wraps them in an Overlay, which adds or replaces fields without copying.
+"""
+
+import sys
+
+
+def intern_text(value):
+    """Intern a string so repeated values share one object (None and non-strings pass through)"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class SlotValue:
+    """Base of the timesheet value types: named fields readable like a dictionary"""
+
+    __slots__ = ()
+
+    # Names of the fields, in constructor order (the __slots__ by default)
+    fields = ()
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.fields else default
+
+    def keys(self):
+        return self.fields
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.fields]
+
+    def to_dict(self):
+        """Plain dictionary copy (nested values are not converted)"""
+        return dict(self.items())
+
+    def __eq__(self, other):
+        # Frozen and mutable values of a type compare equal
+        if not isinstance(other, SlotValue) or other.fields != self.fields:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.fields)
+
+    __hash__ = None
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.fields)
+        return f"{self.__class__.__name__}({values})"
+
+
+class SlotRecord(SlotValue):
+    """SlotValue whose fields are its __slots__, pickled as (class, values)"""
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return self.__class__, tuple([getattr(self, name) for name in self.fields])
+
+
+class TimesheetRecord(SlotRecord):
+    """Attendance record columns rendered by the timesheet (see TIMESHEET_ATTENDANCE_FIELDS)"""
+
+    __slots__ = fields = ('id', 'employee_id', 'date', 'clock_in', 'clock_out', 'work_hours', 'overtime_hours',
+                          'attendance_status', 'terminal_alias_in', 'terminal_alias_out', 'terminal_id_in',
+                          'terminal_id_out', 'sync_status')
+
+    def __init__(self, id=None, employee_id=None, date=None, clock_in=None, clock_out=None, work_hours=0,
+                 overtime_hours=0, attendance_status=None, terminal_alias_in=None, terminal_alias_out=None,
+                 terminal_id_in=None, terminal_id_out=None, sync_status=None):
+        self.id = id
+        self.employee_id = employee_id
+        self.date = date
+        self.clock_in = clock_in
+        self.clock_out = clock_out
+        self.work_hours = work_hours
+        self.overtime_hours = overtime_hours
+        self.attendance_status = attendance_status
+        self.terminal_alias_in = terminal_alias_in
+        self.terminal_alias_out = terminal_alias_out
+        self.terminal_id_in = terminal_id_in
+        self.terminal_id_out = terminal_id_out
+        self.sync_status = sync_status
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Build a record from a TIMESHEET_ATTENDANCE_FIELDS tuple, interning the repeated strings"""
+        (record_id, employee_id, record_date, clock_in, clock_out, work_hours, overtime_hours,
+         attendance_status, terminal_alias_in, terminal_alias_out, terminal_id_in, terminal_id_out) = columns
+        return cls(record_id, employee_id, record_date, clock_in, clock_out, work_hours, overtime_hours,
+                   intern_text(attendance_status), intern_text(terminal_alias_in), intern_text(terminal_alias_out),
+                   intern_text(terminal_id_in), intern_text(terminal_id_out))
+
+
+class TimesheetCell(SlotValue):
+    """View of one day of a TimesheetDays: date, status, record and weekend flag"""
+
+    __slots__ = ('days', 'index')
+    fields = ('date', 'status', 'record', 'is_weekend')
+
+    def __init__(self, days, index):
+        self.days = days
+        self.index = index
+
+    @property
+    def date(self):
+        return self.days.dates[self.index]
+
+    @property
+    def is_weekend(self):
+        return self.days.weekend_mask[self.index]
+
+    @property
+    def status(self):
+        return self.days.statuses[self.index]
+
+    @status.setter
+    def status(self, value):
+        self.days.statuses[self.index] = intern_text(value)
+
+    @property
+    def record(self):
+        return self.days.records[self.index]
+
+    @record.setter
+    def record(self, value):
+        self.days.records[self.index] = value
+
+    def __reduce__(self):
+        return self.__class__, (self.days, self.index)
+
+
+class TimesheetDays:
+    """
+    One employee's days as a struct of arrays aligned with the timesheet dates.
+    Indexing and iterating give TimesheetCell views; setting a view's status or
+    record updates the arrays.
+    """
+
+    __slots__ = ('dates', 'weekend_mask', 'statuses', 'records')
+
+    def __init__(self, dates, weekend_mask, statuses, records):
+        self.dates = dates
+        self.weekend_mask = weekend_mask
+        self.statuses = statuses
+        self.records = records
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TimesheetCell(self, i) for i in range(len(self.statuses))[index]]
+        if index < 0:
+            index += len(self.statuses)
+        if not 0 <= index < len(self.statuses):
+            raise IndexError(index)
+        return TimesheetCell(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.statuses)):
+            yield TimesheetCell(self, index)
+
+    def __bool__(self):
+        return bool(self.statuses)
+
+    def __eq__(self, other):
+        if not isinstance(other, TimesheetDays):
+            return NotImplemented
+        return (tuple(self.dates) == tuple(other.dates) and tuple(self.weekend_mask) == tuple(other.weekend_mask)
+                and tuple(self.statuses) == tuple(other.statuses) and tuple(self.records) == tuple(other.records))
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return self.__class__, (self.dates, self.weekend_mask, self.statuses, self.records)
+
+    def __repr__(self):
+        return f"TimesheetDays({len(self)} days)"
+
+
+class TimesheetRow(SlotRecord):
+    """One timesheet line: an employee in their primary housing or in a secondary one"""
+
+    __slots__ = fields = ('id', 'emp_code', 'name', 'name_ar', 'profession', 'department', 'housing',
+                          'housing_id', 'attendance', 'terminal_alias_in', 'devices', 'total_work_hours',
+                          'total_overtime_hours', 'is_primary')
+
+    def __init__(self, id, emp_code, name, name_ar, profession, department, housing, housing_id, attendance,
+                 terminal_alias_in, devices, total_work_hours, total_overtime_hours, is_primary):
+        self.id = id
+        self.emp_code = emp_code
+        self.name = name
+        self.name_ar = name_ar
+        self.profession = intern_text(profession)
+        self.department = intern_text(department)
+        self.housing = intern_text(housing)
+        self.housing_id = housing_id
+        self.attendance = attendance
+        self.terminal_alias_in = terminal_alias_in
+        self.devices = devices
+        self.total_work_hours = total_work_hours
+        self.total_overtime_hours = total_overtime_hours
+        self.is_primary = is_primary
+
+
+# Rough memory of the values a record points to (clock in/out datetimes and
+# hour floats; the other fields are small ints or shared interned strings)
+RECORD_VALUES_BYTES = 2 * 48 + 2 * 24
+
+# Rough memory of the values a row points to (code, names, devices, totals)
+ROW_VALUES_BYTES = 400
+
+
+class FrozenValue:
+    """Mixin making a timesheet value read-only"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise TypeError(f"{self.__class__.__name__} is frozen: wrap it in an Overlay to change it")
+
+    __delattr__ = __setattr__
+
+
+class FrozenTimesheetRecord(FrozenValue, TimesheetRecord):
+    """Read-only TimesheetRecord (pickled and copied as a mutable one)"""
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return TimesheetRecord, tuple([getattr(self, name) for name in self.fields])
+
+
+class FrozenTimesheetDays(FrozenValue, TimesheetDays):
+    """Read-only TimesheetDays: statuses and records are tuples (pickled and copied as a mutable one)"""
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return TimesheetDays, (self.dates, self.weekend_mask, list(self.statuses), list(self.records))
+
+
+class FrozenTimesheetRow(FrozenValue, TimesheetRow):
+    """Read-only TimesheetRow (pickled and copied as a mutable one)"""
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return TimesheetRow, tuple([getattr(self, name) for name in self.fields])
+
+
+def _frozen(*args, **kwargs):
+    raise TypeError("FrozenDict is frozen: copy it (dict(value)) or wrap it in an Overlay to change it")
+
+
+class FrozenDict(dict):
+    """Read-only dictionary (pickled and copied as a plain dict)"""
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = _frozen
+    clear = pop = popitem = setdefault = update = _frozen
+    __ior__ = _frozen
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+def freeze_value(value):
+    """Read-only version of a plain value: dicts, lists and sets are converted recursively"""
+    if type(value) is dict:
+        return FrozenDict((key, freeze_value(item)) for key, item in value.items())
+    if type(value) is list:
+        return tuple([freeze_value(item) for item in value])
+    if type(value) is set:
+        return frozenset(value)
+    return value
+
+
+def _freeze_days(days, axes):
+    """Make a TimesheetDays read-only in place (axes shares one tuple per dates and mask object)"""
+    for name in ('dates', 'weekend_mask'):
+        axis = getattr(days, name)
+        if type(axis) is not tuple:
+            if id(axis) not in axes:
+                axes[id(axis)] = (axis, tuple(axis))
+            setattr(days, name, axes[id(axis)][1])
+    records = days.records
+    for record in records:
+        if type(record) is TimesheetRecord:
+            record.__class__ = FrozenTimesheetRecord
+    days.statuses = tuple(days.statuses)
+    days.records = tuple(records)
+    days.__class__ = FrozenTimesheetDays
+
+
+def _freeze_row(row, axes):
+    """Make a TimesheetRow, and its days and records, read-only in place"""
+    if type(row.attendance) is TimesheetDays:
+        _freeze_days(row.attendance, axes)
+    if type(row.devices) in (list, set):
+        row.devices = tuple(row.devices)
+    row.__class__ = FrozenTimesheetRow
+
+
+def freeze_timesheet(timesheet):
+    """
+    Make a timesheet read-only, to share it between readers without copies.
+
+    Rows, days and records are frozen in place (their class is switched, no
+    copy is made); the dictionary and the lists around them are rebuilt as
+    FrozenDicts and tuples. Frozen values pickle and deepcopy to mutable ones.
+
+    Args:
+        timesheet: Timesheet dictionary (rows in 'employees' and 'housing_groups')
+
+    Returns:
+        FrozenDict of the timesheet (values other than dictionaries as is)
+    """
+    if type(timesheet) is not dict:
+        return timesheet
+
+    axes = {}
+    frozen = {}
+    for key, value in timesheet.items():
+        if key == 'employees' and isinstance(value, (list, tuple)):
+            for row in value:
+                if type(row) is TimesheetRow:
+                    _freeze_row(row, axes)
+            frozen[key] = tuple(value)
+        elif key == 'housing_groups' and isinstance(value, dict):
+            for rows in value.values():
+                for row in rows:
+                    if type(row) is TimesheetRow:
+                        _freeze_row(row, axes)
+            frozen[key] = FrozenDict((name, tuple(rows)) for name, rows in value.items())
+        else:
+            frozen[key] = freeze_value(value)
+    return FrozenDict(frozen)
+
+
+def timesheet_memory_size(timesheet):
+    """
+    Approximate memory size of a timesheet in bytes: its rows, their days and
+    records, and what they point to (shared days and records counted once).
+    """
+    size = sys.getsizeof(timesheet)
+    rows = timesheet.get('employees') or () if isinstance(timesheet, dict) else ()
+    seen = set()
+    for row in rows:
+        size += sys.getsizeof(row) + ROW_VALUES_BYTES
+        days = getattr(row, 'attendance', None)
+        if not isinstance(days, TimesheetDays) or id(days) in seen:
+            continue
+        seen.add(id(days))
+        size += sys.getsizeof(days) + sys.getsizeof(days.statuses) + sys.getsizeof(days.records)
+        for record in days.records:
+            if record is not None and id(record) not in seen:
+                seen.add(id(record))
+                size += sys.getsizeof(record) + RECORD_VALUES_BYTES
+    for key, value in timesheet.items() if isinstance(timesheet, dict) else ():
+        if key not in ('employees', 'housing_groups'):
+            size += sys.getsizeof(value)
+            if isinstance(value, (list, tuple)):
+                size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class Overlay:
+    """
+    View of a row or a day cell with fields added or replaced, without copying
+    it (for decorating the frozen rows of a cached timesheet). Reads like the
+    value itself; setting a field sets it on the overlay only.
+    """
+
+    __slots__ = ('value', 'overrides')
+
+    def __init__(self, value, **overrides):
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'overrides', overrides)
+
+    def __getattr__(self, name):
+        overrides = object.__getattribute__(self, 'overrides')
+        if name in overrides:
+            return overrides[name]
+        return getattr(object.__getattribute__(self, 'value'), name)
+
+    def __setattr__(self, name, value):
+        self.overrides[name] = value
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.value[key]
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.value
+
+    def get(self, key, default=None):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.value.get(key, default)
+
+    def keys(self):
+        return tuple(self.value.keys()) + tuple(key for key in self.overrides if key not in self.value)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """Plain dictionary copy (nested values are not converted)"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Overlay({self.value!r}, {self.overrides!r})"